@@ -0,0 +1,123 @@
+import os
+import asyncio
+import multiprocessing
+import concurrent.futures
+from typing import Any, Callable, Dict, List, Optional
+
+import analysis_worker
+
+
+class AnalysisExecutor:
+    """
+    Execution layer for the analysis pipeline
+    CPU work runs on worker shards (one process each by default) and
+    database writes run on a single dedicated thread, so the event loop
+    only coordinates. A stream stays on the shard it was first assigned
+    to, which keeps its analyzer and predictor history consistent
+    """
+
+    def __init__(self, workers: Optional[int] = None, mode: Optional[str] = None):
+        self.mode = mode or os.getenv("ANALYSIS_EXECUTOR", "process")
+        self.workers = max(1, workers or int(os.getenv("ANALYSIS_WORKERS", os.cpu_count() or 1)))
+
+        if self.mode == "thread":
+            self._shards = [
+                concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"analysis-{i}")
+                for i in range(self.workers)
+            ]
+        elif self.mode == "process":
+            context = multiprocessing.get_context("spawn")
+            self._shards = [
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=context,
+                    initializer=analysis_worker.init_worker
+                )
+                for _ in range(self.workers)
+            ]
+        else:
+            raise ValueError(f"Unknown ANALYSIS_EXECUTOR mode: {self.mode}")
+
+        self._db = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-reader")
+        self._assignments: Dict[str, int] = {}
+        self._in_flight: List[int] = [0] * self.workers
+        self._db_reads_pending = 0
+        self._memory: List[Dict[str, int]] = [{} for _ in range(self.workers)]
+
+    def _shard_for(self, stream_id: str) -> int:
+        """Sticky assignment of streams to the shard with the fewest streams"""
+        shard = self._assignments.get(stream_id)
+        if shard is None:
+            load = [0] * self.workers
+            for assigned in self._assignments.values():
+                load[assigned] += 1
+            shard = load.index(min(load))
+            self._assignments[stream_id] = shard
+        return shard
+
+    async def _submit(self, shard: int, fn: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        self._in_flight[shard] += 1
+        try:
+            return await loop.run_in_executor(self._shards[shard], fn, *args)
+        finally:
+            self._in_flight[shard] -= 1
+
+    async def analyze_batch(self, stream_id: str, frame_numbers: List[int], frames: List,
+                            camera: Optional[Dict] = None, timestamps: Optional[List[float]] = None) -> List:
+        """Analyze a batch of a stream's frames on its worker shard"""
+        shard = self._shard_for(stream_id)
+        return await self._submit(
+            shard, analysis_worker.analyze_batch, stream_id, frame_numbers, frames, camera, timestamps
+        )
+
+    async def release(self, stream_id: str):
+        """Free a finished stream's worker-side state"""
+        shard = self._assignments.pop(stream_id, None)
+        if shard is not None:
+            await self._submit(shard, analysis_worker.release_stream, stream_id)
+
+    async def get_memory_usage(self, timeout: float = 1.0) -> Dict:
+        """
+        Per-stream history bytes across all workers
+        A shard that is busy past the timeout, or has failed, reports its
+        last known figure
+        """
+        async def query(shard: int):
+            try:
+                usage = await asyncio.wait_for(
+                    self._submit(shard, analysis_worker.get_memory_usage), timeout
+                )
+                self._memory[shard] = usage
+            except Exception:
+                pass
+
+        await asyncio.gather(*(query(shard) for shard in range(self.workers)))
+        streams = {stream_id: size for usage in self._memory for stream_id, size in usage.items()}
+        return {
+            'history_bytes': sum(streams.values()),
+            'streams': streams
+        }
+
+    async def run_db(self, fn: Callable, *args) -> Any:
+        """Run a blocking database read on the dedicated reader thread"""
+        loop = asyncio.get_running_loop()
+        self._db_reads_pending += 1
+        try:
+            return await loop.run_in_executor(self._db, fn, *args)
+        finally:
+            self._db_reads_pending -= 1
+
+    def get_stats(self) -> Dict:
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'streams': len(self._assignments),
+            'in_flight': list(self._in_flight),
+            'db_reads_pending': self._db_reads_pending
+        }
+
+    def shutdown(self):
+        for shard in self._shards:
+            shard.shutdown(wait=True, cancel_futures=True)
+        self._db.shutdown(wait=True)
@@ -0,0 +1,102 @@
+"""
+Entry points executed inside analysis worker processes
+Every worker keeps its own components per stream, so a stream's
+detection and prediction history lives in exactly one process
+"""
+
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from crowd_agent import CrowdAnalyzer
+from detectors import create_detector
+from risk_predictor import PredictionSpill, RiskPredictor
+from safety_actions import SafetyActionManager
+
+_streams: Dict[str, Dict] = {}
+_safety_manager = None
+# Detectors reuse their input tensors, so each worker thread gets its own
+_local = threading.local()
+
+
+def init_worker():
+    """Process pool initializer: build the shared components once"""
+    global _safety_manager
+    _safety_manager = SafetyActionManager()
+
+
+def _get_detector():
+    """The model is loaded once per worker and shared by its streams"""
+    detector = getattr(_local, 'detector', None)
+    if detector is None:
+        detector = _local.detector = create_detector()
+    return detector
+
+
+def _get_stream(stream_id: str, camera: Optional[Dict] = None) -> Dict:
+    stream = _streams.get(stream_id)
+    if stream is None:
+        spill = None
+        if os.getenv("PREDICTION_SPILL", "false").lower() == "true":
+            spill = PredictionSpill(stream_id)
+        camera = dict(camera or {})
+        venue = camera.pop('venue', None)
+        stream = {
+            'crowd_analyzer': CrowdAnalyzer(_get_detector(), **camera),
+            'risk_predictor': RiskPredictor(spill=spill),
+            'venue': venue,
+            'safety_level': None
+        }
+        _streams[stream_id] = stream
+    return stream
+
+
+def analyze_batch(stream_id: str, frame_numbers: Sequence[int], frames: Sequence,
+                  camera: Optional[Dict] = None,
+                  timestamps: Optional[Sequence[float]] = None) -> List[Tuple[Dict, Dict, Dict]]:
+    """
+    Run batched detection, then risk prediction and action planning per frame
+    camera holds CrowdAnalyzer calibration and the venue [lat, lng] safety
+    units are placed around, used when the stream is first seen
+    timestamps are the frames' capture times, which drive the forecaster
+    """
+    if _safety_manager is None:
+        init_worker()
+
+    stream = _get_stream(stream_id, camera)
+    results = []
+    for analysis in stream['crowd_analyzer'].analyze_batch(frame_numbers, frames, timestamps):
+        predictions = stream['risk_predictor'].predict_risk(analysis)
+        level = analysis['risk_level']
+        actions = _safety_manager.get_actions(level, stream['venue'])
+        if stream['safety_level'] is not None and stream['safety_level'] != level:
+            # Frames where the level changes also say which units changed, and
+            # when; the cached plans themselves carry no times
+            changes = _safety_manager.get_changes(stream['safety_level'], level, stream['venue'])
+            actions = {
+                **actions,
+                'changes': {**changes, 'timestamp': datetime.fromtimestamp(analysis['timestamp']).isoformat()}
+            }
+        stream['safety_level'] = level
+        results.append((analysis, predictions, actions))
+    return results
+
+
+def get_memory_usage() -> Dict[str, int]:
+    """History bytes held per stream in this worker"""
+    return {
+        stream_id: stream['crowd_analyzer'].get_memory_usage() + stream['risk_predictor'].get_memory_usage()
+        for stream_id, stream in _streams.items()
+    }
+
+
+def release_stream(stream_id: str) -> bool:
+    """Drop a finished stream's components"""
+    stream = _streams.pop(stream_id, None)
+    if stream is None:
+        return False
+    if stream['risk_predictor'].spill is not None:
+        stream['risk_predictor'].spill.flush()
+    stream['risk_predictor'].release()
+    return True
@@ -1,12 +1,12 @@
 import os
+import re
 import uuid
 import json
 import time
 import asyncio
 import sqlite3
-import requests
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from fastapi import FastAPI, File, UploadFile, WebSocket, WebSocketDisconnect, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
@@ -15,9 +15,21 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-from crowd_agent import CrowdAnalyzer
-from risk_predictor import RiskPredictor
-from safety_actions import SafetyActionManager
+from analysis_executor import AnalysisExecutor
+from connection_manager import ConnectionManager, SubscriptionError
+from db_writer import BatchWriter
+from llm_dispatcher import LLMDispatcher
+from llm_gate import EscalationGate
+import event_store
+import rollups
+from response_cache import ResponseCache
+from retention import RetentionManager
+from risk_predictor import RISK_CATEGORIES, RISK_LEVELS, level_for_detections
+from safety_actions import ACTION_TEMPLATES
+from crowd_agent import BOX_COLUMNS, boxes_to_dicts
+from stream_scheduler import SchedulerFull, StreamJob, StreamScheduler
+from video_pipeline import SamplingPolicy, VideoFramePipeline, find_upload
+import watsonx_client
 
 app = FastAPI(title="AI Crowd Risk Predictor API", version="1.0.0")
 
@@ -31,101 +43,115 @@ app.add_middleware(
 )
 
 # Initialize components
-crowd_analyzer = CrowdAnalyzer()
-risk_predictor = RiskPredictor()
-safety_manager = SafetyActionManager()
-
-# Watsonx credentials
-API_KEY = os.getenv("WATSONX_API_KEY")
-PROJECT_ID = os.getenv("WATSONX_PROJECT_ID")
-BASE_URL = os.getenv("WATSONX_AI_URL")
-MODEL_ID = "ibm/granite-3-3-8b-instruct"
+# Analyzer, predictor and safety manager instances live in the executor's workers
+executor = AnalysisExecutor()
 
-# Watsonx: Get access token
-def get_access_token():
-    url = "https://iam.cloud.ibm.com/identity/token"
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = {
-        "apikey": API_KEY,
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey"
-    }
-    resp = requests.post(url, headers=headers, data=data)
-    return resp.json()["access_token"]
-
-# Watsonx: Make prediction
-def get_prediction(crowd_count, time_str, status):
-    token = get_access_token()
-    prompt = f"""
-    Current crowd count: {crowd_count}
-    Time: {time_str}
-    Status: {status}
-
-    Predict the situation for the next 10 minutes. 
-    Categories:
-    1. Good to go / Low crowd
-    2. Moderate crowd, no danger
-    3. Very crowded, attention needed
-    4. Stampede risk / Red alert
-    """
+async def _run_job(job: StreamJob):
+    await process_video_analysis(job)
 
-    url = f"{BASE_URL}/ml/v1/text/generation?version=2023-05-29"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    body = {
-        "input": prompt,
-        "parameters": {"decoding_method": "greedy", "max_new_tokens": 100},
-        "model_id": MODEL_ID,
-        "project_id": PROJECT_ID
-    }
+scheduler = StreamScheduler(
+    runner=_run_job,
+    max_concurrent=int(os.getenv("MAX_CONCURRENT_STREAMS", 8)),
+    max_pending=int(os.getenv("MAX_PENDING_STREAMS", 100)),
+    frame_slots=int(os.getenv("FRAME_SLOTS", executor.workers * 2))
+)
 
-    resp = requests.post(url, headers=headers, json=body)
-    return resp.json()["results"][0]["generated_text"]
+# Watsonx: async client with a cached IAM token and pooled connections
+watsonx = watsonx_client.AsyncWatsonxClient()
+MODEL_ID = "ibm/granite-3-3-8b-instruct"
+# Identical questions share one upstream call and its answer for a while
+prediction_cache = ResponseCache(cacheable=lambda verdict: verdict["source"] == "watsonx")
+COUNT_BUCKET = int(os.getenv("PREDICT_COUNT_BUCKET", 25))
+TIME_BUCKET_MINUTES = int(os.getenv("PREDICT_TIME_BUCKET", 15))
+_CLOCK_TIME = re.compile(r'^(\d{1,2}):(\d{2})')
 
-# WebSocket connections
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+def normalize_prediction_inputs(crowd_count, time_str, status) -> tuple:
+    """Bucketed crowd count, time and status used as the cache key and in the prompt"""
+    count = int(round(float(crowd_count) / COUNT_BUCKET) * COUNT_BUCKET)
+
+    text = ' '.join(str(time_str).split())
+    try:
+        moment = datetime.fromisoformat(text)
+        minute = moment.minute - moment.minute % TIME_BUCKET_MINUTES
+        text = moment.replace(minute=minute, second=0, microsecond=0, tzinfo=None).isoformat(sep=' ', timespec='minutes')
+    except ValueError:
+        match = _CLOCK_TIME.match(text)
+        if match:
+            minute = int(match.group(2)) - int(match.group(2)) % TIME_BUCKET_MINUTES
+            text = f"{int(match.group(1)):02d}:{minute:02d}"
+        else:
+            text = text.lower()
+
+    return count, text, ' '.join(str(status).split()).lower()
+
+# Watsonx: requests are queued, batched and bounded to LLM_MAX_CONCURRENT calls;
+# a late or failed answer falls back to the local risk level
+llm_dispatcher = LLMDispatcher(
+    lambda prompt, max_new_tokens: watsonx.generate(prompt, model_id=MODEL_ID, max_new_tokens=max_new_tokens)
+)
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+async def get_prediction(crowd_count, time_str, status) -> Dict:
+    crowd_count, time_str, status = key = normalize_prediction_inputs(crowd_count, time_str, status)
+    situation = {"crowd_count": crowd_count, "time": time_str, "status": status}
+    fallback = RISK_CATEGORIES[level_for_detections(crowd_count)]
+    return await prediction_cache.get_or_call(key, lambda: llm_dispatcher.submit(situation, fallback))
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+# Watsonx: streams only ask on level changes, sustained breaches and forecast disagreement
+async def ask_llm(analysis: dict, predictions: dict) -> Dict:
+    status = f"{analysis['risk_level']}, forecast {predictions['10min']['level']} in 10 minutes"
+    return await get_prediction(
+        analysis['detections'], datetime.fromtimestamp(analysis['timestamp']).strftime("%H:%M"), status
+    )
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(json.dumps(message))
-            except:
-                pass
+llm_gate = EscalationGate(ask=ask_llm)
 
+# WebSocket connections
+ALERT_LEVELS = ('overcrowd', 'stampede')
 manager = ConnectionManager()
 
 # Initialize DB
 def init_db():
-    conn = sqlite3.connect('crowd_events.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS events (
-            id TEXT PRIMARY KEY,
-            timestamp DATETIME,
-            video_filename TEXT,
-            current_risk TEXT,
-            current_confidence REAL,
-            detections INTEGER,
-            prediction_10min TEXT,
-            prediction_30min TEXT,
-            actions TEXT
-        )
-    ''')
+    conn = sqlite3.connect(event_store.DB_PATH)
+    migrated = event_store.init_db(conn, ACTION_TEMPLATES)
+    if migrated:
+        print(f"Migrated {migrated['migrated']} events to the compact layout in {migrated['seconds']}s")
+    rollups.init_rollups(conn)
     conn.commit()
     conn.close()
 
 init_db()
 
+# Rollups are updated in the same transaction as the raw events they cover
+event_encoder = event_store.EventEncoder()
+event_rollups = rollups.EventRollups()
+
+def write_events(conn: sqlite3.Connection, pending: List[tuple]):
+    try:
+        rows = event_encoder.encode(conn, pending)
+        event_store.insert_events(conn, rows)
+        event_rollups.apply(conn, rows)
+    except Exception:
+        # Ids interned in this transaction are rolled back with it
+        event_encoder.clear()
+        raise
+
+# Events are queued and inserted in batches by one long-lived connection
+event_writer = BatchWriter(write_events, db_path=event_store.DB_PATH)
+event_writer.start()
+
+# Retention runs periodically off the event loop, in short transactions
+retention_manager = RetentionManager(db_path=event_store.DB_PATH)
+retention_task: Optional[asyncio.Task] = None
+
+async def retention_loop(interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, retention_manager.run_once)
+        except Exception as e:
+            print(f"Retention error: {e}")
+        await asyncio.sleep(interval)
+
 # Routes
 @app.get("/")
 async def root():
@@ -152,124 +178,283 @@ async def upload_video(file: UploadFile = File(...)):
         return JSONResponse(status_code=500, content={"error": f"Upload failed: {str(e)}"})
 
 @app.post("/analyze-video/{file_id}")
-async def analyze_video(file_id: str):
+async def analyze_video(file_id: str, stride: Optional[int] = None, target_fps: Optional[float] = None,
+                        motion_threshold: Optional[float] = None, area_sqm: Optional[float] = None,
+                        grid_rows: Optional[int] = None, grid_cols: Optional[int] = None,
+                        use_peak_density: Optional[bool] = None, venue_lat: Optional[float] = None,
+                        venue_lng: Optional[float] = None):
     try:
-        asyncio.create_task(process_video_analysis(file_id))
+        video_path = find_upload(file_id)
+        if video_path is None:
+            return JSONResponse(status_code=404, content={"error": f"No uploaded video found for {file_id}"})
+
+        # Per-camera overrides of the SAMPLE_*/MOTION_* defaults
+        sampling = {"stride": stride, "target_fps": target_fps, "motion_threshold": motion_threshold}
+        camera = {"area_sqm": area_sqm, "use_peak_density": use_peak_density}
+        if grid_rows and grid_cols:
+            camera["grid_shape"] = (grid_rows, grid_cols)
+        if venue_lat is not None and venue_lng is not None:
+            camera["venue"] = [venue_lat, venue_lng]
+        job = scheduler.submit(file_id, video_path, {"sampling": sampling, "camera": camera})
         return {
             "file_id": file_id,
-            "status": "analysis_started",
-            "message": "Video analysis started"
+            "job_id": job.job_id,
+            "status": "analysis_queued",
+            "message": "Video analysis queued"
         }
+    except SchedulerFull as e:
+        return JSONResponse(status_code=429, content={"error": f"Too many analysis jobs: {str(e)}"})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"Analysis failed: {str(e)}"})
 
-async def process_video_analysis(file_id: str):
+@app.get("/jobs")
+async def list_jobs():
+    return {
+        "jobs": [job.to_dict() for job in scheduler.list_jobs()],
+        "scheduler": scheduler.get_stats()
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = scheduler.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job: {job_id}"})
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/boxes")
+async def get_job_boxes(job_id: str, format: str = "array", limit: Optional[int] = None):
+    """Latest detections for a job; dicts are only built when asked for"""
+    job = scheduler.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job: {job_id}"})
+
+    boxes = job.last_boxes
+    if boxes is None:
+        return {"job_id": job_id, "boxes": []}
+    if format == "dict":
+        return {"job_id": job_id, "boxes": boxes_to_dicts(boxes, limit)}
+    if format == "array":
+        return {"job_id": job_id, "columns": list(BOX_COLUMNS), "boxes": boxes[:limit].tolist()}
+    return JSONResponse(status_code=400, content={"error": f"Unknown format: {format}"})
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = scheduler.cancel(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown job: {job_id}"})
+    return {"job_id": job_id, "status": "cancelling" if not job.finished else job.status}
+
+async def process_video_analysis(job: StreamJob):
     try:
-        for frame_count in range(100):
-            await asyncio.sleep(2)
-            analysis = crowd_analyzer.analyze_frame(frame_count)
-            predictions = risk_predictor.predict_risk(analysis)
-            actions = safety_manager.get_actions(analysis['risk_level'])
-
-            risk_data = {
-                "current": {
-                    "level": analysis['risk_level'],
-                    "category": analysis['category'],
-                    "confidence": analysis['confidence'],
-                    "detections": analysis['detections']
-                },
-                "predictions": {
-                    "next10min": predictions['10min'],
-                    "next30min": predictions['30min']
-                }
-            }
-
-            safety_data = {
-                "actions": actions['actions'],
-                "officers": actions['officers'],
-                "barricades": actions['barricades'],
-                "medical": actions['medical']
-            }
-
-            store_event(file_id, analysis, predictions, actions)
-
-            await manager.broadcast({
-                "type": "analysis_update",
-                "risk_data": risk_data,
-                "safety_actions": safety_data,
-                "frame_count": frame_count
-            })
+        async def publish(frame_count: int, result: tuple, pipeline_stats: dict, reused: bool):
+            analysis, predictions, actions = result
+            if not reused:
+                job.frames_analyzed += 1
+            job.pipeline_stats = pipeline_stats
+            await publish_analysis(job, frame_count, analysis, predictions, actions, pipeline_stats, reused)
+
+        async def analyze(frame_counts: list, frames: list) -> list:
+            # Frames are timed by their position in the video, as if it were
+            # a live feed that started with the job, so forecasts run in scene time
+            fps = pipeline.video_info.get('fps') or 25.0
+            timestamps = [job.started_at + frame_count / fps for frame_count in frame_counts]
+            async with scheduler.gate.slot(job.job_id):
+                return await executor.analyze_batch(
+                    job.job_id, frame_counts, frames, job.options.get("camera"), timestamps
+                )
+
+        pipeline = VideoFramePipeline(
+            job.video_path,
+            analyze=analyze,
+            publish=publish,
+            max_in_flight=int(os.getenv("ANALYSIS_IN_FLIGHT", 2)),
+            max_frame_side=int(os.getenv("FRAME_MAX_SIDE", 640)),
+            batch_size=int(os.getenv("DETECTOR_BATCH", 4)),
+            sampling=SamplingPolicy.from_env(**job.options.get("sampling", {}))
+        )
+        try:
+            job.pipeline_stats = await pipeline.run()
+        finally:
+            await executor.release(job.job_id)
+
+        await manager.broadcast({
+            "type": "analysis_complete",
+            "job_id": job.job_id,
+            "file_id": job.file_id,
+            "pipeline": job.pipeline_stats
+        })
 
+    except asyncio.CancelledError:
+        await manager.broadcast({
+            "type": "analysis_cancelled",
+            "job_id": job.job_id,
+            "file_id": job.file_id
+        })
+        raise
     except Exception as e:
         await manager.broadcast({
             "type": "error",
+            "job_id": job.job_id,
+            "file_id": job.file_id,
             "message": f"Analysis error: {str(e)}"
         })
+        raise
+    finally:
+        manager.close_stream(job.job_id)
+        llm_gate.close_stream(job.job_id)
+
+async def publish_analysis(job: StreamJob, frame_count: int, analysis: dict, predictions: dict,
+                           actions: dict, pipeline_stats: dict, reused: bool = False):
+    risk_data = {
+        "current": {
+            "level": analysis['risk_level'],
+            "category": analysis['category'],
+            "confidence": analysis['confidence'],
+            "detections": analysis['detections'],
+            "density_per_sqm": analysis['density_per_sqm'],
+            "peak_density": analysis['peak_density'],
+            "hotspots": analysis['hotspots']
+        },
+        "predictions": {
+            "next10min": predictions['10min'],
+            "next30min": predictions['30min']
+        }
+    }
+
+    safety_data = {
+        "actions": actions['actions'],
+        "officers": actions['officers'],
+        "barricades": actions['barricades'],
+        "medical": actions['medical']
+    }
+    if "changes" in actions and not reused:
+        safety_data["changes"] = actions["changes"]
+
+    # The latest LLM verdict for the stream rides along with every update
+    verdict = llm_gate.verdict(job.job_id) if reused else llm_gate.observe(job.job_id, analysis, predictions)
+    if verdict is not None:
+        risk_data["llm"] = verdict
+
+    previous_level = job.last_update["risk_data"]["current"]["level"] if job.last_update else None
+    job.last_update = {"frame_count": frame_count, "risk_data": risk_data}
+    job.last_boxes = analysis['bounding_boxes']
+    store_event(job.file_id, analysis, predictions, actions)
+
+    update = {
+        "type": "analysis_update",
+        "job_id": job.job_id,
+        "file_id": job.file_id,
+        "risk_data": risk_data,
+        "safety_actions": safety_data,
+        "frame_count": frame_count,
+        "reused": reused,
+        "pipeline": pipeline_stats
+    }
+    # Boxes are only converted for streams someone has subscribed to them on
+    if manager.wants(job.file_id, "boxes"):
+        update["boxes"] = {"columns": list(BOX_COLUMNS), "rows": job.last_boxes.tolist()}
+    await manager.broadcast(update, key=job.job_id)
+
+    level = analysis['risk_level']
+    if previous_level is not None and RISK_LEVELS.index(level) > RISK_LEVELS.index(previous_level) \
+            and level in ALERT_LEVELS:
+        await manager.broadcast({
+            "type": "alert",
+            "job_id": job.job_id,
+            "file_id": job.file_id,
+            "level": level,
+            "previous_level": previous_level,
+            "category": analysis['category'],
+            "detections": analysis['detections'],
+            "frame_count": frame_count,
+            "actions": actions['actions']
+        })
+
+def store_event(file_id: str, analysis: dict, predictions: dict, actions: dict) -> bool:
+    """Queue an event for the batch writer; False if the queue was full"""
+    return event_writer.submit(event_store.pending_event(file_id, analysis, predictions, actions))
+
+@app.get("/events")
+async def get_events(video_filename: Optional[str] = None, risk: Optional[str] = None,
+                     since: Optional[str] = None, until: Optional[str] = None,
+                     cursor: Optional[str] = None, limit: int = 50, decode_json: bool = True):
+    """
+    Newest events first, filtered by stream, risk levels (comma separated)
+    and time range (ISO datetimes or epoch seconds)
+    Pass next_cursor from a response as cursor to fetch the next page
+    """
+    try:
+        since = event_store.to_epoch(since) if since else None
+        until = event_store.to_epoch(until) if until else None
+        position = event_store.decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError) as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid query: {str(e)}"})
+    levels = [level.strip() for level in risk.split(",") if level.strip()] if risk else None
+    unknown = [level for level in levels or [] if level not in RISK_LEVELS]
+    if unknown:
+        return JSONResponse(status_code=400, content={"error": f"Unknown risk level: {', '.join(unknown)}"})
 
-def store_event(file_id: str, analysis: dict, predictions: dict, actions: dict):
     try:
-        conn = sqlite3.connect('crowd_events.db')
-        cursor = conn.cursor()
-
-        event_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO events (
-                id, timestamp, video_filename, current_risk, current_confidence,
-                detections, prediction_10min, prediction_30min, actions
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            event_id,
-            datetime.now(),
-            file_id,
-            analysis['risk_level'],
-            analysis['confidence'],
-            analysis['detections'],
-            json.dumps(predictions['10min']),
-            json.dumps(predictions['30min']),
-            json.dumps(actions['actions'])
-        ))
-
-        conn.commit()
-        conn.close()
+        return await executor.run_db(
+            event_store.query_events, video_filename, levels, since, until, position, limit, decode_json
+        )
     except Exception as e:
-        print(f"Database error: {e}")
+        return JSONResponse(status_code=500, content={"error": f"Database error: {str(e)}"})
 
-@app.get("/events")
-async def get_events():
+@app.get("/events/rollup")
+async def get_event_rollups(bucket: str = "1m", video_filename: Optional[str] = None,
+                            since: Optional[str] = None, until: Optional[str] = None, limit: int = 5000):
+    """Per-stream history in 1m, 15m or 1h buckets, oldest first"""
+    if bucket not in rollups.BUCKETS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown bucket: {bucket}"})
     try:
-        conn = sqlite3.connect('crowd_events.db')
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT * FROM events ORDER BY timestamp DESC LIMIT 50')
-        events = []
-        for row in cursor.fetchall():
-            events.append({
-                "id": row[0],
-                "timestamp": row[1],
-                "video_filename": row[2],
-                "current_risk": row[3],
-                "current_confidence": row[4],
-                "detections": row[5],
-                "prediction_10min": json.loads(row[6]) if row[6] else None,
-                "prediction_30min": json.loads(row[7]) if row[7] else None,
-                "actions": json.loads(row[8]) if row[8] else None
-            })
-
-        conn.close()
-        return {"events": events}
+        since = event_store.to_epoch(since) if since else None
+        until = event_store.to_epoch(until) if until else None
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid query: {str(e)}"})
 
+    try:
+        return await executor.run_db(
+            rollups.query_rollups, bucket, video_filename, since, until, max(1, min(limit, 50000))
+        )
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"Database error: {str(e)}"})
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    """
+    Connect with ?delta=true to receive only changed fields of analysis updates,
+    and ?format=compact or ?format=msgpack for the compact encodings
+    Send {"action": "subscribe" | "unsubscribe", "streams": [...], "types": [...]}
+    to choose which streams and message types arrive
+    """
+    delta = websocket.query_params.get("delta", "false").lower() in ("1", "true")
+    await manager.connect(websocket, delta=delta, format=websocket.query_params.get("format"))
     try:
         while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
+            manager.send(websocket, handle_ws_request(websocket, await websocket.receive_text()))
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the socket was already closed by an eviction
+        pass
+    finally:
         manager.disconnect(websocket)
 
+def handle_ws_request(websocket: WebSocket, text: str) -> dict:
+    try:
+        request = json.loads(text)
+        if not isinstance(request, dict):
+            raise SubscriptionError("Expected a JSON object")
+        action = request.get("action")
+        if action == "subscribe":
+            return manager.subscribe(websocket, request.get("streams"), request.get("types"))
+        if action == "unsubscribe":
+            return manager.unsubscribe(websocket, request.get("streams"), request.get("types"))
+        if action == "subscriptions":
+            return manager.subscriptions(websocket)
+        raise SubscriptionError(f"Unknown action: {action}")
+    except (ValueError, SubscriptionError) as e:
+        return {"type": "error", "message": f"Invalid request: {str(e)}"}
+
 @app.get("/health")
 async def health_check():
     return {
@@ -280,7 +465,17 @@ async def health_check():
             "risk_predictor": "active",
             "safety_manager": "active",
             "database": "connected"
-        }
+        },
+        "executor": executor.get_stats(),
+        "memory": await executor.get_memory_usage(),
+        "scheduler": scheduler.get_stats(),
+        "db_writer": event_writer.get_stats(),
+        "retention": retention_manager.get_stats(),
+        "websocket": manager.get_stats(),
+        "watsonx": watsonx.get_stats(),
+        "prediction_cache": prediction_cache.get_stats(),
+        "llm_dispatcher": llm_dispatcher.get_stats(),
+        "llm_gate": llm_gate.get_stats()
     }
 
 @app.post("/predict-risk")
@@ -295,9 +490,32 @@ async def predict_risk(request: Request):
         if not (crowd_count and time_str and status):
             return JSONResponse(status_code=400, content={"error": "Missing required fields"})
 
-        prediction = get_prediction(crowd_count, time_str, status)
-        return {"prediction": prediction}
+        try:
+            float(crowd_count)
+        except (TypeError, ValueError):
+            return JSONResponse(status_code=400, content={"error": "crowd_count must be a number"})
+
+        return await get_prediction(crowd_count, time_str, status)
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"Prediction failed: {str(e)}"})
 
+@app.on_event("startup")
+async def startup():
+    global retention_task
+    if os.getenv("RETENTION_ENABLED", "true").lower() == "true":
+        retention_task = asyncio.create_task(retention_loop(float(os.getenv("RETENTION_INTERVAL", 3600))))
+
+@app.on_event("shutdown")
+async def shutdown():
+    if retention_task is not None:
+        retention_task.cancel()
+    await scheduler.shutdown()
+    await manager.shutdown()
+    await llm_gate.shutdown()
+    await llm_dispatcher.shutdown()
+    await watsonx.close()
+    # Flush events still queued before the process exits
+    await asyncio.get_running_loop().run_in_executor(None, event_writer.stop)
+    executor.shutdown()
+
 # Run with: uvicorn app:app --reload
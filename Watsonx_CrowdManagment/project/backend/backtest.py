@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Offline backtest of stored risk predictions
+
+Replays events from crowd_events.db (or an NDJSON, CSV or Parquet export),
+joins each 10/30-minute prediction with the detections observed once that
+horizon has passed on the same video, and reports accuracy, per-level
+confusion matrices and MAE. Rows are read in chunks and each video only
+keeps the predictions still waiting for their horizon, so memory stays flat
+however many rows are replayed.
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import sqlite3
+import sys
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+import event_store
+from risk_predictor import HORIZONS, RISK_LEVELS
+
+LEVEL_INDEX = {level: index for index, level in enumerate(RISK_LEVELS)}
+EVENT_COLUMNS = ('video_filename', 'timestamp', 'current_risk', 'detections', 'prediction_10min', 'prediction_30min')
+
+
+def to_seconds(value) -> float:
+    """Event timestamps are epoch seconds or ISO strings, depending on the source"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def parse_prediction(value) -> Optional[Dict]:
+    if value is None or value == '':
+        return None
+    if isinstance(value, dict):
+        return value
+    return json.loads(value)
+
+
+class HorizonScore:
+    """Running accuracy, confusion matrix and absolute error for one horizon"""
+
+    def __init__(self, seconds: int):
+        self.seconds = seconds
+        levels = len(RISK_LEVELS)
+        # Rows are observed levels, columns predicted levels
+        self.confusion = np.zeros((levels, levels), dtype=np.int64)
+        self.abs_error = 0
+        self.evaluated = 0
+        self.unmatched = 0
+
+    def add(self, predicted_level: int, predicted_detections: int, observed_level: int, observed_detections: int):
+        self.confusion[observed_level, predicted_level] += 1
+        self.abs_error += abs(predicted_detections - observed_detections)
+        self.evaluated += 1
+
+    def to_dict(self) -> Dict:
+        correct = int(np.trace(self.confusion))
+        predicted_totals = self.confusion.sum(axis=0)
+        observed_totals = self.confusion.sum(axis=1)
+        per_level = {}
+        for index, level in enumerate(RISK_LEVELS):
+            hits = int(self.confusion[index, index])
+            per_level[level] = {
+                'observed': int(observed_totals[index]),
+                'predicted': int(predicted_totals[index]),
+                'precision': round(hits / predicted_totals[index], 4) if predicted_totals[index] else None,
+                'recall': round(hits / observed_totals[index], 4) if observed_totals[index] else None
+            }
+        return {
+            'horizon_seconds': self.seconds,
+            'evaluated': self.evaluated,
+            'unmatched': self.unmatched,
+            'accuracy': round(correct / self.evaluated, 4) if self.evaluated else None,
+            'mae': round(self.abs_error / self.evaluated, 3) if self.evaluated else None,
+            'confusion_matrix': {
+                'levels': list(RISK_LEVELS),
+                'rows': 'observed',
+                'columns': 'predicted',
+                'counts': self.confusion.tolist()
+            },
+            'per_level': per_level
+        }
+
+
+class Backtest:
+    """
+    Streaming join of predictions with later observations
+    A prediction made at t is scored against the first observation of the
+    same video at or after t + horizon, if that comes within `tolerance`
+    seconds; otherwise it counts as unmatched
+    """
+
+    def __init__(self, tolerance: float = 60.0):
+        self.tolerance = tolerance
+        self.scores = {horizon: HorizonScore(seconds) for horizon, seconds in HORIZONS.items()}
+        self.rows = 0
+        self.skipped = 0
+        self._videos: Dict[str, Dict] = {}
+
+    def _video(self, video: str) -> Dict:
+        state = self._videos.get(video)
+        if state is None:
+            state = self._videos[video] = {
+                'last_time': None,
+                'pending': {horizon: deque() for horizon in HORIZONS}
+            }
+        return state
+
+    def add(self, video: str, timestamp: float, level: int, detections: int,
+            predictions: Dict[str, Optional[Dict]]):
+        self.rows += 1
+        state = self._video(video)
+        if state['last_time'] is not None and timestamp < state['last_time']:
+            # Each video must be replayed in time order
+            self.skipped += 1
+            return
+        state['last_time'] = timestamp
+
+        for horizon, pending in state['pending'].items():
+            score = self.scores[horizon]
+            while pending and pending[0][0] <= timestamp:
+                target, predicted_level, predicted_detections = pending.popleft()
+                if timestamp - target <= self.tolerance:
+                    score.add(predicted_level, predicted_detections, level, detections)
+                else:
+                    score.unmatched += 1
+
+            prediction = predictions.get(horizon)
+            if prediction and prediction.get('level') in LEVEL_INDEX:
+                pending.append((
+                    timestamp + score.seconds,
+                    LEVEL_INDEX[prediction['level']],
+                    int(prediction.get('predicted_detections', 0))
+                ))
+
+    def close_video(self, video: str):
+        """Predictions still waiting when a video ends can never be scored"""
+        state = self._videos.pop(video, None)
+        if state is None:
+            return
+        for horizon, pending in state['pending'].items():
+            self.scores[horizon].unmatched += len(pending)
+
+    def close_all(self):
+        for video in list(self._videos):
+            self.close_video(video)
+
+    def pending(self) -> int:
+        return sum(len(pending) for state in self._videos.values() for pending in state['pending'].values())
+
+    def report(self) -> Dict:
+        return {
+            'rows': self.rows,
+            'skipped_out_of_order': self.skipped,
+            'pending': self.pending(),
+            'horizons': {horizon: score.to_dict() for horizon, score in self.scores.items()}
+        }
+
+
+def iter_sqlite_events(db_path: str, chunk_size: int = 10000) -> Iterator[Dict]:
+    """Events ordered by video then time, fetched chunk_size rows at a time"""
+    conn = sqlite3.connect(db_path)
+    try:
+        if event_store.is_legacy(conn):
+            cursor = conn.execute(
+                f"SELECT {', '.join(EVENT_COLUMNS)} FROM events ORDER BY video_filename, timestamp"
+            )
+            decode = _decode_legacy
+        else:
+            cursor = conn.execute(f"""
+                SELECT s.video_filename, e.timestamp, e.current_risk, e.detections,
+                       {', '.join(f'e.level_{horizon}, e.detections_{horizon}' for horizon in HORIZONS)}
+                FROM events e JOIN streams s ON s.id = e.stream_id
+                ORDER BY e.stream_id, e.timestamp
+            """)
+            decode = _decode_compact
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield decode(row)
+    finally:
+        conn.close()
+
+
+def _decode_legacy(row: tuple) -> Dict:
+    return dict(zip(EVENT_COLUMNS, row))
+
+
+def _decode_compact(row: tuple) -> Dict:
+    event = {
+        'video_filename': row[0],
+        'timestamp': row[1],
+        'current_risk': RISK_LEVELS[row[2]],
+        'detections': row[3]
+    }
+    for index, horizon in enumerate(HORIZONS):
+        level, detections = row[4 + 2 * index:6 + 2 * index]
+        event[f'prediction_{horizon}'] = None if level is None else {
+            'level': RISK_LEVELS[level],
+            'predicted_detections': detections
+        }
+    return event
+
+
+def _open_text(path: str):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else open(path, encoding='utf-8', newline='')
+
+
+def iter_ndjson_events(path: str) -> Iterator[Dict]:
+    with _open_text(path) as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_csv_events(path: str) -> Iterator[Dict]:
+    with _open_text(path) as handle:
+        yield from csv.DictReader(handle)
+
+
+def iter_parquet_events(path: str, chunk_size: int = 10000) -> Iterator[Dict]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Reading Parquet exports needs pyarrow (pip install pyarrow)")
+
+    parquet = pq.ParquetFile(path)
+    columns = [name for name in EVENT_COLUMNS if name in parquet.schema_arrow.names]
+    for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+        yield from batch.to_pylist()
+
+
+def iter_events(source: str, chunk_size: int = 10000) -> Tuple[Iterator[Dict], bool]:
+    """
+    Pick a reader from the file name
+    Returns the rows and whether they arrive grouped by video
+    """
+    name = source[:-3] if source.endswith('.gz') else source
+    if name.endswith(('.ndjson', '.jsonl')):
+        return iter_ndjson_events(source), False
+    if name.endswith('.csv'):
+        return iter_csv_events(source), False
+    if name.endswith('.parquet'):
+        return iter_parquet_events(source, chunk_size), False
+    return iter_sqlite_events(source, chunk_size), True
+
+
+def run_backtest(rows: Iterable[Dict], grouped: bool = False, tolerance: float = 60.0) -> Dict:
+    """
+    Score every prediction in rows
+    With grouped rows (all of a video's events together) finished videos
+    are dropped as soon as the next one starts
+    """
+    backtest = Backtest(tolerance=tolerance)
+    current = None
+    for row in rows:
+        video = row['video_filename']
+        if grouped and video != current and current is not None:
+            backtest.close_video(current)
+        current = video
+
+        predictions = {
+            horizon: parse_prediction(row.get(f'prediction_{horizon}'))
+            for horizon in HORIZONS
+        }
+        backtest.add(
+            video,
+            to_seconds(row['timestamp']),
+            LEVEL_INDEX[row['current_risk']],
+            int(row['detections']),
+            predictions
+        )
+
+    backtest.close_all()
+    return backtest.report()
+
+
+def print_report(report: Dict):
+    print(f"📊 Replayed {report['rows']} events ({report['skipped_out_of_order']} out of order, skipped)")
+    for horizon, score in report['horizons'].items():
+        print(f"\n🔮 {horizon} predictions")
+        print(f"   evaluated: {score['evaluated']}  unmatched: {score['unmatched']}")
+        print(f"   accuracy:  {score['accuracy']}")
+        print(f"   MAE:       {score['mae']} detections")
+        levels = score['confusion_matrix']['levels']
+        width = max(len(level) for level in levels) + 2
+        print("   observed \\ predicted")
+        print("   " + " " * width + "".join(level.rjust(width) for level in levels))
+        for level, counts in zip(levels, score['confusion_matrix']['counts']):
+            print("   " + level.ljust(width) + "".join(str(count).rjust(width) for count in counts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest stored risk predictions")
+    parser.add_argument("source", nargs="?", default="crowd_events.db",
+                        help="SQLite database, or an .ndjson/.csv/.parquet export (optionally .gz)")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Rows fetched per read")
+    parser.add_argument("--tolerance", type=float, default=60.0,
+                        help="Seconds after the horizon an observation may arrive and still count")
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    args = parser.parse_args()
+
+    try:
+        rows, grouped = iter_events(args.source, args.chunk_size)
+        report = run_backtest(rows, grouped=grouped, tolerance=args.tolerance)
+    except Exception as e:
+        print(f"❌ Backtest error: {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
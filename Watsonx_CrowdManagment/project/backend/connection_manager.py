@@ -0,0 +1,368 @@
+import os
+import asyncio
+from collections import deque
+from itertools import chain
+from typing import Deque, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple, Union
+
+from fastapi import WebSocket
+
+import wire_format
+
+_MISSING = object()
+
+# Sent with every delta so clients can route it without their previous state
+IDENTITY_FIELDS = ('type', 'job_id', 'file_id')
+
+# Topic types a client can subscribe to, and the analysis_update fields each
+# one carries; every other message is an alert or a job status change
+TOPIC_TYPES = ('risk', 'actions', 'boxes', 'alerts', 'status')
+TOPIC_FIELDS = {
+    'risk': ('risk_data', 'pipeline'),
+    'actions': ('safety_actions',),
+    'boxes': ('boxes',)
+}
+MESSAGE_TOPICS = {'alert': 'alerts'}
+ALL_STREAMS = '*'
+# Clients that never subscribe get what /ws has always sent
+DEFAULT_TOPICS = frozenset((ALL_STREAMS, topic) for topic in ('risk', 'actions', 'status'))
+
+Topic = Tuple[str, str]
+
+
+class SubscriptionError(ValueError):
+    """Raised for a malformed subscribe or unsubscribe request"""
+
+
+def message_topics(message: Dict) -> List[str]:
+    """The topic types a message carries"""
+    if message.get('type') == 'analysis_update':
+        return [topic for topic, fields in TOPIC_FIELDS.items() if any(field in message for field in fields)]
+    return [MESSAGE_TOPICS.get(message.get('type'), 'status')]
+
+
+def _topics(streams: Optional[List[str]], types: Optional[List[str]]) -> Set[Topic]:
+    streams = [streams] if isinstance(streams, str) else streams or [ALL_STREAMS]
+    types = [types] if isinstance(types, str) else types or list(TOPIC_TYPES)
+    if not isinstance(streams, list) or not all(isinstance(stream, str) for stream in streams):
+        raise SubscriptionError("streams must be a list of stream ids")
+    if not isinstance(types, list):
+        raise SubscriptionError("types must be a list")
+    unknown = [topic for topic in types if topic not in TOPIC_TYPES]
+    if unknown:
+        raise SubscriptionError(f"Unknown types: {', '.join(map(str, unknown))}; expected {', '.join(TOPIC_TYPES)}")
+    return {(stream, topic) for stream in streams for topic in types}
+
+
+def project(message: Dict, topics: FrozenSet[str]) -> Dict:
+    """message without the fields of topics outside `topics`"""
+    if message.get('type') != 'analysis_update':
+        return message
+    hidden = {field for topic, fields in TOPIC_FIELDS.items() if topic not in topics for field in fields}
+    if not hidden.intersection(message):
+        return message
+    return {key: value for key, value in message.items() if key not in hidden}
+
+
+def diff(previous: Dict, current: Dict) -> Dict:
+    """
+    Fields of current that differ from previous
+    Nested dicts are diffed recursively, lists are replaced whole and
+    removed keys come back as None
+    """
+    changes = {}
+    for key, value in current.items():
+        old = previous.get(key, _MISSING)
+        if old is _MISSING:
+            changes[key] = value
+        elif isinstance(value, dict) and isinstance(old, dict):
+            nested = diff(old, value)
+            if nested:
+                changes[key] = nested
+        elif value != old:
+            changes[key] = value
+    for key in previous.keys() - current.keys():
+        changes[key] = None
+    return changes
+
+
+class Frame:
+    """
+    One broadcast message, shared by every client it is queued for
+    Each encoding of it is produced at most once, by the first sender
+    that needs it
+    """
+
+    __slots__ = ('key', 'seq', 'message', 'delta', 'encoded')
+
+    def __init__(self, key: Optional[tuple], seq: int, message: dict, delta: Optional[dict] = None):
+        self.key = key
+        self.seq = seq
+        self.message = message
+        self.delta = delta
+        self.encoded: Dict[tuple, Union[str, bytes]] = {}
+
+
+class Client:
+    """
+    A connected socket and the frames waiting to be sent to it
+    Frames for the same stream key are coalesced while queued, since only
+    the newest state matters; past max_queue the oldest frame is dropped
+    """
+
+    def __init__(self, websocket: WebSocket, delta: bool, max_queue: int, format: str = 'json'):
+        self.websocket = websocket
+        self.delta = delta
+        self.format = format
+        self.max_queue = max_queue
+        self.topics: Set[Topic] = set(DEFAULT_TOPICS)
+        self.subscribed = False
+        # Entries are one-item lists so a coalesced frame keeps its place in line
+        self.queue: Deque[List[Frame]] = deque()
+        self.queued: Dict[tuple, List[Frame]] = {}
+        self.sent_seq: Dict[tuple, int] = {}
+        self.ready = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def push(self, frame: Frame):
+        if frame.key is not None:
+            entry = self.queued.get(frame.key)
+            if entry is not None:
+                entry[0] = frame
+                self.coalesced += 1
+                return
+        if len(self.queue) >= self.max_queue:
+            oldest = self.queue.popleft()
+            if oldest[0].key is not None:
+                self.queued.pop(oldest[0].key, None)
+            self.dropped += 1
+
+        entry = [frame]
+        self.queue.append(entry)
+        if frame.key is not None:
+            self.queued[frame.key] = entry
+        self.ready.set()
+
+    def pop(self) -> Tuple[Frame, bool]:
+        """The next frame, and whether to send it as a delta"""
+        frame = self.queue.popleft()[0]
+        if frame.key is None:
+            return frame, False
+        self.queued.pop(frame.key, None)
+        # A delta only applies on top of the frame just before it
+        in_sequence = self.sent_seq.get(frame.key) == frame.seq - 1
+        self.sent_seq[frame.key] = frame.seq
+        return frame, self.delta and frame.delta is not None and in_sequence
+
+
+class ConnectionManager:
+    """
+    WebSocket fan-out
+    Each message is encoded once per distinct view and format. Every client
+    has its own bounded send queue drained by its own task, so a slow
+    client only delays itself; a client whose send fails or takes longer
+    than send_timeout is evicted. Clients subscribe to (stream, type)
+    topics and an index from topic to clients means routing a message only
+    touches that stream's subscribers. Clients in delta mode get only the
+    fields that changed since the last frame of the same stream, and a
+    full frame whenever they missed one
+    """
+
+    def __init__(self, max_queue: Optional[int] = None, send_timeout: Optional[float] = None):
+        self.max_queue = max_queue or int(os.getenv("WS_SEND_QUEUE", 64))
+        self.send_timeout = send_timeout or float(os.getenv("WS_SEND_TIMEOUT", 5))
+        self.clients: Dict[WebSocket, Client] = {}
+        self.index: Dict[Topic, Set[Client]] = {}
+        # Last message and sequence number per stream key and view, the base for deltas
+        self._streams: Dict[tuple, tuple] = {}
+
+        self.messages = 0
+        self.serializations = 0
+        self.bytes_serialized = 0
+        self.evicted = 0
+        # Counters of clients that have since disconnected
+        self._closed = {'sent': 0, 'bytes_sent': 0, 'dropped': 0, 'coalesced': 0}
+
+    async def connect(self, websocket: WebSocket, delta: bool = False, format: Optional[str] = None):
+        """format is the encoding the client asked for; see wire_format"""
+        await websocket.accept()
+        client = Client(websocket, delta, self.max_queue, wire_format.negotiate(format))
+        self.clients[websocket] = client
+        self._index(client, client.topics)
+        client.task = asyncio.create_task(self._send_loop(client))
+        if format is not None:
+            self.send(websocket, wire_format.schema(client.format))
+
+    def disconnect(self, websocket: WebSocket):
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        self._unindex(client, client.topics)
+        for counter in self._closed:
+            self._closed[counter] += getattr(client, counter)
+        if client.task is not asyncio.current_task():
+            client.task.cancel()
+
+    def _index(self, client: Client, topics: Iterable[Topic]):
+        for topic in topics:
+            self.index.setdefault(topic, set()).add(client)
+
+    def _unindex(self, client: Client, topics: Iterable[Topic]):
+        for topic in topics:
+            subscribers = self.index.get(topic)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self.index[topic]
+
+    def subscribe(self, websocket: WebSocket, streams: Optional[List[str]] = None,
+                  types: Optional[List[str]] = None) -> Dict:
+        """
+        Add every (stream, type) pair; streams default to all ("*") and
+        types to all of TOPIC_TYPES. The first subscribe replaces the
+        default subscription
+        """
+        client = self.clients[websocket]
+        topics = _topics(streams, types)
+        if not client.subscribed:
+            self._unindex(client, client.topics)
+            client.topics = set()
+            client.subscribed = True
+        client.topics |= topics
+        self._index(client, topics)
+        return self.subscriptions(websocket)
+
+    def unsubscribe(self, websocket: WebSocket, streams: Optional[List[str]] = None,
+                    types: Optional[List[str]] = None) -> Dict:
+        client = self.clients[websocket]
+        topics = _topics(streams, types)
+        if not client.subscribed:
+            client.subscribed = True
+        removed = client.topics & topics
+        client.topics -= removed
+        self._unindex(client, removed)
+        return self.subscriptions(websocket)
+
+    def subscriptions(self, websocket: WebSocket) -> Dict:
+        by_stream: Dict[str, List[str]] = {}
+        for stream, topic in self.clients[websocket].topics:
+            by_stream.setdefault(stream, []).append(topic)
+        return {"type": "subscriptions", "streams": {stream: sorted(types) for stream, types in by_stream.items()}}
+
+    def wants(self, stream: Optional[str], topic: str) -> bool:
+        """Whether anyone would receive `topic` for this stream"""
+        return (stream, topic) in self.index or (ALL_STREAMS, topic) in self.index
+
+    def send(self, websocket: WebSocket, message: dict):
+        """Queue a message for one client, behind what it is already due"""
+        client = self.clients.get(websocket)
+        if client is not None:
+            client.push(Frame(None, 0, message))
+
+    async def broadcast(self, message: dict, key: Optional[str] = None):
+        """
+        Queue message for every client subscribed to it, without waiting on
+        any of them. The stream is the message's file_id. key names the
+        job a state update belongs to; updates with a key may be coalesced
+        and sent as deltas
+        """
+        stream = message.get('file_id')
+        views: Dict[Client, Set[str]] = {}
+        for topic in message_topics(message):
+            subscribers = chain(self.index.get((stream, topic), ()), self.index.get((ALL_STREAMS, topic), ()))
+            for client in subscribers:
+                views.setdefault(client, set()).add(topic)
+        if not views:
+            return
+        self.messages += 1
+
+        groups: Dict[FrozenSet[str], List[Client]] = {}
+        for client, topics in views.items():
+            groups.setdefault(frozenset(topics), []).append(client)
+        for topics, clients in groups.items():
+            frame = self._frame(project(message, topics), key and (key, topics),
+                                any(client.delta for client in clients))
+            for client in clients:
+                client.push(frame)
+
+    def _frame(self, message: dict, key: Optional[tuple], delta_wanted: bool) -> Frame:
+        seq, delta = 0, None
+        if key is not None:
+            seq, previous = self._streams.get(key, (0, None))
+            seq += 1
+            self._streams[key] = (seq, message)
+            if previous is not None and delta_wanted:
+                changes = diff(previous, message)
+                identity = {field: message[field] for field in IDENTITY_FIELDS if field in message}
+                delta = {**identity, "delta": True, **changes}
+        return Frame(key, seq, message, delta)
+
+    def _encode(self, frame: Frame, format: str, delta: bool) -> Union[str, bytes]:
+        payload = frame.encoded.get((format, delta))
+        if payload is None:
+            payload = wire_format.encode(frame.delta if delta else frame.message, format)
+            frame.encoded[(format, delta)] = payload
+            self.serializations += 1
+            self.bytes_serialized += len(payload)
+        return payload
+
+    def close_stream(self, key: str):
+        """Forget a finished job's delta bases"""
+        for stream_key in [stream_key for stream_key in self._streams if stream_key[0] == key]:
+            del self._streams[stream_key]
+        for client in self.clients.values():
+            for sent_key in [sent_key for sent_key in client.sent_seq if sent_key[0] == key]:
+                del client.sent_seq[sent_key]
+
+    async def _send_loop(self, client: Client):
+        try:
+            while True:
+                await client.ready.wait()
+                while client.queue:
+                    frame, delta = client.pop()
+                    payload = self._encode(frame, client.format, delta)
+                    if isinstance(payload, bytes):
+                        send = client.websocket.send_bytes(payload)
+                    else:
+                        send = client.websocket.send_text(payload)
+                    await asyncio.wait_for(send, self.send_timeout)
+                    client.sent += 1
+                    client.bytes_sent += len(payload)
+                client.ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.evicted += 1
+            print(f"WebSocket client evicted: {e!r}")
+            self.disconnect(client.websocket)
+            try:
+                await client.websocket.close()
+            except Exception:
+                pass
+
+    async def shutdown(self):
+        for websocket in list(self.clients):
+            self.disconnect(websocket)
+
+    def get_stats(self) -> Dict:
+        clients = list(self.clients.values())
+        return {
+            'connections': len(clients),
+            'delta_clients': sum(1 for client in clients if client.delta),
+            'formats': {fmt: sum(1 for client in clients if client.format == fmt) for fmt in wire_format.FORMATS},
+            'topics': len(self.index),
+            'messages': self.messages,
+            'serializations': self.serializations,
+            'bytes_serialized': self.bytes_serialized,
+            'frames_sent': self._closed['sent'] + sum(client.sent for client in clients),
+            'bytes_sent': self._closed['bytes_sent'] + sum(client.bytes_sent for client in clients),
+            'queue_depth_max': max((len(client.queue) for client in clients), default=0),
+            'dropped': self._closed['dropped'] + sum(client.dropped for client in clients),
+            'coalesced': self._closed['coalesced'] + sum(client.coalesced for client in clients),
+            'evicted': self.evicted
+        }
+
@@ -1,69 +1,137 @@
+import os
 import cv2
 import numpy as np
 import random
 import time
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from detectors import BOX_COLUMNS, BOX_H, BOX_W, BOX_X, BOX_Y, Detector, SimulatedDetector, boxes_to_dicts
+from rolling_stats import RingBuffer, RollingStats
+
+# Compact per-frame record kept in the detection history
+DETECTION_RECORD = np.dtype([
+    ('frame_number', np.int64),
+    ('timestamp', np.float64),
+    ('detections', np.int32),
+    ('risk_level', np.int8),
+    ('confidence', np.float32),
+    ('peak_density', np.float32)
+])
+
+
+def person_grid(boxes: np.ndarray, grid_shape: Tuple[int, int], weight: float = 1.0) -> np.ndarray:
+    """
+    Count people per grid cell from their ground (feet) points
+    One bincount over flattened cell indices, so the cost is linear in boxes
+    """
+    rows, cols = grid_shape
+    if len(boxes) == 0:
+        return np.zeros(grid_shape, dtype=np.float32)
+
+    feet_x = boxes[:, BOX_X] + boxes[:, BOX_W] / 2
+    feet_y = boxes[:, BOX_Y] + boxes[:, BOX_H]
+    col = np.clip((feet_x * cols).astype(np.intp), 0, cols - 1)
+    row = np.clip((feet_y * rows).astype(np.intp), 0, rows - 1)
+
+    counts = np.bincount(row * cols + col, minlength=rows * cols)
+    return (counts * weight).astype(np.float32).reshape(grid_shape)
+
 
 class CrowdAnalyzer:
     """
-    Simulates YOLO-based crowd detection and analysis
-    In production, this would use actual YOLOv8 model
+    YOLO-based crowd detection and analysis
+    Detection is delegated to a Detector backend; the deterministic
+    simulator is used unless a real CPU backend is configured
     """
     
-    def __init__(self):
+    def __init__(
+        self,
+        detector: Optional[Detector] = None,
+        area_sqm: Optional[float] = None,
+        grid_shape: Optional[Tuple[int, int]] = None,
+        use_peak_density: Optional[bool] = None
+    ):
         self.risk_levels = [
             {
                 'level': 'good',
                 'category': 'Good to go / Well managed / Low crowd',
                 'density_range': (0, 50),
+                'peak_density_range': (0, 2),  # people per sqm in the densest cell
                 'base_confidence': 0.95
             },
             {
                 'level': 'moderate',
                 'category': 'Moderate crowd but no danger',
                 'density_range': (51, 120),
+                'peak_density_range': (2, 4),  # people per sqm in the densest cell
                 'base_confidence': 0.88
             },
             {
                 'level': 'overcrowd',
                 'category': 'Overcrowd / Very much crowded / Attention needed',
                 'density_range': (121, 200),
+                'peak_density_range': (4, 6),  # people per sqm in the densest cell
                 'base_confidence': 0.82
             },
             {
                 'level': 'stampede',
                 'category': 'Stampede / Red alert / Very much attention needed',
                 'density_range': (201, 500),
+                'peak_density_range': (6, float('inf')),  # people per sqm in the densest cell
                 'base_confidence': 0.91
             }
         ]
         
-        self.frame_history = []
-        self.detection_history = []
+        self.level_index = {risk['level']: i for i, risk in enumerate(self.risk_levels)}
+
+        # Fixed-size history of compact records plus O(1) trend statistics
+        self.detection_history = RingBuffer(50, DETECTION_RECORD)
+        self.trend_stats = RollingStats(window=10)
+
+        self.detector = detector or SimulatedDetector()
+
+        # Camera calibration: ground area covered by the frame, split into a grid
+        self.area_sqm = area_sqm or float(os.getenv("CAMERA_AREA_SQM", 100))
+        self.grid_shape = grid_shape or (
+            int(os.getenv("DENSITY_GRID_ROWS", 8)),
+            int(os.getenv("DENSITY_GRID_COLS", 8))
+        )
+        self.cell_area_sqm = self.area_sqm / (self.grid_shape[0] * self.grid_shape[1])
+        if use_peak_density is None:
+            use_peak_density = os.getenv("RISK_FROM_PEAK_DENSITY", "false").lower() == "true"
+        self.use_peak_density = use_peak_density
+        self.hotspot_min_density = 2.0
+        self.max_hotspots = 5
     
-    def analyze_frame(self, frame_number: int) -> Dict:
+    def analyze_frame(self, frame_number: int, frame: Optional[np.ndarray] = None) -> Dict:
         """
-        Simulate YOLO detection on a frame
+        Run YOLO detection on a single frame
         Returns crowd analysis with risk classification
         """
-        
-        # Simulate crowd detection count (would be actual YOLO detections)
-        base_crowd = 80 + (frame_number % 50) * 2
-        noise = random.randint(-20, 30)
-        crowd_count = max(10, base_crowd + noise)
-        
-        # Add some realistic patterns
-        if frame_number > 30:  # Simulate crowd building up
-            crowd_count += min(frame_number - 30, 100)
-        
-        if frame_number > 70:  # Simulate potential overcrowding
-            crowd_count += random.randint(0, 80)
-        
+        return self.analyze_batch([frame_number], [frame])[0]
+
+    def analyze_batch(self, frame_numbers: Sequence[int],
+                      frames: Sequence[Optional[np.ndarray]],
+                      timestamps: Optional[Sequence[float]] = None) -> List[Dict]:
+        """
+        Run YOLO detection on a batch of frames in one detector call
+        Returns one crowd analysis per frame, in order
+        timestamps give each frame's capture time; defaults to now
+        """
+        detections = self.detector.detect_batch(frames, frame_numbers)
+        if timestamps is None:
+            timestamps = [time.time()] * len(frame_numbers)
+        return [
+            self._build_analysis(frame_number, crowd_count, bounding_boxes, timestamp)
+            for frame_number, (crowd_count, bounding_boxes), timestamp in zip(frame_numbers, detections, timestamps)
+        ]
+
+    def _build_analysis(self, frame_number: int, crowd_count: int, bounding_boxes: np.ndarray,
+                        timestamp: float) -> Dict:
+        density = self.compute_density(crowd_count, bounding_boxes)
+
         # Classify risk level based on crowd density
-        risk_info = self._classify_risk(crowd_count)
-        
-        # Generate bounding boxes (simulate YOLO detections)
-        bounding_boxes = self._generate_bounding_boxes(crowd_count)
+        risk_info = self._classify_risk(crowd_count, density['peak_density'])
         
         # Calculate confidence based on detection quality
         confidence = self._calculate_confidence(crowd_count, risk_info)
@@ -75,45 +143,72 @@ class CrowdAnalyzer:
             'category': risk_info['category'],
             'confidence': confidence,
             'bounding_boxes': bounding_boxes,
-            'timestamp': time.time(),
-            'density_per_sqm': round(crowd_count / 100, 2)  # Assuming 100 sqm area
+            'timestamp': timestamp,
+            'density_per_sqm': round(crowd_count / self.area_sqm, 2),
+            'peak_density': density['peak_density'],
+            'hotspots': density['hotspots'],
+            'density_grid': density['grid']
         }
         
         # Store in history for trend analysis
-        self.detection_history.append(analysis)
-        if len(self.detection_history) > 50:
-            self.detection_history.pop(0)
+        self.detection_history.append((
+            frame_number, analysis['timestamp'], crowd_count,
+            self.level_index[risk_info['level']], confidence, density['peak_density']
+        ))
+        self.trend_stats.push(crowd_count)
         
         return analysis
     
-    def _classify_risk(self, crowd_count: int) -> Dict:
-        """Classify crowd count into risk categories"""
+    def compute_density(self, crowd_count: int, bounding_boxes: np.ndarray) -> Dict:
+        """Per-cell density grid, peak cell density and hotspot cells"""
+        # Scale when the detector returns fewer boxes than people counted
+        weight = crowd_count / len(bounding_boxes) if len(bounding_boxes) else 0.0
+        grid = person_grid(bounding_boxes, self.grid_shape, weight) / self.cell_area_sqm
+
+        flat = grid.ravel()
+        k = min(self.max_hotspots, flat.size)
+        top = np.argpartition(flat, -k)[-k:]
+        top = top[np.argsort(-flat[top])]
+
+        rows, cols = self.grid_shape
+        top = [int(cell) for cell in top]
+        hotspots = [
+            {
+                'row': int(cell // cols),
+                'col': int(cell % cols),
+                # Cell centre in normalized frame coordinates
+                'x': round((cell % cols + 0.5) / cols, 4),
+                'y': round((cell // cols + 0.5) / rows, 4),
+                'density': round(float(flat[cell]), 2)
+            }
+            for cell in top if flat[cell] >= self.hotspot_min_density
+        ]
+
+        return {
+            'grid': grid,
+            'peak_density': round(float(flat.max()), 2) if flat.size else 0.0,
+            'hotspots': hotspots
+        }
+
+    def _classify_risk(self, crowd_count: int, peak_density: Optional[float] = None) -> Dict:
+        """Classify crowd count (and optionally peak local density) into risk categories"""
+        by_count = self.risk_levels[-1]  # If exceeds highest category, return stampede
         for risk in self.risk_levels:
             min_density, max_density = risk['density_range']
             if min_density <= crowd_count <= max_density:
-                return risk
-        
-        # If exceeds highest category, return stampede
-        return self.risk_levels[-1]
-    
-    def _generate_bounding_boxes(self, crowd_count: int) -> List[Dict]:
-        """Generate simulated bounding boxes for detected persons"""
-        boxes = []
-        
-        # Simulate realistic distribution of people in frame
-        for i in range(min(crowd_count, 50)):  # Limit visual boxes for performance
-            box = {
-                'id': f'person_{i}',
-                'x': random.uniform(0.1, 0.9),  # Normalized coordinates
-                'y': random.uniform(0.2, 0.8),
-                'width': random.uniform(0.03, 0.08),
-                'height': random.uniform(0.08, 0.15),
-                'confidence': random.uniform(0.7, 0.98),
-                'class': 'person'
-            }
-            boxes.append(box)
-        
-        return boxes
+                by_count = risk
+                break
+
+        if not self.use_peak_density or peak_density is None:
+            return by_count
+
+        # A single crushed area raises the level even if the total count is modest
+        for risk in reversed(self.risk_levels):
+            if peak_density >= risk['peak_density_range'][0]:
+                if self.risk_levels.index(risk) > self.risk_levels.index(by_count):
+                    return risk
+                break
+        return by_count
     
     def _calculate_confidence(self, crowd_count: int, risk_info: Dict) -> float:
         """Calculate detection confidence based on crowd density and conditions"""
@@ -134,46 +229,36 @@ class CrowdAnalyzer:
         return max(0.6, min(0.99, final_confidence))
     
     def get_trend_analysis(self) -> Dict:
-        """Analyze crowd trends from recent history"""
-        if len(self.detection_history) < 5:
+        """Analyze crowd trends from recent history in O(1)"""
+        stats = self.trend_stats
+        if len(stats) < 5:
             return {"trend": "insufficient_data"}
         
-        recent_detections = [h['detections'] for h in self.detection_history[-10:]]
-        
-        # Calculate trend
-        if len(recent_detections) >= 2:
-            trend_slope = (recent_detections[-1] - recent_detections[0]) / len(recent_detections)
-            
-            if trend_slope > 5:
-                trend = "increasing"
-            elif trend_slope < -5:
-                trend = "decreasing"
-            else:
-                trend = "stable"
+        # Least-squares slope in detections per frame over the window
+        trend_slope = stats.slope
+        if trend_slope > 5:
+            trend = "increasing"
+        elif trend_slope < -5:
+            trend = "decreasing"
         else:
             trend = "stable"
         
         return {
             "trend": trend,
-            "recent_average": np.mean(recent_detections),
-            "recent_max": max(recent_detections),
-            "recent_min": min(recent_detections),
-            "volatility": np.std(recent_detections)
+            "trend_slope": trend_slope,
+            "recent_average": stats.mean,
+            "recent_max": stats.max,
+            "recent_min": stats.min,
+            "volatility": stats.std
         }
+
+    def get_memory_usage(self) -> int:
+        """Bytes held by this analyzer's history"""
+        return self.detection_history.nbytes
     
     def simulate_yolo_processing(self, video_path: str = None) -> Dict:
         """
-        Simulate YOLO model processing
-        In production, this would load and run actual YOLOv8 model
+        Describe the detector backend in use
+        Processing time is the measured average seconds per frame
         """
-        processing_info = {
-            "model": "YOLOv8n",
-            "input_size": "640x640",
-            "classes": ["person"],
-            "processing_time": random.uniform(0.05, 0.15),  # Seconds per frame
-            "gpu_acceleration": True,
-            "confidence_threshold": 0.5,
-            "nms_threshold": 0.4
-        }
-        
-        return processing_info
\ No newline at end of file
+        return self.detector.info()
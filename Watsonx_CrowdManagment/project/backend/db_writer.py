@@ -0,0 +1,176 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+_STOP = object()
+
+
+class BatchWriter:
+    """
+    Single long-lived SQLite writer
+    Rows are queued in memory and a background thread inserts them in
+    batched transactions, flushing once batch_size rows are waiting or
+    flush_interval seconds after the first one arrived. The connection runs
+    in WAL mode, so readers are not blocked while a batch commits
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[sqlite3.Connection, List], None],
+        db_path: str = 'crowd_events.db',
+        init_db: Optional[Callable[[sqlite3.Connection], None]] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_queue: Optional[int] = None
+    ):
+        self.write_batch = write_batch
+        self.db_path = db_path
+        self.init_db = init_db
+        self.batch_size = batch_size or int(os.getenv("DB_BATCH_SIZE", 500))
+        self.flush_interval = flush_interval or float(os.getenv("DB_FLUSH_INTERVAL", 0.5))
+        self.max_queue = max_queue or int(os.getenv("DB_QUEUE_SIZE", 50000))
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=self.max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._idle = threading.Condition()
+        self._busy = False
+
+        self.rows_written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-batch-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, row) -> bool:
+        """Queue a row without blocking; returns False if it was dropped"""
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far has been written"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._queue.unfinished_tasks or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stop(self, timeout: Optional[float] = 10.0) -> bool:
+        """
+        Write what is still queued, then close the connection
+        timeout bounds the whole call; returns False if the writer had not
+        finished by then, and the rows it had not written may be lost
+        """
+        if self._thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        thread, self._thread = self._thread, None
+        if thread.is_alive():
+            try:
+                # A full queue behind a stuck writer must not hang shutdown
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                print(f"Database writer did not stop: {self._queue.qsize()} rows left unwritten")
+                return False
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return not thread.is_alive()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if self.init_db is not None:
+            self.init_db(conn)
+            conn.commit()
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            stopping = False
+            while not stopping:
+                first = self._queue.get()
+                if first is _STOP:
+                    self._task_done(1)
+                    break
+
+                batch = [first]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        row = self._queue.get(timeout=max(remaining, 0)) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if row is _STOP:
+                        stopping = True
+                        self._task_done(1)
+                        break
+                    batch.append(row)
+
+                self._write(conn, batch)
+                self._task_done(len(batch))
+        finally:
+            conn.close()
+
+    def _write(self, conn: sqlite3.Connection, batch: List):
+        with self._idle:
+            self._busy = True
+        started = time.perf_counter()
+        try:
+            with conn:
+                self.write_batch(conn, batch)
+            self.rows_written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.errors += 1
+            self.dropped += len(batch)
+            self.last_error = str(e)
+            print(f"Database error: {e}")
+        elapsed = (time.perf_counter() - started) * 1000
+        self.last_flush_ms = elapsed
+        self.max_flush_ms = max(self.max_flush_ms, elapsed)
+        self._total_flush_ms += elapsed
+        with self._idle:
+            self._busy = False
+
+    def _task_done(self, count: int):
+        with self._idle:
+            for _ in range(count):
+                self._queue.task_done()
+            self._idle.notify_all()
+
+    def get_stats(self) -> Dict:
+        return {
+            'queue_depth': self._queue.qsize(),
+            'max_queue': self.max_queue,
+            'batch_size': self.batch_size,
+            'flush_interval': self.flush_interval,
+            'rows_written': self.rows_written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'flush_ms': {
+                'last': round(self.last_flush_ms, 3),
+                'avg': round(self._total_flush_ms / self.batches, 3) if self.batches else None,
+                'max': round(self.max_flush_ms, 3)
+            }
+        }
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Storage and queries for analysis events in crowd_events.db
+
+Events are stored in a compact typed layout: epoch timestamps, risk levels
+as indexes into RISK_LEVELS, one column per prediction field, and stream
+names and action lists interned in small lookup tables. A database still
+in the old JSON layout is migrated in place by init_db, or ahead of time
+with `python event_store.py migrate`.
+"""
+
+import argparse
+import json
+import base64
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from risk_predictor import HORIZONS, RISK_LEVELS
+
+DB_PATH = 'crowd_events.db'
+MAX_PAGE_SIZE = 1000
+
+PREDICTION_FIELDS = ('level', 'detections', 'confidence', 'lower', 'upper')
+EVENT_COLUMNS = (
+    'timestamp', 'stream_id', 'current_risk', 'current_confidence', 'detections'
+) + tuple(
+    f'{field}_{horizon}' for horizon in HORIZONS for field in PREDICTION_FIELDS
+) + ('action_set_id',)
+COLUMN_INDEX = {name: index for index, name in enumerate(EVENT_COLUMNS)}
+LEGACY_INDEXES = ('idx_events_timestamp', 'idx_events_stream_time', 'idx_events_risk_time')
+
+
+def init_db(conn: sqlite3.Connection, templates: Optional[Dict[str, List[str]]] = None) -> Optional[Dict]:
+    """
+    Create the schema, migrating an events table in the old layout
+    templates (safety_actions.ACTION_TEMPLATES) pre-seed the action
+    texts. Returns the migration report when one ran
+    """
+    # Only takes effect on a new database; lets retention free pages incrementally
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    if is_legacy(conn):
+        return migrate_legacy(conn, templates)
+    _create_schema(conn)
+    if templates:
+        seed_action_texts(conn, templates)
+    return None
+
+
+def is_legacy(conn: sqlite3.Connection) -> bool:
+    return 'video_filename' in [row[1] for row in conn.execute('PRAGMA table_info(events)')]
+
+
+def _create_schema(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS streams (
+            id INTEGER PRIMARY KEY,
+            video_filename TEXT UNIQUE NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS action_texts (
+            id INTEGER PRIMARY KEY,
+            text TEXT UNIQUE NOT NULL
+        )
+    ''')
+    # Each distinct action list is stored once, as the comma-joined ids of its texts
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS action_sets (
+            id INTEGER PRIMARY KEY,
+            text_ids TEXT UNIQUE NOT NULL
+        )
+    ''')
+    prediction_columns = ''.join(
+        f'''
+            level_{horizon} INTEGER,
+            detections_{horizon} INTEGER,
+            confidence_{horizon} REAL,
+            lower_{horizon} INTEGER,
+            upper_{horizon} INTEGER,'''
+        for horizon in HORIZONS
+    )
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            timestamp REAL NOT NULL,
+            stream_id INTEGER NOT NULL,
+            current_risk INTEGER NOT NULL,
+            current_confidence REAL,
+            detections INTEGER,{prediction_columns}
+            action_set_id INTEGER
+        )
+    ''')
+    # Every query pages newest first, optionally narrowed by stream or risk
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_events_stream_time ON events (stream_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_events_risk_time ON events (current_risk, timestamp)')
+
+
+def seed_action_texts(conn: sqlite3.Connection, templates: Dict[str, List[str]]):
+    conn.executemany(
+        'INSERT OR IGNORE INTO action_texts (text) VALUES (?)',
+        [(text,) for level in RISK_LEVELS for text in templates.get(level, [])]
+    )
+
+
+def pending_event(file_id: str, analysis: Dict, predictions: Dict, actions: Dict) -> tuple:
+    """
+    The row store_event queues: EVENT_COLUMNS order, with the stream name
+    in place of stream_id and the action list in place of action_set_id.
+    The writer interns both
+    """
+    row = [
+        analysis['timestamp'],
+        file_id,
+        RISK_LEVELS.index(analysis['risk_level']),
+        analysis['confidence'],
+        analysis['detections']
+    ]
+    for horizon in HORIZONS:
+        row.extend(_prediction_fields(predictions.get(horizon)))
+    row.append(tuple(actions['actions']))
+    return tuple(row)
+
+
+def _prediction_fields(prediction: Optional[Dict]) -> tuple:
+    if not prediction or prediction.get('level') not in RISK_LEVELS:
+        return (None,) * len(PREDICTION_FIELDS)
+    interval = prediction.get('interval') or {}
+    return (
+        RISK_LEVELS.index(prediction['level']),
+        prediction.get('predicted_detections'),
+        prediction.get('confidence'),
+        interval.get('lower'),
+        interval.get('upper')
+    )
+
+
+class EventEncoder:
+    """
+    Turns pending events into stored rows
+    Stream and action-list ids are cached, so after the first sighting a
+    row costs no extra queries. Call clear() when a transaction that may
+    have created ids is rolled back
+    """
+
+    def __init__(self):
+        self._streams: Dict[str, int] = {}
+        self._texts: Dict[str, int] = {}
+        self._sets: Dict[tuple, int] = {}
+
+    def clear(self):
+        self._streams.clear()
+        self._texts.clear()
+        self._sets.clear()
+
+    def stream_id(self, conn: sqlite3.Connection, name: str) -> int:
+        stream_id = self._streams.get(name)
+        if stream_id is None:
+            stream_id = self._streams[name] = _intern(conn, 'streams', 'video_filename', name)
+        return stream_id
+
+    def action_set_id(self, conn: sqlite3.Connection, actions: Optional[tuple]) -> Optional[int]:
+        if actions is None:
+            return None
+        set_id = self._sets.get(actions)
+        if set_id is None:
+            text_ids = []
+            for text in actions:
+                text_id = self._texts.get(text)
+                if text_id is None:
+                    text_id = self._texts[text] = _intern(conn, 'action_texts', 'text', text)
+                text_ids.append(str(text_id))
+            set_id = self._sets[actions] = _intern(conn, 'action_sets', 'text_ids', ','.join(text_ids))
+        return set_id
+
+    def encode(self, conn: sqlite3.Connection, pending: Iterable[tuple]) -> List[tuple]:
+        stream_index, actions_index = COLUMN_INDEX['stream_id'], COLUMN_INDEX['action_set_id']
+        rows = []
+        for event in pending:
+            row = list(event)
+            row[stream_index] = self.stream_id(conn, event[stream_index])
+            row[actions_index] = self.action_set_id(conn, event[actions_index])
+            rows.append(tuple(row))
+        return rows
+
+
+def _intern(conn: sqlite3.Connection, table: str, column: str, value: str) -> int:
+    conn.execute(f'INSERT OR IGNORE INTO {table} ({column}) VALUES (?)', (value,))
+    return conn.execute(f'SELECT id FROM {table} WHERE {column} = ?', (value,)).fetchone()[0]
+
+
+def insert_events(conn: sqlite3.Connection, rows: List[tuple]):
+    """Insert encoded rows (EVENT_COLUMNS order)"""
+    conn.executemany(f'''
+        INSERT INTO events ({', '.join(EVENT_COLUMNS)})
+        VALUES ({', '.join('?' for _ in EVENT_COLUMNS)})
+    ''', rows)
+
+
+def migrate_legacy(conn: sqlite3.Connection, templates: Optional[Dict[str, List[str]]] = None,
+                   chunk_size: int = 10000) -> Dict:
+    """
+    Convert an events table in the old layout (text timestamps and levels,
+    JSON predictions and actions) in a single transaction
+    The stored factors and category of each prediction are not carried
+    over; category follows from the level
+    """
+    started = time.perf_counter()
+    conn.commit()
+    conn.execute('BEGIN')
+    try:
+        conn.execute('ALTER TABLE events RENAME TO events_legacy')
+        # Indexes follow the renamed table; free their names for the new one
+        for name in LEGACY_INDEXES:
+            conn.execute(f'DROP INDEX IF EXISTS {name}')
+        _create_schema(conn)
+        if templates:
+            seed_action_texts(conn, templates)
+
+        encoder = EventEncoder()
+        cursor = conn.execute('''
+            SELECT timestamp, video_filename, current_risk, current_confidence, detections,
+                   prediction_10min, prediction_30min, actions
+            FROM events_legacy ORDER BY timestamp
+        ''')
+        migrated = skipped = 0
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            pending = []
+            for timestamp, video, risk, confidence, detections, p10, p30, actions in chunk:
+                if timestamp is None or video is None or risk not in RISK_LEVELS:
+                    skipped += 1
+                    continue
+                row = [to_epoch(timestamp), video, RISK_LEVELS.index(risk), confidence, detections]
+                row.extend(_prediction_fields(json.loads(p10) if p10 else None))
+                row.extend(_prediction_fields(json.loads(p30) if p30 else None))
+                row.append(tuple(json.loads(actions)) if actions else None)
+                pending.append(tuple(row))
+            insert_events(conn, encoder.encode(conn, pending))
+            migrated += len(pending)
+
+        conn.execute('DROP TABLE events_legacy')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {'migrated': migrated, 'skipped': skipped, 'seconds': round(time.perf_counter() - started, 2)}
+
+
+def to_epoch(value) -> float:
+    """Accept a datetime, epoch seconds or an ISO datetime string"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def encode_cursor(timestamp: float, event_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([timestamp, event_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    timestamp, event_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return float(timestamp), int(event_id)
+
+
+def stream_id(conn: sqlite3.Connection, video_filename: str) -> Optional[int]:
+    row = conn.execute('SELECT id FROM streams WHERE video_filename = ?', (video_filename,)).fetchone()
+    return row[0] if row else None
+
+
+class Lookups:
+    """Stream names and action lists referenced by a set of stored rows"""
+
+    def __init__(self, conn: sqlite3.Connection, rows: Sequence[Sequence], offset: int = 0):
+        stream_ids = {row[offset + COLUMN_INDEX['stream_id']] for row in rows}
+        set_ids = {row[offset + COLUMN_INDEX['action_set_id']] for row in rows} - {None}
+        self.streams = dict(_select_in(conn, 'SELECT id, video_filename FROM streams', stream_ids))
+        sets = dict(_select_in(conn, 'SELECT id, text_ids FROM action_sets', set_ids))
+        text_ids = {int(text_id) for ids in sets.values() for text_id in ids.split(',') if text_id}
+        texts = dict(_select_in(conn, 'SELECT id, text FROM action_texts', text_ids))
+        self.actions = {
+            set_id: [texts[int(text_id)] for text_id in ids.split(',') if text_id]
+            for set_id, ids in sets.items()
+        }
+
+
+def _select_in(conn: sqlite3.Connection, query: str, ids: Iterable[int]) -> List[tuple]:
+    ids = list(ids)
+    rows = []
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        rows += conn.execute(f"{query} WHERE id IN ({', '.join('?' for _ in chunk)})", chunk).fetchall()
+    return rows
+
+
+def decode_event(event_id: int, row: Sequence, lookups: Lookups) -> Dict:
+    """A stored row in the readable layout /events and the archives use"""
+    event = {
+        "id": event_id,
+        "timestamp": datetime.fromtimestamp(row[COLUMN_INDEX['timestamp']]).isoformat(" "),
+        "video_filename": lookups.streams.get(row[COLUMN_INDEX['stream_id']]),
+        "current_risk": RISK_LEVELS[row[COLUMN_INDEX['current_risk']]],
+        "current_confidence": row[COLUMN_INDEX['current_confidence']],
+        "detections": row[COLUMN_INDEX['detections']]
+    }
+    for horizon in HORIZONS:
+        level = row[COLUMN_INDEX[f'level_{horizon}']]
+        event[f"prediction_{horizon}"] = None if level is None else {
+            "level": RISK_LEVELS[level],
+            "predicted_detections": row[COLUMN_INDEX[f'detections_{horizon}']],
+            "confidence": row[COLUMN_INDEX[f'confidence_{horizon}']],
+            "interval": {
+                "lower": row[COLUMN_INDEX[f'lower_{horizon}']],
+                "upper": row[COLUMN_INDEX[f'upper_{horizon}']]
+            }
+        }
+    event["actions"] = lookups.actions.get(row[COLUMN_INDEX['action_set_id']])
+    return event
+
+
+def query_events(
+    video_filename: Optional[str] = None,
+    risk: Optional[Sequence[str]] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    cursor: Optional[Tuple[float, int]] = None,
+    limit: int = 50,
+    decode_json: bool = True,
+    db_path: str = DB_PATH
+) -> Dict:
+    """
+    Newest events first, one page at a time
+    Pages are keyset-paginated on (timestamp, id): pass the previous page's
+    next_cursor to continue. since is inclusive, until exclusive (epoch
+    seconds). With decode_json off, rows are the flat stored columns, with
+    levels as RISK_LEVELS indexes, instead of nested predictions and actions
+    """
+    clauses, params = [], []
+    if since is not None:
+        clauses.append('timestamp >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('timestamp < ?')
+        params.append(until)
+    if cursor:
+        clauses.append('(timestamp, id) < (?, ?)')
+        params.extend(cursor)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    select = f"SELECT id, {', '.join(EVENT_COLUMNS)} FROM events"
+    order = "ORDER BY timestamp DESC, id DESC LIMIT ?"
+
+    conn = sqlite3.connect(db_path)
+    try:
+        if video_filename:
+            stream = stream_id(conn, video_filename)
+            if stream is None:
+                return {"events": [], "next_cursor": None}
+            clauses.insert(0, 'stream_id = ?')
+            params.insert(0, stream)
+
+        if risk:
+            # One index range per level, merged, rather than sorting every match
+            parts, query_params = [], []
+            for level in risk:
+                where = ' AND '.join(['current_risk = ?'] + clauses)
+                parts.append(f"SELECT * FROM ({select} WHERE {where} {order})")
+                query_params += [RISK_LEVELS.index(level)] + params + [limit + 1]
+            query = f"{' UNION ALL '.join(parts)} {order}"
+            query_params.append(limit + 1)
+        else:
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+            query = f"{select} {where} {order}"
+            query_params = params + [limit + 1]
+
+        rows = conn.execute(query, query_params).fetchall()
+        page = rows[:limit]
+        lookups = Lookups(conn, page, offset=1)
+    finally:
+        conn.close()
+
+    if decode_json:
+        events = [decode_event(row[0], row[1:], lookups) for row in page]
+    else:
+        columns = ('id',) + EVENT_COLUMNS
+        events = []
+        for row in page:
+            event = dict(zip(columns, row))
+            event['video_filename'] = lookups.streams.get(event['stream_id'])
+            events.append(event)
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last[1], last[0])
+    return {"events": events, "next_cursor": next_cursor}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the crowd_events.db events schema")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    migrate = subcommands.add_parser("migrate", help="Convert an events table in the old JSON layout")
+    migrate.add_argument("--db", default=DB_PATH, help="Events database")
+    migrate.add_argument("--chunk-size", type=int, default=10000, help="Rows converted per batch")
+    args = parser.parse_args()
+
+    import rollups
+    from safety_actions import ACTION_TEMPLATES
+
+    try:
+        conn = sqlite3.connect(args.db, timeout=30)
+        try:
+            if not is_legacy(conn):
+                print("✅ Events table is already in the compact layout")
+                return
+            result = migrate_legacy(conn, ACTION_TEMPLATES, args.chunk_size)
+            # Old rollups are carried over to the new stream ids, and the
+            # buckets raw events still cover are recomputed
+            rollups.init_rollups(conn)
+            rebuilt = rollups.rebuild(conn)
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"❌ Migration error: {e}")
+        sys.exit(1)
+    print(f"✅ Migrated {result['migrated']} events ({result['skipped']} skipped) in {result['seconds']}s")
+    print(f"   Rebuilt {rebuilt['rollup_rows']} rollup rows")
+
+
+if __name__ == "__main__":
+    main()
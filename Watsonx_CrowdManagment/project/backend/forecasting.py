@@ -0,0 +1,295 @@
+import math
+import time
+from functools import lru_cache
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Two-sided 90% prediction interval
+Z_90 = 1.645
+
+
+def normal_cdf_array(x: np.ndarray) -> np.ndarray:
+    """Vectorized normal CDF (Abramowitz and Stegun 7.1.26, error < 1.5e-7)"""
+    z = np.abs(x) / math.sqrt(2)
+    t = 1 / (1 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1 - poly * np.exp(-z * z)
+    return 0.5 * (1 + np.sign(x) * erf)
+
+
+@lru_cache(maxsize=64)
+def _utc_offset(hour: int) -> int:
+    """Local UTC offset in seconds during an hour since the epoch"""
+    return time.localtime(hour * 3600).tm_gmtoff
+
+
+class HoltBank:
+    """
+    Online crowd-count forecasters for many streams, one row each: exponentially
+    weighted level and linear trend (Holt's method) plus an additive
+    time-of-day profile
+
+    The state lives in parallel arrays (level, trend, last time, residual
+    variance, time-of-day profile and forecast checkpoints), so updating and
+    forecasting a batch of streams are array operations over their rows.
+    Smoothing is expressed as time constants rather than per-sample weights,
+    so irregular or high frame rates behave the same as slow sampling.
+    Prediction intervals use the squared errors of earlier forecasts once
+    their horizon has passed (a few checkpoints per horizon); until then
+    they fall back to the one-step residual spread.
+    """
+
+    def __init__(
+        self,
+        horizons: Sequence[float] = (600, 1800),
+        level_seconds: float = 30.0,
+        trend_seconds: float = 300.0,
+        damping_seconds: float = 1800.0,
+        season_buckets: int = 96,
+        season_days: float = 7.0,
+        error_alpha: float = 0.1,
+        checkpoints: int = 16,
+        capacity: int = 16
+    ):
+        self.horizons = tuple(horizons)
+        self.level_seconds = level_seconds
+        self.trend_seconds = trend_seconds
+        self.damping_seconds = damping_seconds
+        self.season_buckets = season_buckets
+        # A bucket is live for 1440 / season_buckets minutes a day, so the
+        # profile averages roughly the last season_days days of that slot
+        self.season_seconds = season_days * 86400 / season_buckets
+        self.error_alpha = error_alpha
+        self.checkpoints = checkpoints
+        # Minimum spacing of the checkpoints kept per horizon
+        self._spacing = np.array(self.horizons, dtype=np.float64) / checkpoints
+
+        self.capacity = 0
+        self._free: List[int] = []
+        self._allocate(max(1, capacity))
+
+    def _allocate(self, capacity: int):
+        """Grow every state array to capacity rows; new rows start empty"""
+        old = self.capacity
+        shapes = {
+            'level': ((), np.float64),  # Deseasonalized level
+            'trend': ((), np.float64),  # Change per second
+            'last_time': ((), np.float64),
+            'samples': ((), np.int64),
+            'residual_var': ((), np.float64),
+            'seasonal': ((self.season_buckets,), np.float64),
+            # Per horizon: error variance of matured forecasts, and a ring of
+            # pending checkpoints (target time, forecast mean) oldest first
+            'error_var': ((len(self.horizons),), np.float64),
+            'matured': ((len(self.horizons),), np.int64),
+            'made_at': ((len(self.horizons),), np.float64),
+            'head': ((len(self.horizons),), np.int64),
+            'pending': ((len(self.horizons),), np.int64),
+            'due': ((len(self.horizons), self.checkpoints), np.float64),
+            'predicted': ((len(self.horizons), self.checkpoints), np.float64)
+        }
+        for name, (shape, dtype) in shapes.items():
+            grown = np.zeros((capacity,) + shape, dtype=dtype)
+            if old:
+                grown[:old] = getattr(self, name)
+            setattr(self, name, grown)
+        self.capacity = capacity
+        self._free.extend(range(capacity - 1, old - 1, -1))
+        for row in range(old, capacity):
+            self._reset(row)
+
+    def _reset(self, row: int):
+        for name in ('level', 'trend', 'samples', 'residual_var', 'seasonal', 'error_var',
+                     'matured', 'head', 'pending', 'due', 'predicted'):
+            getattr(self, name)[row] = 0
+        self.last_time[row] = np.nan
+        self.made_at[row] = np.nan
+
+    def add(self) -> int:
+        """Row for a new stream"""
+        if not self._free:
+            self._allocate(self.capacity * 2)
+        return self._free.pop()
+
+    def remove(self, row: int):
+        """Free a finished stream's row for reuse"""
+        self._reset(row)
+        self._free.append(row)
+
+    def __len__(self) -> int:
+        return self.capacity - len(self._free)
+
+    def _buckets(self, timestamps: np.ndarray) -> np.ndarray:
+        # One UTC offset per batch: its timestamps are seconds apart, not
+        # across a daylight saving change
+        offset = _utc_offset(int(timestamps.max() // 3600))
+        minute_of_day = ((timestamps + offset) % 86400) // 60
+        return (minute_of_day * self.season_buckets // 1440).astype(np.intp)
+
+    def update(self, rows: np.ndarray, values: np.ndarray, timestamps: np.ndarray):
+        """Fold one observation per row into the state; rows must be distinct"""
+        rows = np.asarray(rows, dtype=np.intp)
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        buckets = self._buckets(timestamps)
+        seasonal = self.seasonal[rows, buckets]
+        self._score_checkpoints(rows, values, timestamps)
+
+        first = self.samples[rows] == 0
+        level = self.level[rows]
+        trend = self.trend[rows]
+        dt = np.where(first, 1.0, np.maximum(timestamps - self.last_time[rows], 1e-3))
+        predicted = level + trend * dt
+        error = values - seasonal - predicted
+        self.residual_var[rows] += np.where(
+            first, 0.0, self.error_alpha * (error ** 2 - self.residual_var[rows])
+        )
+
+        alpha = 1 - np.exp(-dt / self.level_seconds)
+        beta = 1 - np.exp(-dt / self.trend_seconds)
+        gamma = 1 - np.exp(-dt / self.season_seconds)
+        new_level = np.where(first, values - seasonal, predicted + alpha * error)
+        self.trend[rows] = np.where(first, trend, trend + beta * ((new_level - level) / dt - trend))
+        self.seasonal[rows, buckets] = np.where(first, seasonal, seasonal + gamma * (values - new_level - seasonal))
+        self.level[rows] = new_level
+        self.last_time[rows] = timestamps
+        self.samples[rows] += 1
+        self._add_checkpoints(rows, timestamps)
+
+    def trend_offset(self, rows: np.ndarray, horizon: float) -> np.ndarray:
+        """Damped trend so long horizons do not extrapolate without bound"""
+        return self.trend[rows] * self.damping_seconds * (1 - math.exp(-horizon / self.damping_seconds))
+
+    def _seasonal_at(self, rows: np.ndarray, horizon: float) -> np.ndarray:
+        """Time-of-day term at each row's last time plus horizon"""
+        last_time = self.last_time[rows]
+        targets = np.where(np.isnan(last_time), time.time(), last_time) + horizon
+        return self.seasonal[rows, self._buckets(targets)]
+
+    def components(self, rows: np.ndarray, horizon: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(level, trend offset, seasonal term, error sd) arrays for a horizon"""
+        rows = np.asarray(rows, dtype=np.intp)
+        return (
+            self.level[rows], self.trend_offset(rows, horizon),
+            self._seasonal_at(rows, horizon), self.error_sd(rows, horizon)
+        )
+
+    def error_sd(self, rows: np.ndarray, horizon: float) -> np.ndarray:
+        index = self.horizons.index(horizon) if horizon in self.horizons else None
+        # Not calibrated yet: widen the one-step spread with the horizon
+        spread = np.sqrt(self.residual_var[rows] * (1 + horizon / self.level_seconds))
+        if index is None:
+            return spread
+        return np.where(self.matured[rows, index] >= 3, np.sqrt(self.error_var[rows, index]), spread)
+
+    def forecast_mean(self, rows: np.ndarray, horizon: float) -> np.ndarray:
+        return np.maximum(0.0, self.level[rows] + self.trend_offset(rows, horizon) + self._seasonal_at(rows, horizon))
+
+    def _add_checkpoints(self, rows: np.ndarray, timestamps: np.ndarray):
+        for index, horizon in enumerate(self.horizons):
+            pending = self.pending[rows, index]
+            # Keep only a handful of checkpoints spread over each horizon
+            add = (pending == 0) | (timestamps - self.made_at[rows, index] >= self._spacing[index])
+            if not add.any():
+                continue
+            rows_added, pending, times = rows[add], pending[add], timestamps[add]
+            head = self.head[rows_added, index]
+            slot = (head + pending) % self.checkpoints
+            self.due[rows_added, index, slot] = times + horizon
+            self.predicted[rows_added, index, slot] = self.forecast_mean(rows_added, horizon)
+            self.made_at[rows_added, index] = times
+            # A full ring drops its oldest checkpoint
+            full = pending == self.checkpoints
+            self.head[rows_added, index] = np.where(full, (head + 1) % self.checkpoints, head)
+            self.pending[rows_added, index] = np.where(full, pending, pending + 1)
+
+    def _score_checkpoints(self, rows: np.ndarray, values: np.ndarray, timestamps: np.ndarray):
+        head = self.head[rows]
+        pending = self.pending[rows]
+        stream = np.arange(len(rows))[:, None]
+        horizon = np.arange(len(self.horizons))
+        due = self.due[rows[:, None], horizon, head]
+        if not ((pending > 0) & (due <= timestamps[:, None])).any():
+            return
+        error_var = self.error_var[rows]
+        matured = np.zeros_like(pending)
+        # Checkpoints mature oldest first, so each step scores the next one
+        # of every ring that has one due
+        for step in range(self.checkpoints):
+            slot = (head + step) % self.checkpoints
+            ready = (
+                (step < pending) & (matured == step)
+                & (self.due[rows[stream], horizon, slot] <= timestamps[:, None])
+            )
+            if not ready.any():
+                break
+            errors = (values[:, None] - self.predicted[rows[stream], horizon, slot]) ** 2
+            error_var = np.where(ready, error_var + self.error_alpha * (errors - error_var), error_var)
+            matured += ready
+        self.error_var[rows] = error_var
+        self.head[rows] = (head + matured) % self.checkpoints
+        self.pending[rows] = pending - matured
+        self.matured[rows] += matured
+
+
+class HoltForecaster:
+    """
+    One stream's row of a HoltBank, with a single-stream interface
+    Without a bank it gets a private one, sized for one stream
+    """
+
+    def __init__(self, bank: HoltBank = None, **kwargs):
+        self.bank = bank if bank is not None else HoltBank(capacity=1, **kwargs)
+        self.row = self.bank.add()
+        self._rows = np.array([self.row], dtype=np.intp)
+        self.horizons = self.bank.horizons
+        self.level_seconds = self.bank.level_seconds
+        self.trend_seconds = self.bank.trend_seconds
+        self.damping_seconds = self.bank.damping_seconds
+
+    @property
+    def level(self) -> float:
+        return float(self.bank.level[self.row])
+
+    @property
+    def trend(self) -> float:
+        return float(self.bank.trend[self.row])
+
+    @property
+    def last_time(self):
+        last_time = float(self.bank.last_time[self.row])
+        return None if math.isnan(last_time) else last_time
+
+    @property
+    def samples(self) -> int:
+        return int(self.bank.samples[self.row])
+
+    @property
+    def residual_var(self) -> float:
+        return float(self.bank.residual_var[self.row])
+
+    def update(self, value: float, timestamp: float):
+        """Fold one observation into the model state"""
+        self.bank.update(self._rows, [value], [timestamp])
+
+    def components(self, horizon: float) -> Tuple[float, float, float, float]:
+        """(level, trend offset, seasonal term, error sd) for a horizon"""
+        return tuple(float(column[0]) for column in self.bank.components(self._rows, horizon))
+
+    def error_sd(self, horizon: float) -> float:
+        return float(self.bank.error_sd(self._rows, horizon)[0])
+
+    def forecast(self, horizon: float) -> Dict:
+        level, trend_offset, seasonal, sd = self.components(horizon)
+        mean = max(0.0, level + trend_offset + seasonal)
+        return {
+            'mean': mean,
+            'sd': sd,
+            'lower': max(0.0, mean - Z_90 * sd),
+            'upper': mean + Z_90 * sd
+        }
+
+    def release(self):
+        """Give the row back to the bank"""
+        self.bank.remove(self.row)
@@ -0,0 +1,225 @@
+import os
+import re
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Sequence
+
+import numpy as np
+
+CATEGORIES = """
+    Categories:
+    1. Good to go / Low crowd
+    2. Moderate crowd, no danger
+    3. Very crowded, attention needed
+    4. Stampede risk / Red alert
+    """
+_ANSWER = re.compile(r'^\s*(?:situation\s*)?(\d+)\s*[:.)-]\s*(.+?)\s*$', re.IGNORECASE)
+
+
+def single_prompt(situation: Dict) -> str:
+    return f"""
+    Current crowd count: {situation['crowd_count']}
+    Time: {situation['time']}
+    Status: {situation['status']}
+
+    Predict the situation for the next 10 minutes. {CATEGORIES}"""
+
+
+def batch_prompt(situations: Sequence[Dict]) -> str:
+    lines = "\n".join(
+        f"    Situation {number}: crowd count {situation['crowd_count']}, "
+        f"time {situation['time']}, status {situation['status']}"
+        for number, situation in enumerate(situations, 1)
+    )
+    return f"""
+    Predict the situation for the next 10 minutes at each of these places. {CATEGORIES}
+{lines}
+
+    Answer with exactly one line per situation, as "<situation number>: <category>".
+    """
+
+
+def parse_batch(text: str, count: int) -> List[Optional[str]]:
+    """The answer for each of count situations, None where the model gave none"""
+    answers: List[Optional[str]] = [None] * count
+    for line in text.splitlines():
+        match = _ANSWER.match(line)
+        if match and 1 <= int(match.group(1)) <= count and answers[int(match.group(1)) - 1] is None:
+            answers[int(match.group(1)) - 1] = match.group(2)
+    return answers
+
+
+class LLMRequest:
+    """One situation waiting for a verdict"""
+
+    def __init__(self, situation: Dict, fallback: str, deadline: float):
+        self.situation = situation
+        self.fallback = fallback
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    def resolve(self, prediction: str, source: str):
+        if not self.future.done():
+            self.future.set_result({'prediction': prediction, 'source': source})
+
+
+class LLMDispatcher:
+    """
+    Queue in front of the Watsonx generation endpoint
+    At most max_concurrent upstream calls run at once. While they are busy
+    requests pile up, and up to max_batch of them go out together as one
+    numbered prompt. A request not answered by its deadline, or whose call
+    fails, gets the fallback verdict the caller supplied
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[str, int], Awaitable[str]],
+        max_concurrent: Optional[int] = None,
+        max_batch: Optional[int] = None,
+        batch_window: Optional[float] = None,
+        deadline: Optional[float] = None,
+        single_tokens: int = 100,
+        tokens_per_situation: int = 25,
+        samples: int = 1000
+    ):
+        self.generate = generate
+        self.max_concurrent = max_concurrent or int(os.getenv("LLM_MAX_CONCURRENT", 4))
+        self.max_batch = max_batch or int(os.getenv("LLM_MAX_BATCH", 8))
+        self.batch_window = batch_window if batch_window is not None else float(os.getenv("LLM_BATCH_WINDOW", 0.05))
+        self.deadline = deadline or float(os.getenv("LLM_DEADLINE", 10))
+        self.single_tokens = single_tokens
+        self.tokens_per_situation = tokens_per_situation
+
+        self._queue: Deque[LLMRequest] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._calls: set = set()
+        self._queue_wait: Deque[float] = deque(maxlen=samples)
+        self._latency: Deque[float] = deque(maxlen=samples)
+        self.stats = {
+            'requests': 0,
+            'answered': 0,
+            'upstream_calls': 0,
+            'batched_situations': 0,
+            'fallbacks': {'deadline': 0, 'error': 0, 'unparsed': 0}
+        }
+
+    def _start(self):
+        if self._collector is None or self._collector.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+            self._collector = asyncio.create_task(self._collect())
+
+    async def submit(self, situation: Dict, fallback: str, deadline: Optional[float] = None) -> Dict:
+        """
+        Verdict for one situation: {'prediction', 'source'}, where source is
+        'watsonx' or 'fallback'. Never raises for upstream failures
+        """
+        self._start()
+        timeout = deadline if deadline is not None else self.deadline
+        request = LLMRequest(situation, fallback, time.monotonic() + timeout)
+        self._queue.append(request)
+        self.stats['requests'] += 1
+        self._wakeup.set()
+        try:
+            return await asyncio.wait_for(asyncio.shield(request.future), timeout)
+        except asyncio.TimeoutError:
+            self.stats['fallbacks']['deadline'] += 1
+            request.resolve(fallback, 'fallback')
+            return request.future.result()
+
+    async def _collect(self):
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await self._slots.acquire()
+            if len(self._queue) < self.max_batch and self.batch_window > 0:
+                # Give requests arriving together a moment to join the batch
+                await asyncio.sleep(self.batch_window)
+
+            batch = []
+            now = time.monotonic()
+            while self._queue and len(batch) < self.max_batch:
+                request = self._queue.popleft()
+                if request.deadline > now and not request.future.done():
+                    batch.append(request)
+            if not batch:
+                self._slots.release()
+                continue
+
+            call = asyncio.create_task(self._call(batch))
+            self._calls.add(call)
+            call.add_done_callback(self._calls.discard)
+
+    async def _call(self, batch: List[LLMRequest]):
+        started = time.monotonic()
+        for request in batch:
+            self._queue_wait.append(started - request.enqueued_at)
+        self.stats['upstream_calls'] += 1
+        self.stats['batched_situations'] += len(batch)
+        try:
+            if len(batch) == 1:
+                answers = [await self.generate(single_prompt(batch[0].situation), self.single_tokens)]
+            else:
+                text = await self.generate(
+                    batch_prompt([request.situation for request in batch]),
+                    self.tokens_per_situation * len(batch)
+                )
+                answers = parse_batch(text, len(batch))
+            self._latency.append(time.monotonic() - started)
+        except Exception as e:
+            print(f"LLM dispatcher error: {e}")
+            self._latency.append(time.monotonic() - started)
+            answers = [None] * len(batch)
+            reason = 'error'
+        else:
+            reason = 'unparsed'
+        finally:
+            self._slots.release()
+
+        for request, answer in zip(batch, answers):
+            if request.future.done():
+                continue
+            if answer:
+                self.stats['answered'] += 1
+                request.resolve(answer, 'watsonx')
+            else:
+                self.stats['fallbacks'][reason] += 1
+                request.resolve(request.fallback, 'fallback')
+
+    async def shutdown(self):
+        tasks = list(self._calls) + ([self._collector] if self._collector is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for request in self._queue:
+            request.resolve(request.fallback, 'fallback')
+        self._queue.clear()
+
+    @staticmethod
+    def _percentiles(samples: Deque[float]) -> Dict:
+        if not samples:
+            return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+        p50, p95, p99 = np.percentile(np.fromiter(samples, dtype=np.float64), (50, 95, 99)) * 1000
+        return {'p50': round(float(p50), 1), 'p95': round(float(p95), 1), 'p99': round(float(p99), 1)}
+
+    def get_stats(self) -> Dict:
+        fallbacks = sum(self.stats['fallbacks'].values())
+        return {
+            **self.stats,
+            'fallbacks': dict(self.stats['fallbacks']),
+            'queued': len(self._queue),
+            'in_flight': len(self._calls),
+            'max_concurrent': self.max_concurrent,
+            'avg_batch_size': round(
+                self.stats['batched_situations'] / self.stats['upstream_calls'], 2
+            ) if self.stats['upstream_calls'] else 0.0,
+            'fallback_rate': round(fallbacks / self.stats['requests'], 3) if self.stats['requests'] else 0.0,
+            'queue_wait_ms': self._percentiles(self._queue_wait),
+            'upstream_latency_ms': self._percentiles(self._latency)
+        }
@@ -0,0 +1,235 @@
+import os
+import re
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from risk_predictor import RISK_LEVELS
+
+# Reasons to ask the LLM, most important first
+REASONS = ('transition', 'sustained', 'disagreement')
+BREACH_LEVEL = RISK_LEVELS.index('overcrowd')
+_LEADING_CATEGORY = re.compile(r'^\W*([1-4])\b')
+_KEYWORDS = (
+    ('stampede', ('stampede', 'red alert')),
+    ('overcrowd', ('overcrowd', 'very crowded', 'very much crowded', 'attention needed')),
+    ('moderate', ('moderate',)),
+    ('good', ('good to go', 'low crowd', 'well managed'))
+)
+
+
+def verdict_level(text: Optional[str]) -> Optional[str]:
+    """Risk level an LLM answer or fallback category names, if any"""
+    if not text:
+        return None
+    match = _LEADING_CATEGORY.match(text)
+    if match:
+        return RISK_LEVELS[int(match.group(1)) - 1]
+    lowered = text.lower()
+    for level, keywords in _KEYWORDS:
+        if any(keyword in lowered for keyword in keywords):
+            return level
+    return None
+
+
+class StreamGate:
+    """
+    Decides, frame by frame, whether one stream's situation is worth an LLM call
+    - transition: the level stayed higher for confirm_frames frames, or
+      lower for deescalate_seconds
+    - sustained: the level stayed at overcrowd or above for sustain_seconds
+      since the breach began or the last call
+    - disagreement: the 10-minute forecast differed from the last verdict
+      for confirm_frames frames in a row, once per verdict
+    A reason arising within min_interval of the last call, or while a call
+    is pending, is held and asked about as soon as allowed. Times are the
+    analysis timestamps, so they run in scene time like the forecasters
+    """
+
+    def __init__(self, min_interval: float, sustain_seconds: float, deescalate_seconds: float, confirm_frames: int):
+        self.min_interval = min_interval
+        self.sustain_seconds = sustain_seconds
+        self.deescalate_seconds = deescalate_seconds
+        self.confirm_frames = confirm_frames
+
+        self.confirmed: Optional[int] = None
+        self.higher_level = 0
+        self.higher_frames = 0
+        self.lower_since: Optional[float] = None
+        self.breach_since: Optional[float] = None
+        self.disagree_frames = 0
+        self.disagreement_asked = False
+        self.due: Optional[str] = None
+        self.pending = False
+        self.last_query_at: Optional[float] = None
+        self.verdict: Optional[Dict] = None
+
+    def check(self, level: int, forecast: int, now: float) -> Optional[str]:
+        """The reason to call the LLM now, or None"""
+        reason = None
+        # Hysteresis: a level change only counts once it has held for a while,
+        # so counts hovering around a threshold do not flap
+        if self.confirmed is None:
+            self.confirmed = level
+            reason = 'transition'
+        elif level > self.confirmed:
+            self.lower_since = None
+            self.higher_level = level if not self.higher_frames else min(self.higher_level, level)
+            self.higher_frames += 1
+            if self.higher_frames >= self.confirm_frames:
+                self.confirmed = self.higher_level
+                self.higher_frames = 0
+                reason = 'transition'
+        elif level < self.confirmed:
+            self.higher_frames = 0
+            if self.lower_since is None:
+                self.lower_since = now
+            elif now - self.lower_since >= self.deescalate_seconds:
+                self.confirmed = level
+                self.lower_since = None
+                reason = 'transition'
+        else:
+            self.higher_frames = 0
+            self.lower_since = None
+
+        if self.confirmed >= BREACH_LEVEL:
+            if self.breach_since is None:
+                self.breach_since = now
+            last = max(self.breach_since, self.last_query_at if self.last_query_at is not None else self.breach_since)
+            if reason is None and now - last >= self.sustain_seconds:
+                reason = 'sustained'
+        else:
+            self.breach_since = None
+
+        verdict = self.verdict['level'] if self.verdict else None
+        if verdict is not None and RISK_LEVELS[forecast] != verdict:
+            self.disagree_frames += 1
+        else:
+            self.disagree_frames = 0
+        if reason is None and self.disagree_frames >= self.confirm_frames and not self.disagreement_asked:
+            self.disagreement_asked = True
+            reason = 'disagreement'
+
+        if reason is not None and (self.due is None or REASONS.index(reason) < REASONS.index(self.due)):
+            self.due = reason
+        if self.due is None or self.pending:
+            return None
+        if self.last_query_at is not None and now - self.last_query_at < self.min_interval:
+            return None
+
+        reason, self.due = self.due, None
+        self.pending = True
+        self.last_query_at = now
+        return reason
+
+    def record(self, verdict: Optional[Dict]):
+        self.pending = False
+        if verdict is not None:
+            self.verdict = verdict
+            self.disagree_frames = 0
+            self.disagreement_asked = False
+
+
+class EscalationGate:
+    """
+    Calls the LLM for a stream only when its StreamGate finds a reason
+    Calls run in the background through ask(analysis, predictions); every
+    update of the stream carries the latest verdict in the meantime
+    """
+
+    def __init__(
+        self,
+        ask: Callable[[Dict, Dict], Awaitable[Dict]],
+        min_interval: Optional[float] = None,
+        sustain_seconds: Optional[float] = None,
+        deescalate_seconds: Optional[float] = None,
+        confirm_frames: Optional[int] = None
+    ):
+        self.ask = ask
+        self.min_interval = min_interval if min_interval is not None else float(os.getenv("LLM_GATE_MIN_INTERVAL", 30))
+        self.sustain_seconds = sustain_seconds or float(os.getenv("LLM_GATE_SUSTAIN", 120))
+        self.deescalate_seconds = deescalate_seconds if deescalate_seconds is not None else float(
+            os.getenv("LLM_GATE_DEESCALATE", 60)
+        )
+        self.confirm_frames = confirm_frames or int(os.getenv("LLM_GATE_CONFIRM_FRAMES", 3))
+        self.enabled = os.getenv("LLM_GATE_ENABLED", "true").lower() == "true"
+
+        self.streams: Dict[str, StreamGate] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            'frames': 0,
+            'calls': 0,
+            'avoided': 0,
+            'errors': 0,
+            'reasons': {reason: 0 for reason in REASONS}
+        }
+
+    def observe(self, stream_id: str, analysis: Dict, predictions: Dict) -> Optional[Dict]:
+        """Check a new analysis, maybe start a call, and return the latest verdict"""
+        if not self.enabled:
+            return None
+        gate = self.streams.get(stream_id)
+        if gate is None:
+            gate = self.streams[stream_id] = StreamGate(
+                self.min_interval, self.sustain_seconds, self.deescalate_seconds, self.confirm_frames
+            )
+
+        self.stats['frames'] += 1
+        reason = gate.check(
+            RISK_LEVELS.index(analysis['risk_level']),
+            RISK_LEVELS.index(predictions['10min']['level']),
+            analysis['timestamp']
+        )
+        if reason is None:
+            self.stats['avoided'] += 1
+        else:
+            self.stats['calls'] += 1
+            self.stats['reasons'][reason] += 1
+            self._tasks[stream_id] = asyncio.create_task(
+                self._call(stream_id, gate, reason, analysis, predictions)
+            )
+        return gate.verdict
+
+    def verdict(self, stream_id: str) -> Optional[Dict]:
+        gate = self.streams.get(stream_id)
+        return gate.verdict if gate is not None else None
+
+    async def _call(self, stream_id: str, gate: StreamGate, reason: str, analysis: Dict, predictions: Dict):
+        verdict = None
+        try:
+            answer = await self.ask(analysis, predictions)
+            verdict = {
+                **answer,
+                'level': verdict_level(answer.get('prediction')),
+                'reason': reason,
+                'asked_at': analysis['timestamp']
+            }
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"LLM gate error: {e}")
+        finally:
+            gate.record(verdict)
+            if self._tasks.get(stream_id) is asyncio.current_task():
+                del self._tasks[stream_id]
+
+    def close_stream(self, stream_id: str):
+        self.streams.pop(stream_id, None)
+        task = self._tasks.pop(stream_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'reasons': dict(self.stats['reasons']),
+            'enabled': self.enabled,
+            'streams': len(self.streams),
+            'pending': len(self._tasks),
+            'avoided_rate': round(self.stats['avoided'] / self.stats['frames'], 3) if self.stats['frames'] else 0.0
+        }
@@ -0,0 +1,101 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of async call results with request coalescing
+    Callers asking for a key that is already being fetched await the same
+    call instead of starting another, and successful results are kept for
+    ttl seconds, up to max_entries least recently used. Failures, and
+    results cacheable() rejects, are not cached, so the next caller retries
+    """
+
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ):
+        self.cacheable = cacheable
+        self.ttl = ttl if ttl is not None else float(os.getenv("PREDICT_CACHE_TTL", 60))
+        self.max_entries = max_entries or int(os.getenv("PREDICT_CACHE_SIZE", 1024))
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'errors': 0,
+            'evicted': 0,
+            'expired': 0
+        }
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.stats['expired'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    async def get_or_call(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        """The cached result for key, or the result of one shared call"""
+        value = self.get(key)
+        if value is not None:
+            self.stats['hits'] += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+        else:
+            self.stats['misses'] += 1
+            task = asyncio.create_task(self._fetch(key, call))
+            # Retrieved here too, in case every caller went away before it failed
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self._inflight[key] = task
+        # A caller going away must not cancel the call others are waiting on
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Hashable, call: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await call()
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        if self.cacheable is None or self.cacheable(value):
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        requests = self.stats['hits'] + self.stats['misses'] + self.stats['coalesced']
+        return {
+            **self.stats,
+            'entries': len(self._entries),
+            'in_flight': len(self._inflight),
+            'upstream_saved_rate': round(
+                (self.stats['hits'] + self.stats['coalesced']) / requests, 3
+            ) if requests else 0.0
+        }
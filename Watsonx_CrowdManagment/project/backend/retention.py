@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Retention for crowd_events.db
+
+Raw events older than the TTL are archived to compressed files on local
+disk, one file per day, then deleted. Rollups already cover them, and old
+1-minute and 15-minute rollups are compacted away in favour of the coarser
+buckets. Freed pages are returned with incremental VACUUM. Work is done in
+short transactions so the event writer is never held up for long.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import event_store
+import rollups
+
+_COLUMNS = ('id',) + event_store.EVENT_COLUMNS
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class RetentionPolicy:
+    """
+    Retention settings
+    A TTL of 0 days keeps that data forever
+    """
+
+    def __init__(
+        self,
+        raw_days: Optional[float] = None,
+        rollup_1m_days: Optional[float] = None,
+        rollup_15m_days: Optional[float] = None,
+        archive_dir: Optional[str] = None,
+        archive_format: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        vacuum_pages: Optional[int] = None
+    ):
+        self.raw_days = raw_days if raw_days is not None else float(os.getenv("RETENTION_RAW_DAYS", 7))
+        self.rollup_days = {
+            60: rollup_1m_days if rollup_1m_days is not None else float(os.getenv("RETENTION_ROLLUP_1M_DAYS", 30)),
+            900: rollup_15m_days if rollup_15m_days is not None else float(os.getenv("RETENTION_ROLLUP_15M_DAYS", 365))
+        }
+        self.archive_dir = archive_dir or os.getenv("ARCHIVE_DIR", "archive")
+        self.archive_format = archive_format or os.getenv("ARCHIVE_FORMAT", "ndjson")
+        if self.archive_format == "parquet" and not parquet_available():
+            print("pyarrow is not installed; archiving as NDJSON instead of Parquet")
+            self.archive_format = "ndjson"
+        self.chunk_size = chunk_size or int(os.getenv("RETENTION_CHUNK", 5000))
+        self.vacuum_pages = vacuum_pages or int(os.getenv("RETENTION_VACUUM_PAGES", 2000))
+
+
+def database_size(conn: sqlite3.Connection, db_path: str) -> Dict:
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+    freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    wal_path = f"{db_path}-wal"
+    return {
+        'bytes': page_size * page_count,
+        'free_bytes': page_size * freelist,
+        'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        'auto_vacuum': ('none', 'full', 'incremental')[conn.execute('PRAGMA auto_vacuum').fetchone()[0]]
+    }
+
+
+class RetentionManager:
+    """
+    Applies a RetentionPolicy to the events database
+    Archives are written before the rows they hold are deleted, so a crash
+    can at worst leave a row both archived and still in the table
+    """
+
+    def __init__(self, policy: Optional[RetentionPolicy] = None, db_path: str = event_store.DB_PATH):
+        self.policy = policy or RetentionPolicy()
+        self.db_path = db_path
+        self.last_report: Optional[Dict] = None
+        self.runs = 0
+
+    def run_once(self, now: Optional[float] = None, dry_run: bool = False) -> Dict:
+        now = now or time.time()
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            size_before = database_size(conn, self.db_path)
+            report = {
+                'started_at': datetime.fromtimestamp(now).isoformat(),
+                'dry_run': dry_run,
+                'size_before': size_before
+            }
+
+            if self.policy.raw_days > 0:
+                cutoff = now - self.policy.raw_days * 86400
+                report['events'] = self._expire_events(conn, cutoff, dry_run)
+                report['prediction_history'] = self._expire_predictions(conn, cutoff, dry_run)
+
+            report['rollups'] = {}
+            for bucket_seconds, days in self.policy.rollup_days.items():
+                if days > 0:
+                    report['rollups'][rollups_bucket(bucket_seconds)] = self._compact_rollups(
+                        conn, bucket_seconds, now - days * 86400, dry_run
+                    )
+
+            report['vacuum'] = self._vacuum(conn) if not dry_run else None
+            report['size_after'] = database_size(conn, self.db_path)
+            report['bytes_reclaimed'] = size_before['bytes'] - report['size_after']['bytes']
+            report['seconds'] = round(time.perf_counter() - started, 3)
+        finally:
+            conn.close()
+
+        self.runs += 1
+        self.last_report = report
+        return report
+
+    def _expire_events(self, conn: sqlite3.Connection, cutoff: float, dry_run: bool) -> Dict:
+        if dry_run:
+            count = conn.execute('SELECT COUNT(*) FROM events WHERE timestamp < ?', (cutoff,)).fetchone()[0]
+            return {'expired': count, 'archived': 0, 'deleted': 0, 'files': []}
+
+        archived = deleted = 0
+        files = set()
+        while True:
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM events WHERE timestamp < ? ORDER BY timestamp LIMIT ?",
+                (cutoff, self.policy.chunk_size)
+            ).fetchall()
+            if not rows:
+                break
+            files.update(self._archive(conn, rows))
+            archived += len(rows)
+            with conn:
+                deleted += conn.executemany(
+                    'DELETE FROM events WHERE id = ?', [(row[0],) for row in rows]
+                ).rowcount
+        return {'expired': archived, 'archived': archived, 'deleted': deleted, 'files': sorted(files)}
+
+    def _archive(self, conn: sqlite3.Connection, rows: List[tuple]) -> List[str]:
+        """
+        Append rows to one archive file per day of their timestamps
+        Archives hold the readable layout /events returns, so they do not
+        depend on the lookup tables of the database they came from
+        """
+        os.makedirs(self.policy.archive_dir, exist_ok=True)
+        lookups = event_store.Lookups(conn, rows, offset=1)
+        by_day: Dict[str, List[Dict]] = {}
+        for row in rows:
+            event = event_store.decode_event(row[0], row[1:], lookups)
+            by_day.setdefault(event['timestamp'][:10], []).append(event)
+
+        paths = []
+        for day, events in by_day.items():
+            if self.policy.archive_format == "parquet":
+                paths.append(self._write_parquet(day, events))
+            else:
+                path = os.path.join(self.policy.archive_dir, f"events-{day}.ndjson.gz")
+                # Appending adds a gzip member; readers see one continuous stream
+                with gzip.open(path, 'at', encoding='utf-8') as handle:
+                    for event in events:
+                        handle.write(json.dumps(event) + '\n')
+                paths.append(path)
+        return paths
+
+    def _write_parquet(self, day: str, events: List[Dict]) -> str:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # Parquet files cannot be appended to, so each chunk gets its own part
+        part = 0
+        while True:
+            path = os.path.join(self.policy.archive_dir, f"events-{day}-{part:04d}.parquet")
+            if not os.path.exists(path):
+                break
+            part += 1
+        pq.write_table(pa.Table.from_pylist(events), path, compression='zstd')
+        return path
+
+    def _expire_predictions(self, conn: sqlite3.Connection, cutoff: float, dry_run: bool) -> Optional[Dict]:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'prediction_history'"
+        ).fetchone()
+        if not exists:
+            return None
+        if dry_run:
+            count = conn.execute('SELECT COUNT(*) FROM prediction_history WHERE timestamp < ?', (cutoff,)).fetchone()[0]
+            return {'expired': count, 'deleted': 0}
+        return {'deleted': self._delete_chunked(conn, 'prediction_history', 'timestamp < ?', (cutoff,))}
+
+    def _compact_rollups(self, conn: sqlite3.Connection, bucket_seconds: int, cutoff: float, dry_run: bool) -> Dict:
+        """Fine-grained buckets past their TTL; the coarser buckets keep their totals"""
+        where, params = 'bucket_seconds = ? AND bucket_start < ?', (bucket_seconds, int(cutoff))
+        if dry_run:
+            count = conn.execute(f'SELECT COUNT(*) FROM event_rollups WHERE {where}', params).fetchone()[0]
+            return {'expired': count, 'deleted': 0}
+        return {'deleted': self._delete_chunked(conn, 'event_rollups', where, params)}
+
+    def _delete_chunked(self, conn: sqlite3.Connection, table: str, where: str, params: tuple) -> int:
+        deleted = 0
+        while True:
+            with conn:
+                count = conn.execute(
+                    f'DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)',
+                    params + (self.policy.chunk_size,)
+                ).rowcount
+            deleted += count
+            if count < self.policy.chunk_size:
+                return deleted
+
+    def _vacuum(self, conn: sqlite3.Connection) -> Dict:
+        """Release free pages a few at a time; needs auto_vacuum=incremental"""
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if mode != 2:
+            return {'pages_released': 0, 'note': 'auto_vacuum is not incremental; run retention.py --convert once'}
+
+        released = 0
+        while True:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                break
+            conn.execute(f'PRAGMA incremental_vacuum({self.policy.vacuum_pages})').fetchall()
+            released += free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if free <= self.policy.vacuum_pages:
+                break
+        # Let the WAL shrink back once its pages are checkpointed
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        return {'pages_released': released}
+
+    def get_stats(self) -> Dict:
+        return {
+            'raw_days': self.policy.raw_days,
+            'rollup_days': {rollups_bucket(seconds): days for seconds, days in self.policy.rollup_days.items()},
+            'archive_dir': self.policy.archive_dir,
+            'archive_format': self.policy.archive_format,
+            'runs': self.runs,
+            'last_report': self.last_report
+        }
+
+
+def rollups_bucket(seconds: int) -> str:
+    return next((name for name, size in rollups.BUCKETS.items() if size == seconds), str(seconds))
+
+
+def convert_to_incremental(db_path: str = event_store.DB_PATH) -> Dict:
+    """
+    One-off full VACUUM that switches an existing database to incremental
+    auto_vacuum. It rewrites the whole file, so run it with the server stopped
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        before = database_size(conn, db_path)
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        after = database_size(conn, db_path)
+    finally:
+        conn.close()
+    return {'size_before': before, 'size_after': after}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply retention to crowd_events.db")
+    parser.add_argument("--db", default=event_store.DB_PATH, help="Events database")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would be removed")
+    parser.add_argument("--convert", action="store_true",
+                        help="Switch an existing database to incremental auto_vacuum (full VACUUM, server stopped)")
+    args = parser.parse_args()
+
+    try:
+        if args.convert:
+            result = convert_to_incremental(args.db)
+        else:
+            result = RetentionManager(db_path=args.db).run_once(dry_run=args.dry_run)
+    except Exception as e:
+        print(f"❌ Retention error: {e}")
+        sys.exit(1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
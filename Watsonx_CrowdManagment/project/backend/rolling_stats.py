@@ -0,0 +1,163 @@
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity ring buffer of compact numeric records
+    Records live in one preallocated NumPy structured array, so memory
+    stays constant however long a stream runs
+    """
+
+    def __init__(self, capacity: int, dtype: np.dtype):
+        self.capacity = max(1, capacity)
+        self.dtype = np.dtype(dtype)
+        self._data = np.zeros(self.capacity, dtype=self.dtype)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    def append(self, record: tuple) -> Optional[np.void]:
+        """Store a record; returns the record it overwrote once full"""
+        evicted = self._data[self._next].copy() if self._size == self.capacity else None
+        self._data[self._next] = record
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        return evicted
+
+    def last(self, n: Optional[int] = None) -> np.ndarray:
+        """The newest n records (all by default), oldest first"""
+        n = self._size if n is None else min(n, self._size)
+        start = (self._next - n) % self.capacity
+        if start + n <= self.capacity:
+            return self._data[start:start + n].copy()
+        return np.concatenate((self._data[start:], self._data[:self._next]))
+
+    def newest(self) -> Optional[np.void]:
+        if not self._size:
+            return None
+        return self._data[(self._next - 1) % self.capacity].copy()
+
+    def clear(self):
+        self._next = 0
+        self._size = 0
+
+
+class RollingStats:
+    """
+    Mean, variance, min, max and least-squares slope over the last
+    `window` values, each updated in O(1) per sample
+    - mean/variance: Welford's algorithm with removal of the oldest value
+    - min/max: monotonic deques
+    - slope: running sums of y and i*y over window-relative indices
+    """
+
+    def __init__(self, window: int):
+        self.window = max(1, window)
+        self._values = deque()
+        self._count = 0  # Samples pushed so far, used as the sample index
+
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._sum_y = 0.0
+        self._sum_iy = 0.0
+
+        self._min = deque()  # (index, value), values increasing
+        self._max = deque()  # (index, value), values decreasing
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def push(self, value: float):
+        value = float(value)
+        if len(self._values) == self.window:
+            self._remove_oldest()
+
+        # Welford add
+        n = len(self._values) + 1
+        delta = value - self._mean
+        self._mean += delta / n
+        self._m2 += delta * (value - self._mean)
+
+        # The new value sits at window-relative index n - 1
+        self._sum_iy += (n - 1) * value
+        self._sum_y += value
+        self._values.append(value)
+
+        index = self._count
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((index, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((index, value))
+
+        self._count += 1
+        oldest_index = self._count - len(self._values)
+        while self._min[0][0] < oldest_index:
+            self._min.popleft()
+        while self._max[0][0] < oldest_index:
+            self._max.popleft()
+
+    def _remove_oldest(self):
+        value = self._values.popleft()
+        n = len(self._values)
+        if n == 0:
+            self._mean = self._m2 = self._sum_y = self._sum_iy = 0.0
+            return
+
+        # Welford remove
+        delta = value - self._mean
+        self._mean -= delta / n
+        self._m2 = max(0.0, self._m2 - delta * (value - self._mean))
+
+        # The removed value had index 0; every remaining index shifts down by one
+        self._sum_y -= value
+        self._sum_iy -= self._sum_y
+
+    @property
+    def mean(self) -> float:
+        return self._mean
+
+    @property
+    def variance(self) -> float:
+        """Population variance, matching np.var"""
+        return self._m2 / len(self._values) if self._values else 0.0
+
+    @property
+    def std(self) -> float:
+        return self.variance ** 0.5
+
+    @property
+    def min(self) -> Optional[float]:
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self) -> Optional[float]:
+        return self._max[0][1] if self._max else None
+
+    @property
+    def slope(self) -> float:
+        """Least-squares slope per sample across the window"""
+        n = len(self._values)
+        if n < 2:
+            return 0.0
+        sum_i = n * (n - 1) / 2
+        sum_ii = (n - 1) * n * (2 * n - 1) / 6
+        return (n * self._sum_iy - sum_i * self._sum_y) / (n * sum_ii - sum_i ** 2)
+
+    @property
+    def first(self) -> Optional[float]:
+        return self._values[0] if self._values else None
+
+    @property
+    def last(self) -> Optional[float]:
+        return self._values[-1] if self._values else None
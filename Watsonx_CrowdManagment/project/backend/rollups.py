@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Time-bucketed rollups of analysis events
+
+Per stream and per 1-minute, 15-minute and 1-hour bucket: event count,
+mean/max detections, seconds spent in each risk level and max confidence.
+The batch writer updates them in the same transaction as the raw events,
+and `python rollups.py backfill` rebuilds them from the events table.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import event_store
+from risk_predictor import RISK_LEVELS
+
+BUCKETS = {'1m': 60, '15m': 900, '1h': 3600}
+LEVELS = RISK_LEVELS
+LEVEL_COLUMNS = tuple(f'seconds_{level}' for level in LEVELS)
+
+_COLUMN_INDEX = event_store.COLUMN_INDEX
+
+
+def init_rollups(conn: sqlite3.Connection) -> Optional[Dict]:
+    """
+    Create the rollup table. One still keyed by video_filename (from before
+    the compact events layout) is carried over to stream ids, since raw
+    events past retention can no longer rebuild it. Returns the number of
+    rows carried over when that ran
+    """
+    legacy = 'video_filename' in [row[1] for row in conn.execute('PRAGMA table_info(event_rollups)')]
+    if legacy:
+        conn.execute('ALTER TABLE event_rollups RENAME TO event_rollups_legacy')
+        conn.execute('DROP INDEX IF EXISTS idx_event_rollups_time')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS event_rollups (
+            stream_id INTEGER,
+            bucket_seconds INTEGER,
+            bucket_start INTEGER,
+            count INTEGER,
+            sum_detections INTEGER,
+            max_detections INTEGER,
+            {', '.join(f'{column} REAL' for column in LEVEL_COLUMNS)},
+            max_confidence REAL,
+            PRIMARY KEY (stream_id, bucket_seconds, bucket_start)
+        )
+    ''')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS idx_event_rollups_time ON event_rollups (bucket_seconds, bucket_start)'
+    )
+    if not legacy:
+        return None
+
+    conn.execute(
+        'INSERT OR IGNORE INTO streams (video_filename) SELECT DISTINCT video_filename FROM event_rollups_legacy'
+    )
+    values = f'bucket_seconds, bucket_start, count, sum_detections, max_detections, {", ".join(LEVEL_COLUMNS)}, max_confidence'
+    migrated = conn.execute(f'''
+        INSERT INTO event_rollups (stream_id, {values})
+        SELECT s.id, {', '.join(f'r.{column}' for column in values.split(', '))}
+        FROM event_rollups_legacy r JOIN streams s ON s.video_filename = r.video_filename
+    ''').rowcount
+    conn.execute('DROP TABLE event_rollups_legacy')
+    return {'migrated': migrated}
+
+
+class EventRollups:
+    """
+    Folds batches of event rows into the rollup table
+    Time in a risk level is the gap to the stream's next event, capped at
+    max_gap seconds, and is credited to the bucket of the earlier event.
+    The last event of each stream is remembered between batches. since
+    maps a stream to the first bucket_start, per bucket size, to fold
+    events into; earlier buckets are left alone
+    """
+
+    def __init__(self, max_gap: Optional[float] = None, since: Optional[Dict[int, Dict[int, int]]] = None):
+        self.max_gap = max_gap or float(os.getenv("ROLLUP_MAX_GAP", 10))
+        self.since = since or {}
+        self._last: Dict[int, Tuple[float, int]] = {}
+
+    def apply(self, conn: sqlite3.Connection, rows: Iterable[tuple]):
+        """Add stored event rows (in EVENT_COLUMNS order) to the rollups"""
+        cells: Dict[Tuple[int, int, int], List] = {}
+
+        def cell(stream: int, bucket_seconds: int, timestamp: float) -> List:
+            key = (stream, bucket_seconds, int(timestamp // bucket_seconds * bucket_seconds))
+            if key[2] < self.since.get(stream, {}).get(bucket_seconds, key[2]):
+                # Discarded: the bucket is kept as it is
+                return [0, 0, 0] + [0.0] * len(LEVELS) + [0.0]
+            values = cells.get(key)
+            if values is None:
+                # count, sum, max detections, seconds per level, max confidence
+                values = cells[key] = [0, 0, 0] + [0.0] * len(LEVELS) + [0.0]
+            return values
+
+        newest = 0.0
+        for row in rows:
+            stream = row[_COLUMN_INDEX['stream_id']]
+            timestamp = row[_COLUMN_INDEX['timestamp']]
+            level = row[_COLUMN_INDEX['current_risk']]
+            detections = row[_COLUMN_INDEX['detections']]
+            confidence = row[_COLUMN_INDEX['current_confidence']]
+            newest = max(newest, timestamp)
+
+            previous = self._last.get(stream)
+            if previous is not None and 0 <= timestamp - previous[0] <= self.max_gap:
+                for bucket_seconds in BUCKETS.values():
+                    cell(stream, bucket_seconds, previous[0])[3 + previous[1]] += timestamp - previous[0]
+            if previous is None or timestamp >= previous[0]:
+                self._last[stream] = (timestamp, level)
+
+            for bucket_seconds in BUCKETS.values():
+                values = cell(stream, bucket_seconds, timestamp)
+                values[0] += 1
+                values[1] += detections
+                values[2] = max(values[2], detections)
+                values[-1] = max(values[-1], confidence)
+
+        if len(self._last) > 1000:
+            # Streams silent for longer than max_gap can no longer add time
+            self._last = {
+                stream: last for stream, last in self._last.items()
+                if newest - last[0] <= self.max_gap
+            }
+
+        level_updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in LEVEL_COLUMNS)
+        conn.executemany(f'''
+            INSERT INTO event_rollups (
+                stream_id, bucket_seconds, bucket_start, count, sum_detections,
+                max_detections, {', '.join(LEVEL_COLUMNS)}, max_confidence
+            ) VALUES ({', '.join('?' for _ in range(7 + len(LEVELS)))})
+            ON CONFLICT (stream_id, bucket_seconds, bucket_start) DO UPDATE SET
+                count = count + excluded.count,
+                sum_detections = sum_detections + excluded.sum_detections,
+                max_detections = MAX(max_detections, excluded.max_detections),
+                {level_updates},
+                max_confidence = MAX(max_confidence, excluded.max_confidence)
+        ''', [key + tuple(values) for key, values in cells.items()])
+
+
+def query_rollups(
+    bucket: str = '1m',
+    video_filename: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    limit: int = 5000,
+    db_path: str = event_store.DB_PATH
+) -> Dict:
+    """Rollup rows oldest first; since is inclusive, until exclusive"""
+    clauses, params = ['r.bucket_seconds = ?'], [BUCKETS[bucket]]
+    if video_filename:
+        clauses.append('s.video_filename = ?')
+        params.append(video_filename)
+    if since is not None:
+        clauses.append('r.bucket_start >= ?')
+        params.append(int(since // BUCKETS[bucket] * BUCKETS[bucket]))
+    if until is not None:
+        clauses.append('r.bucket_start < ?')
+        params.append(until)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(f'''
+            SELECT s.video_filename, r.bucket_start, r.count, r.sum_detections, r.max_detections,
+                   {', '.join(f'r.{column}' for column in LEVEL_COLUMNS)}, r.max_confidence
+            FROM event_rollups r JOIN streams s ON s.id = r.stream_id
+            WHERE {' AND '.join(clauses)}
+            ORDER BY r.bucket_start, r.stream_id LIMIT ?
+        ''', params + [limit]).fetchall()
+    finally:
+        conn.close()
+
+    buckets = []
+    for row in rows:
+        video, start, count, total, peak = row[:5]
+        buckets.append({
+            'video_filename': video,
+            'bucket_start': datetime.fromtimestamp(start).isoformat(),
+            'bucket_epoch': start,
+            'count': count,
+            'mean_detections': round(total / count, 2) if count else None,
+            'max_detections': peak,
+            'seconds_by_level': {level: round(seconds, 3) for level, seconds in zip(LEVELS, row[5:5 + len(LEVELS)])},
+            'max_confidence': row[-1]
+        })
+    return {'bucket': bucket, 'bucket_seconds': BUCKETS[bucket], 'rollups': buckets}
+
+
+def rebuild(conn: sqlite3.Connection, video_filename: Optional[str] = None, chunk_size: int = 10000) -> Dict:
+    """
+    Recompute rollups from raw events on conn, for one stream or all of
+    them, without committing
+    Retention deletes raw events the rollups still cover, so only buckets
+    from a stream's oldest remaining event on are recomputed. The bucket
+    holding that event is kept too if it counts more events than remain
+    raw in it; streams with no raw events left are not touched
+    """
+    columns = ', '.join(event_store.EVENT_COLUMNS)
+    if video_filename:
+        stream = event_store.stream_id(conn, video_filename)
+        oldest = conn.execute(
+            'SELECT stream_id, MIN(timestamp) FROM events WHERE stream_id = ? GROUP BY stream_id', (stream,)
+        ).fetchall()
+    else:
+        oldest = conn.execute('SELECT stream_id, MIN(timestamp) FROM events GROUP BY stream_id').fetchall()
+
+    since: Dict[int, Dict[int, int]] = {}
+    for stream, first in oldest:
+        since[stream] = {}
+        for bucket_seconds in BUCKETS.values():
+            start = int(first // bucket_seconds * bucket_seconds)
+            kept = conn.execute(
+                'SELECT count FROM event_rollups WHERE stream_id = ? AND bucket_seconds = ? AND bucket_start = ?',
+                (stream, bucket_seconds, start)
+            ).fetchone()
+            if kept is not None:
+                raw = conn.execute(
+                    'SELECT COUNT(*) FROM events WHERE stream_id = ? AND timestamp >= ? AND timestamp < ?',
+                    (stream, start, start + bucket_seconds)
+                ).fetchone()[0]
+                if kept[0] > raw:
+                    start += bucket_seconds
+            since[stream][bucket_seconds] = start
+            conn.execute(
+                'DELETE FROM event_rollups WHERE stream_id = ? AND bucket_seconds = ? AND bucket_start >= ?',
+                (stream, bucket_seconds, start)
+            )
+
+    rollups = EventRollups(since=since)
+    events = 0
+    for stream, starts in since.items():
+        cursor = conn.execute(
+            f'SELECT {columns} FROM events WHERE stream_id = ? AND timestamp >= ? ORDER BY timestamp',
+            (stream, min(starts.values()))
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            rollups.apply(conn, rows)
+            events += len(rows)
+    return {'events': events, 'rollup_rows': conn.execute('SELECT COUNT(*) FROM event_rollups').fetchone()[0]}
+
+
+def backfill(db_path: str = event_store.DB_PATH, video_filename: Optional[str] = None,
+             chunk_size: int = 10000) -> Dict:
+    """
+    Rebuild rollups from raw events, for one stream or all of them
+    Buckets older than the raw events retention kept are left as they are.
+    Run it while the server is stopped, or only for streams that are no
+    longer being written, since live writes would be counted twice
+    """
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        event_store.init_db(conn)
+        init_rollups(conn)
+        # Everything is rebuilt in one transaction, so readers never see a partial table
+        result = rebuild(conn, video_filename, chunk_size)
+        conn.commit()
+    finally:
+        conn.close()
+    result['seconds'] = round(time.perf_counter() - started, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain crowd event rollups")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="Rebuild rollups from the events table")
+    backfill_parser.add_argument("--db", default=event_store.DB_PATH, help="Events database")
+    backfill_parser.add_argument("--video", help="Only rebuild this video_filename")
+    backfill_parser.add_argument("--chunk-size", type=int, default=10000, help="Events read per batch")
+    args = parser.parse_args()
+
+    try:
+        result = backfill(args.db, args.video, args.chunk_size)
+    except Exception as e:
+        print(f"❌ Backfill error: {e}")
+        sys.exit(1)
+    print(f"✅ Rolled up {result['events']} events into {result['rollup_rows']} rows in {result['seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,219 +1,289 @@
+import os
 import random
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple
 from datetime import datetime
 
+# Units deployed per risk level; a level's units are the first n of the venue's roster
+UNIT_COUNTS = {
+    'officers': {'good': 3, 'moderate': 5, 'overcrowd': 8, 'stampede': 12},
+    'barricades': {'good': 2, 'moderate': 3, 'overcrowd': 5, 'stampede': 7},
+    'medical': {'good': 1, 'moderate': 2, 'overcrowd': 3, 'stampede': 5}
+}
+
+# Action templates for each risk level
+ACTION_TEMPLATES = {
+    'good': (
+        'Monitoring active',
+        'Regular patrol schedule',
+        'Standard security protocols in place'
+    ),
+    'moderate': (
+        'Increased monitoring',
+        'Officer presence enhanced',
+        'Crowd flow observation active'
+    ),
+    'overcrowd': (
+        'Deploy more officers',
+        'Control entry flow',
+        'Activate crowd control measures',
+        'Increase surveillance',
+        'Prepare emergency protocols'
+    ),
+    'stampede': (
+        'EMERGENCY: Close nearby barricades',
+        'Call medical team',
+        'Re-route crowd immediately',
+        'Establish emergency corridors',
+        'Activate full emergency response',
+        'Contact emergency services'
+    )
+}
+# Fixed texts of the dynamic actions added to a level's templates; the
+# redirect share and emergency services ETA are added around them
+DYNAMIC_ACTIONS = {
+    'overcrowd': ('Open additional exit routes', 'Increase announcement frequency'),
+    'stampede': ('IMMEDIATE: Stop all entry points', 'Emergency evacuation protocol ACTIVE', 'Medical teams on standby')
+}
+
+# Statuses a unit can be given at each risk level
+OFFICER_STATUSES = {
+    'good': ('patrol', 'monitoring'),
+    'moderate': ('monitoring', 'positioned'),
+    'overcrowd': ('deployed', 'crowd_control'),
+    'stampede': ('emergency_response',)
+}
+BARRICADE_STATUSES = {
+    'good': ('open',),
+    'moderate': ('open',),
+    'overcrowd': ('open', 'controlled', 'partial'),
+    'stampede': ('closed', 'emergency_only')
+}
+MEDICAL_STATUSES = {'good': 'standby', 'moderate': 'ready', 'overcrowd': 'alert', 'stampede': 'active'}
+MEDICAL_EQUIPMENT_LEVELS = {'good': 'basic', 'moderate': 'basic', 'overcrowd': 'intermediate', 'stampede': 'advanced'}
+
+BARRICADE_TYPES = ('portable', 'fixed', 'temporary')
+MEDICAL_TYPES = ('ambulance', 'first_aid_station', 'mobile_unit')
+# Officers carry the first n items of EQUIPMENT at each risk level
+EQUIPMENT = ('radio', 'first_aid', 'megaphone', 'barrier_tape', 'emergency_kit', 'crowd_control_gear')
+EQUIPMENT_COUNTS = {'good': 2, 'moderate': 2, 'overcrowd': 4, 'stampede': 6}
+CHANNELS = ('Channel-1', 'Channel-2', 'Channel-3')
+
+
+class FrozenDict(dict):
+    """
+    Read-only dict for cached plans
+    Unlike types.MappingProxyType it pickles, so plans can be returned from
+    analysis worker processes
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("cached safety plans are read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value):
+    """A read-only copy of nested dicts and lists: FrozenDicts and tuples"""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
 class SafetyActionManager:
     """
     Manages proactive safety measures based on crowd risk levels
     Simulates deployment of officers, barricades, and medical units
+    Each venue gets one roster of units with fixed positions, drawn from an
+    RNG seeded by the venue, and the plan for a (venue, level) is built
+    once from it and cached. Cached plans and changes are shared, so they
+    are frozen: FrozenDicts and tuples
     """
     
-    def __init__(self):
+    def __init__(self, seed: Optional[int] = None):
         self.base_location = [28.6139, 77.2090]  # Sample location (Delhi, India)
+        self.seed = seed if seed is not None else int(os.getenv("SAFETY_PLAN_SEED", 0))
         self.deployed_resources = {
             'officers': [],
             'barricades': [],
             'medical': []
         }
-        
-        # Action templates for each risk level
-        self.action_templates = {
-            'good': [
-                'Monitoring active',
-                'Regular patrol schedule',
-                'Standard security protocols in place'
-            ],
-            'moderate': [
-                'Increased monitoring',
-                'Officer presence enhanced',
-                'Crowd flow observation active'
-            ],
-            'overcrowd': [
-                'Deploy more officers',
-                'Control entry flow',
-                'Activate crowd control measures',
-                'Increase surveillance',
-                'Prepare emergency protocols'
-            ],
-            'stampede': [
-                'EMERGENCY: Close nearby barricades',
-                'Call medical team',
-                'Re-route crowd immediately',
-                'Establish emergency corridors',
-                'Activate full emergency response',
-                'Contact emergency services'
-            ]
-        }
+        self._rosters: Dict[Tuple[float, float], Dict[str, List[Dict]]] = {}
+        self._plans: Dict[Tuple[Tuple[float, float], str], Dict] = {}
+        self._changes: Dict[Tuple[Tuple[float, float], str, str], Dict] = {}
+
+    def _venue(self, venue: Optional[Sequence[float]]) -> Tuple[float, float]:
+        lat, lng = venue if venue is not None else self.base_location
+        return round(float(lat), 6), round(float(lng), 6)
+    
+    def _rng(self, venue: Tuple[float, float], *parts) -> random.Random:
+        return random.Random(':'.join(str(part) for part in (self.seed, venue[0], venue[1]) + parts))
     
-    def get_actions(self, risk_level: str) -> Dict:
+    def get_actions(self, risk_level: str, venue: Optional[Sequence[float]] = None) -> Dict:
         """
         Get comprehensive safety actions for given risk level
+        venue is the [lat, lng] the units are placed around (base_location
+        by default). Returns the cached plan, built on first use
+        """
+        key = (self._venue(venue), risk_level)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plans[key] = freeze(self._build_plan(*key))
+        return plan
+    
+    def get_changes(self, from_level: str, to_level: str, venue: Optional[Sequence[float]] = None) -> Dict:
+        """
+        What changes between two levels' plans of a venue, per resource:
+        new statuses by unit id, and ids added or stood down
         """
-        actions = self._get_action_list(risk_level)
-        officers = self._deploy_officers(risk_level)
-        barricades = self._manage_barricades(risk_level)
-        medical = self._deploy_medical_units(risk_level)
+        venue = self._venue(venue)
+        key = (venue, from_level, to_level)
+        changes = self._changes.get(key)
+        if changes is None:
+            before = self.get_actions(from_level, venue)
+            after = self.get_actions(to_level, venue)
+            changes = {}
+            for resource in UNIT_COUNTS:
+                old = {unit['id']: unit for unit in before[resource]}
+                new = {unit['id']: unit for unit in after[resource]}
+                changes[resource] = {
+                    'status': {
+                        unit_id: unit['status'] for unit_id, unit in new.items()
+                        if unit_id in old and old[unit_id]['status'] != unit['status']
+                    },
+                    'added': [unit_id for unit_id in new if unit_id not in old],
+                    'removed': [unit_id for unit_id in old if unit_id not in new]
+                }
+            changes = self._changes[key] = freeze(changes)
+        return changes
+    
+    def _build_plan(self, venue: Tuple[float, float], risk_level: str) -> Dict:
+        roster = self._get_roster(venue)
+        rng = self._rng(venue, risk_level)
+        actions = self._get_action_list(risk_level, rng)
+        officers = self._deploy_officers(risk_level, roster['officers'], rng)
+        barricades = self._manage_barricades(risk_level, roster['barricades'], rng)
+        medical = self._deploy_medical_units(risk_level, roster['medical'])
         
         return {
             'actions': actions,
             'officers': officers,
             'barricades': barricades,
             'medical': medical,
-            'timestamp': datetime.now().isoformat(),
             'risk_level': risk_level,
             'total_resources': len(officers) + len(barricades) + len(medical)
         }
     
-    def _get_action_list(self, risk_level: str) -> List[str]:
+    def _get_roster(self, venue: Tuple[float, float]) -> Dict[str, List[Dict]]:
+        """Every unit the venue can deploy, with the attributes that never change"""
+        roster = self._rosters.get(venue)
+        if roster is not None:
+            return roster
+        
+        rng = self._rng(venue, 'roster')
+        spreads = {'officers': 0.01, 'barricades': 0.008, 'medical': 0.006}
+        roster = {}
+        for resource, counts in UNIT_COUNTS.items():
+            units = []
+            for i in range(max(counts.values())):
+                # Generate positions around the venue
+                lat_offset = rng.uniform(-spreads[resource], spreads[resource])
+                lng_offset = rng.uniform(-spreads[resource], spreads[resource])
+                unit = {'position': [venue[0] + lat_offset, venue[1] + lng_offset]}
+                if resource == 'barricades':
+                    unit['type'] = rng.choice(BARRICADE_TYPES)
+                    unit['capacity'] = rng.randint(50, 200)
+                elif resource == 'medical':
+                    unit['type'] = rng.choice(MEDICAL_TYPES)
+                    unit['personnel_count'] = rng.randint(2, 6)
+                    unit['response_time'] = f'{rng.randint(2, 8)} minutes'
+                units.append(unit)
+            roster[resource] = units
+        self._rosters[venue] = roster
+        return roster
+    
+    def _get_action_list(self, risk_level: str, rng: random.Random) -> List[str]:
         """Get action items for risk level"""
-        base_actions = self.action_templates.get(risk_level, self.action_templates['good'])
+        base_actions = list(ACTION_TEMPLATES.get(risk_level, ACTION_TEMPLATES['good']))
         
         # Add dynamic actions based on current conditions
         dynamic_actions = []
         
         if risk_level == 'overcrowd':
-            dynamic_actions.extend([
-                f'Redirect {random.randint(20, 40)}% of incoming crowd',
-                'Open additional exit routes',
-                'Increase announcement frequency'
-            ])
+            dynamic_actions.append(f'Redirect {rng.randint(20, 40)}% of incoming crowd')
+            dynamic_actions.extend(DYNAMIC_ACTIONS['overcrowd'])
         elif risk_level == 'stampede':
-            dynamic_actions.extend([
-                'IMMEDIATE: Stop all entry points',
-                'Emergency evacuation protocol ACTIVE',
-                'Medical teams on standby',
-                f'Emergency services ETA: {random.randint(3, 8)} minutes'
-            ])
+            dynamic_actions.extend(DYNAMIC_ACTIONS['stampede'])
+            dynamic_actions.append(f'Emergency services ETA: {rng.randint(3, 8)} minutes')
         
         return base_actions + dynamic_actions
     
-    def _deploy_officers(self, risk_level: str) -> List[Dict]:
+    def _deploy_officers(self, risk_level: str, roster: List[Dict], rng: random.Random) -> List[Dict]:
         """Deploy officers based on risk level"""
-        officer_counts = {
-            'good': 3,
-            'moderate': 5,
-            'overcrowd': 8,
-            'stampede': 12
-        }
-        
-        count = officer_counts.get(risk_level, 3)
+        count = UNIT_COUNTS['officers'].get(risk_level, 3)
+        equipment = self._get_officer_equipment(risk_level)
         officers = []
         
-        for i in range(count):
-            # Generate positions around the base location
-            lat_offset = random.uniform(-0.01, 0.01)
-            lng_offset = random.uniform(-0.01, 0.01)
-            
-            status = self._get_officer_status(risk_level)
-            
+        for i, unit in enumerate(roster[:count]):
             officer = {
                 'id': f'officer-{i+1}',
-                'position': [
-                    self.base_location[0] + lat_offset,
-                    self.base_location[1] + lng_offset
-                ],
-                'status': status,
-                'deployment_time': datetime.now().isoformat(),
-                'equipment': self._get_officer_equipment(risk_level),
-                'communication_channel': f'Channel-{(i % 3) + 1}'
+                'position': unit['position'],
+                'status': self._get_officer_status(risk_level, rng),
+                'equipment': equipment,
+                'communication_channel': CHANNELS[i % len(CHANNELS)]
             }
             officers.append(officer)
         
         return officers
     
-    def _get_officer_status(self, risk_level: str) -> str:
+    def _get_officer_status(self, risk_level: str, rng: random.Random) -> str:
         """Get officer status based on risk level"""
-        status_map = {
-            'good': random.choice(['patrol', 'monitoring']),
-            'moderate': random.choice(['monitoring', 'positioned']),
-            'overcrowd': random.choice(['deployed', 'crowd_control']),
-            'stampede': 'emergency_response'
-        }
-        return status_map.get(risk_level, 'patrol')
+        return rng.choice(OFFICER_STATUSES.get(risk_level, OFFICER_STATUSES['good']))
     
     def _get_officer_equipment(self, risk_level: str) -> List[str]:
         """Get equipment list for officers based on risk level"""
-        base_equipment = ['radio', 'first_aid']
-        
-        if risk_level in ['overcrowd', 'stampede']:
-            base_equipment.extend(['megaphone', 'barrier_tape'])
-        
-        if risk_level == 'stampede':
-            base_equipment.extend(['emergency_kit', 'crowd_control_gear'])
-        
-        return base_equipment
+        return list(EQUIPMENT[:EQUIPMENT_COUNTS.get(risk_level, EQUIPMENT_COUNTS['good'])])
     
-    def _manage_barricades(self, risk_level: str) -> List[Dict]:
+    def _manage_barricades(self, risk_level: str, roster: List[Dict], rng: random.Random) -> List[Dict]:
         """Manage barricades based on risk level"""
-        barricade_counts = {
-            'good': 2,
-            'moderate': 3,
-            'overcrowd': 5,
-            'stampede': 7
-        }
-        
-        count = barricade_counts.get(risk_level, 2)
+        count = UNIT_COUNTS['barricades'].get(risk_level, 2)
         barricades = []
         
-        for i in range(count):
-            lat_offset = random.uniform(-0.008, 0.008)
-            lng_offset = random.uniform(-0.008, 0.008)
-            
-            status = self._get_barricade_status(risk_level)
-            
+        for i, unit in enumerate(roster[:count]):
             barricade = {
                 'id': f'barricade-{i+1}',
-                'position': [
-                    self.base_location[0] + lat_offset,
-                    self.base_location[1] + lng_offset
-                ],
-                'status': status,
-                'type': random.choice(['portable', 'fixed', 'temporary']),
-                'capacity': random.randint(50, 200),
-                'last_updated': datetime.now().isoformat()
+                'position': unit['position'],
+                'status': self._get_barricade_status(risk_level, rng),
+                'type': unit['type'],
+                'capacity': unit['capacity']
             }
             barricades.append(barricade)
         
         return barricades
     
-    def _get_barricade_status(self, risk_level: str) -> str:
+    def _get_barricade_status(self, risk_level: str, rng: random.Random) -> str:
         """Get barricade status based on risk level"""
-        if risk_level in ['good', 'moderate']:
-            return 'open'
-        elif risk_level == 'overcrowd':
-            return random.choice(['open', 'controlled', 'partial'])
-        else:  # stampede
-            return random.choice(['closed', 'emergency_only'])
+        return rng.choice(BARRICADE_STATUSES.get(risk_level, BARRICADE_STATUSES['good']))
     
-    def _deploy_medical_units(self, risk_level: str) -> List[Dict]:
+    def _deploy_medical_units(self, risk_level: str, roster: List[Dict]) -> List[Dict]:
         """Deploy medical units based on risk level"""
-        medical_counts = {
-            'good': 1,
-            'moderate': 2,
-            'overcrowd': 3,
-            'stampede': 5
-        }
-        
-        count = medical_counts.get(risk_level, 1)
+        count = UNIT_COUNTS['medical'].get(risk_level, 1)
         medical_units = []
         
-        for i in range(count):
-            lat_offset = random.uniform(-0.006, 0.006)
-            lng_offset = random.uniform(-0.006, 0.006)
-            
-            status = self._get_medical_status(risk_level)
-            
+        for i, unit in enumerate(roster[:count]):
             medical_unit = {
                 'id': f'medical-{i+1}',
-                'position': [
-                    self.base_location[0] + lat_offset,
-                    self.base_location[1] + lng_offset
-                ],
-                'status': status,
-                'type': random.choice(['ambulance', 'first_aid_station', 'mobile_unit']),
-                'personnel_count': random.randint(2, 6),
+                'position': unit['position'],
+                'status': self._get_medical_status(risk_level),
+                'type': unit['type'],
+                'personnel_count': unit['personnel_count'],
                 'equipment_level': self._get_medical_equipment_level(risk_level),
-                'response_time': f'{random.randint(2, 8)} minutes'
+                'response_time': unit['response_time']
             }
             medical_units.append(medical_unit)
         
@@ -221,22 +291,11 @@ class SafetyActionManager:
     
     def _get_medical_status(self, risk_level: str) -> str:
         """Get medical unit status based on risk level"""
-        status_map = {
-            'good': 'standby',
-            'moderate': 'ready',
-            'overcrowd': 'alert',
-            'stampede': 'active'
-        }
-        return status_map.get(risk_level, 'standby')
+        return MEDICAL_STATUSES.get(risk_level, MEDICAL_STATUSES['good'])
     
     def _get_medical_equipment_level(self, risk_level: str) -> str:
         """Get medical equipment level based on risk"""
-        if risk_level in ['good', 'moderate']:
-            return 'basic'
-        elif risk_level == 'overcrowd':
-            return 'intermediate'
-        else:
-            return 'advanced'
+        return MEDICAL_EQUIPMENT_LEVELS.get(risk_level, MEDICAL_EQUIPMENT_LEVELS['good'])
     
     def get_resource_summary(self) -> Dict:
         """Get summary of all deployed resources"""
@@ -0,0 +1,199 @@
+import time
+import uuid
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+
+class SchedulerFull(Exception):
+    """Raised when a job is submitted while the pending queue is full"""
+
+
+class RoundRobinGate:
+    """
+    Limits how many frames are being analyzed at once across all streams
+    Free slots are handed out one stream at a time in rotation, so a
+    stream with many frames waiting cannot starve the others
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.active = 0
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    async def acquire(self, stream_id: str):
+        if self.active < self.capacity and not self._waiters:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(stream_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            queue = self._waiters.get(stream_id)
+            if queue is not None and future in queue:
+                queue.remove(future)
+                if not queue:
+                    del self._waiters[stream_id]
+            elif future.done() and not future.cancelled():
+                # The slot was handed to us just before cancellation
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            stream_id, queue = next(iter(self._waiters.items()))
+            future = queue.popleft()
+            # Move the stream to the back of the rotation
+            del self._waiters[stream_id]
+            if queue:
+                self._waiters[stream_id] = queue
+            if not future.done():
+                # The slot passes straight to the waiter; active is unchanged
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, stream_id: str):
+        await self.acquire(stream_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class StreamJob:
+    """
+    Scheduler-side state for one analysis job
+    The job id doubles as the stream id used by the analysis workers
+    """
+
+    def __init__(self, file_id: str, video_path: str, options: Optional[Dict] = None):
+        self.job_id = str(uuid.uuid4())
+        self.file_id = file_id
+        self.video_path = video_path
+        self.options = options or {}
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.frames_analyzed = 0
+        self.last_update: Optional[Dict] = None
+        self.last_boxes = None
+        self.pipeline_stats: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('completed', 'cancelled', 'failed')
+
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.job_id,
+            'file_id': self.file_id,
+            'options': self.options,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'frames_analyzed': self.frames_analyzed,
+            'last_update': self.last_update,
+            'pipeline': self.pipeline_stats,
+            'error': self.error
+        }
+
+
+class StreamScheduler:
+    """
+    Admits analysis jobs, runs at most max_concurrent of them at a time
+    and shares the analysis slots between running streams round-robin
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[StreamJob], Awaitable[None]],
+        max_concurrent: int = 8,
+        max_pending: int = 100,
+        frame_slots: int = 2,
+        history_size: int = 200
+    ):
+        self.runner = runner
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_pending = max_pending
+        self.history_size = history_size
+        self.gate = RoundRobinGate(frame_slots)
+
+        self._running = asyncio.Semaphore(self.max_concurrent)
+        self._jobs: "OrderedDict[str, StreamJob]" = OrderedDict()
+
+    def submit(self, file_id: str, video_path: str, options: Optional[Dict] = None) -> StreamJob:
+        """Queue a new job; raises SchedulerFull if too many are waiting"""
+        pending = sum(1 for job in self._jobs.values() if job.status == 'queued')
+        if pending >= self.max_pending:
+            raise SchedulerFull(f"{pending} jobs already waiting")
+
+        job = StreamJob(file_id, video_path, options)
+        self._jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run(job))
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Optional[StreamJob]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[StreamJob]:
+        return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[StreamJob]:
+        job = self._jobs.get(job_id)
+        if job is not None and not job.finished and job.task is not None:
+            job.task.cancel()
+        return job
+
+    async def shutdown(self):
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.finished]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            'max_concurrent': self.max_concurrent,
+            'max_pending': self.max_pending,
+            'jobs': counts,
+            'frame_slots': self.gate.capacity,
+            'frame_slots_active': self.gate.active,
+            'frames_waiting': self.gate.waiting
+        }
+
+    async def _run(self, job: StreamJob):
+        try:
+            async with self._running:
+                job.status = 'running'
+                job.started_at = time.time()
+                await self.runner(job)
+            job.status = 'completed'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond history_size"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
@@ -0,0 +1,34 @@
+import threading
+import time
+
+from db_writer import BatchWriter
+
+
+def test_stop_writes_what_is_queued(tmp_path):
+    written = []
+    writer = BatchWriter(lambda conn, batch: written.extend(batch), db_path=str(tmp_path / 'events.db'),
+                         batch_size=10, flush_interval=0.05)
+    writer.start()
+    for row in range(25):
+        assert writer.submit(row)
+
+    assert writer.stop(timeout=5)
+    assert written == list(range(25))
+
+
+def test_stop_is_bounded_when_the_writer_is_stuck(tmp_path):
+    release = threading.Event()
+    writer = BatchWriter(lambda conn, batch: release.wait(), db_path=str(tmp_path / 'events.db'),
+                         batch_size=1, flush_interval=0.05, max_queue=3)
+    writer.start()
+    writer.submit('stuck')
+    time.sleep(0.2)
+    while writer.submit('queued'):
+        pass
+
+    started = time.monotonic()
+    try:
+        assert not writer.stop(timeout=0.3)
+        assert time.monotonic() - started < 2
+    finally:
+        release.set()
@@ -0,0 +1,168 @@
+import re
+import asyncio
+
+from llm_dispatcher import LLMDispatcher, parse_batch
+from risk_predictor import RISK_CATEGORIES, level_for_detections
+
+SITUATION = re.compile(r'Situation (\d+): crowd count (\d+)')
+
+
+def situation(crowd_count: int) -> dict:
+    return {'crowd_count': crowd_count, 'time': '18:30', 'status': 'ongoing'}
+
+
+def fallback(crowd_count: int) -> str:
+    """The local verdict app.get_prediction supplies"""
+    return RISK_CATEGORIES[level_for_detections(crowd_count)]
+
+
+class FakeWatsonx:
+    """
+    Async generate that answers every situation of a prompt with its crowd
+    count, optionally waiting for release first or failing
+    """
+
+    def __init__(self, delay: float = 0.0, reply=None, error: Exception = None):
+        self.delay = delay
+        self.reply = reply
+        self.error = error
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started = asyncio.Event()
+        self.release = None
+
+    async def generate(self, prompt: str, max_new_tokens: int) -> str:
+        self.prompts.append(prompt)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.started.set()
+        try:
+            if self.release is not None:
+                await self.release.wait()
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            if self.reply is not None:
+                return self.reply
+            numbered = SITUATION.findall(prompt)
+            if not numbered:
+                return 'Moderate crowd, no danger'
+            return '\n'.join(f'{number}: crowd {count}' for number, count in reversed(numbered))
+        finally:
+            self.in_flight -= 1
+
+
+def test_parse_batch_splits_numbered_answers():
+    text = 'Here you go:\nSituation 2: Stampede risk\n1) Good to go\n3 - Moderate\n2: ignored repeat\n9: out of range'
+    assert parse_batch(text, 4) == ['Good to go', 'Stampede risk', 'Moderate', None]
+
+
+def test_queued_situations_share_one_batched_prompt():
+    async def main():
+        fake = FakeWatsonx()
+        fake.release = asyncio.Event()
+        dispatcher = LLMDispatcher(fake.generate, max_concurrent=1, max_batch=8, batch_window=0.01, deadline=5)
+        first = asyncio.create_task(dispatcher.submit(situation(10), fallback(10)))
+        await fake.started.wait()
+        # These wait for the only slot, then go out together
+        queued = [asyncio.create_task(dispatcher.submit(situation(count), fallback(count))) for count in (60, 150, 250)]
+        await asyncio.sleep(0.05)
+        fake.release.set()
+        results = await asyncio.gather(first, *queued)
+        await dispatcher.shutdown()
+        return fake, dispatcher, results
+
+    fake, dispatcher, results = asyncio.run(main())
+    assert len(fake.prompts) == 2
+    assert SITUATION.findall(fake.prompts[1]) == [('1', '60'), ('2', '150'), ('3', '250')]
+    assert [result['prediction'] for result in results[1:]] == ['crowd 60', 'crowd 150', 'crowd 250']
+    assert all(result['source'] == 'watsonx' for result in results)
+    stats = dispatcher.get_stats()
+    assert stats['upstream_calls'] == 2
+    assert stats['batched_situations'] == 4
+    assert stats['avg_batch_size'] == 2.0
+
+
+def test_in_flight_calls_stay_within_limit():
+    async def main():
+        fake = FakeWatsonx(delay=0.05)
+        dispatcher = LLMDispatcher(fake.generate, max_concurrent=2, max_batch=1, batch_window=0, deadline=5)
+        results = await asyncio.gather(*(dispatcher.submit(situation(count), fallback(count)) for count in range(1, 11)))
+        await dispatcher.shutdown()
+        return fake, results
+
+    fake, results = asyncio.run(main())
+    assert fake.max_in_flight == 2
+    assert len(fake.prompts) == 10
+    assert all(result['source'] == 'watsonx' for result in results)
+
+
+def test_deadline_falls_back_to_local_verdict():
+    async def main():
+        fake = FakeWatsonx(delay=1.0)
+        dispatcher = LLMDispatcher(fake.generate, max_concurrent=1, batch_window=0, deadline=0.1)
+        result = await dispatcher.submit(situation(250), fallback(250))
+        stats = dispatcher.get_stats()
+        await dispatcher.shutdown()
+        return result, stats
+
+    result, stats = asyncio.run(main())
+    assert result == {'prediction': RISK_CATEGORIES['stampede'], 'source': 'fallback'}
+    assert stats['fallbacks'] == {'deadline': 1, 'error': 0, 'unparsed': 0}
+
+
+def test_upstream_error_falls_back_to_local_verdict():
+    async def main():
+        fake = FakeWatsonx(error=RuntimeError('upstream down'))
+        dispatcher = LLMDispatcher(fake.generate, max_concurrent=1, batch_window=0, deadline=5)
+        result = await dispatcher.submit(situation(100), fallback(100))
+        stats = dispatcher.get_stats()
+        await dispatcher.shutdown()
+        return result, stats
+
+    result, stats = asyncio.run(main())
+    assert result == {'prediction': RISK_CATEGORIES['moderate'], 'source': 'fallback'}
+    assert stats['fallbacks'] == {'deadline': 0, 'error': 1, 'unparsed': 0}
+
+
+def test_unparseable_batch_falls_back_to_local_verdicts():
+    async def main():
+        fake = FakeWatsonx(reply='I cannot classify these situations.')
+        dispatcher = LLMDispatcher(fake.generate, max_concurrent=1, max_batch=8, batch_window=0.05, deadline=5)
+        results = await asyncio.gather(*(dispatcher.submit(situation(count), fallback(count)) for count in (20, 180)))
+        stats = dispatcher.get_stats()
+        await dispatcher.shutdown()
+        return fake, results, stats
+
+    fake, results, stats = asyncio.run(main())
+    assert len(fake.prompts) == 1
+    assert results == [
+        {'prediction': RISK_CATEGORIES['good'], 'source': 'fallback'},
+        {'prediction': RISK_CATEGORIES['overcrowd'], 'source': 'fallback'}
+    ]
+    assert stats['fallbacks'] == {'deadline': 0, 'error': 0, 'unparsed': 2}
+
+
+def test_stats_report_waits_latency_and_fallback_rate():
+    async def main():
+        fake = FakeWatsonx(delay=0.02)
+        dispatcher = LLMDispatcher(fake.generate, max_concurrent=1, max_batch=1, batch_window=0, deadline=5)
+        await asyncio.gather(*(dispatcher.submit(situation(count), fallback(count)) for count in (30, 40, 50)))
+        fake.error = RuntimeError('upstream down')
+        await dispatcher.submit(situation(60), fallback(60))
+        stats = dispatcher.get_stats()
+        await dispatcher.shutdown()
+        return stats
+
+    stats = asyncio.run(main())
+    assert stats['requests'] == 4
+    assert stats['answered'] == 3
+    assert stats['fallback_rate'] == 0.25
+    assert stats['queued'] == 0 and stats['in_flight'] == 0
+    for name in ('queue_wait_ms', 'upstream_latency_ms'):
+        assert set(stats[name]) == {'p50', 'p95', 'p99'}
+        assert 0 <= stats[name]['p50'] <= stats[name]['p95'] <= stats[name]['p99']
+    # One call at a time, so the last of three queued requests waited for two
+    assert stats['queue_wait_ms']['p99'] >= 30
+    assert stats['upstream_latency_ms']['p50'] >= 15
@@ -0,0 +1,68 @@
+import threading
+
+from forecasting import HoltBank
+from risk_predictor import HORIZONS, PredictionSpill, RiskPredictor, level_for_detections, shared_bank
+
+START = 1_790_000_000.0
+
+
+def feed(predictor: RiskPredictor, seconds: float, step: float = 5.0):
+    """One prediction every step seconds of scene time on a slowly rising crowd"""
+    for i in range(int(seconds / step)):
+        detections = 40 + i // 20
+        predictor.predict_risk({
+            'timestamp': START + i * step,
+            'detections': detections,
+            'risk_level': level_for_detections(detections),
+            'confidence': 0.9
+        })
+
+
+def bank() -> HoltBank:
+    return HoltBank(horizons=tuple(HORIZONS.values()))
+
+
+def test_long_horizons_need_more_than_the_buffer():
+    predictor = RiskPredictor(history_size=100, bank=bank())
+    feed(predictor, 3600)
+
+    accuracy = predictor.get_prediction_accuracy()
+    assert accuracy['evaluated_window'] == 100
+    assert accuracy['10min_accuracy'] is None
+    assert accuracy['30min_accuracy'] is None
+
+
+def test_long_horizons_are_scored_from_the_spill(tmp_path):
+    spill = PredictionSpill('cam-1', db_path=str(tmp_path / 'events.db'), batch_size=50)
+    predictor = RiskPredictor(history_size=100, spill=spill, bank=bank())
+    feed(predictor, 3600)
+
+    accuracy = predictor.get_prediction_accuracy()
+    # Spilled rows, pending or written, plus the buffer cover the whole hour
+    assert accuracy['evaluated_window'] == 720
+    assert accuracy['10min_evaluated'] == 600
+    assert accuracy['30min_evaluated'] == 360
+    assert 0.0 <= accuracy['30min_accuracy'] <= 1.0
+    assert accuracy['30min_mae'] >= 0
+
+
+def test_each_thread_gets_its_own_bank():
+    banks = {}
+
+    def run(name: str):
+        predictors = [RiskPredictor(history_size=10) for _ in range(20)]
+        banks[name] = ({id(predictor.forecaster.bank) for predictor in predictors},
+                       {predictor.forecaster.row for predictor in predictors},
+                       shared_bank())
+
+    threads = [threading.Thread(target=run, args=(f'shard-{i}',)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for bank_ids, rows, bank in banks.values():
+        assert bank_ids == {id(bank)}
+        assert len(rows) == 20
+    assert len({id(bank) for _, _, bank in banks.values()}) == 4
+    assert all(bank is not shared_bank() for _, _, bank in banks.values())
@@ -0,0 +1,128 @@
+import sqlite3
+
+import pytest
+
+import event_store
+import rollups
+from retention import RetentionManager, RetentionPolicy
+
+DAY = 86400
+NOW = 1_790_000_000.0
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'events.db')
+    conn = sqlite3.connect(path)
+    event_store.init_db(conn)
+    rollups.init_rollups(conn)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def write_events(db_path: str, events):
+    """Store (video_filename, timestamp, detections) events the way app.write_events does"""
+    pending = [
+        event_store.pending_event(
+            video_filename,
+            {'timestamp': timestamp, 'risk_level': 'moderate', 'confidence': 0.9, 'detections': detections},
+            {},
+            {'actions': ('Increased monitoring',)}
+        )
+        for video_filename, timestamp, detections in events
+    ]
+    conn = sqlite3.connect(db_path)
+    rows = event_store.EventEncoder().encode(conn, pending)
+    event_store.insert_events(conn, rows)
+    rollups.EventRollups().apply(conn, rows)
+    conn.commit()
+    conn.close()
+
+
+def rollup_counts(db_path: str, bucket: str = '1h') -> dict:
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        'SELECT bucket_start, count, sum_detections FROM event_rollups WHERE bucket_seconds = ? ORDER BY bucket_start',
+        (rollups.BUCKETS[bucket],)
+    ).fetchall()
+    conn.close()
+    return {start: (count, total) for start, count, total in rows}
+
+
+def expire_raw_events(db_path: str, tmp_path) -> dict:
+    policy = RetentionPolicy(
+        raw_days=7, rollup_1m_days=0, rollup_15m_days=0, archive_dir=str(tmp_path / 'archive')
+    )
+    return RetentionManager(policy, db_path=db_path).run_once(now=NOW)
+
+
+def test_backfill_after_retention_keeps_expired_history(db_path, tmp_path):
+    write_events(db_path, [
+        ('cam.mp4', NOW - age * DAY + offset, 100 + offset)
+        for age in (30, 20, 1) for offset in range(0, 100, 10)
+    ])
+    before = {bucket: rollup_counts(db_path, bucket) for bucket in rollups.BUCKETS}
+    assert len(before['1h']) == 3
+
+    report = expire_raw_events(db_path, tmp_path)
+    assert report['events']['deleted'] == 20
+
+    result = rollups.backfill(db_path)
+    assert result['events'] == 10
+    assert {bucket: rollup_counts(db_path, bucket) for bucket in rollups.BUCKETS} == before
+
+
+def test_backfill_keeps_a_bucket_retention_cut_through(db_path, tmp_path):
+    cutoff = NOW - 7 * DAY
+    hour = cutoff // 3600 * 3600
+    # One hour bucket straddles the retention cutoff; later ones are double counted
+    write_events(db_path, [('cam.mp4', timestamp, 50) for timestamp in (hour + 1, cutoff - 30, cutoff + 30)])
+    write_events(db_path, [('cam.mp4', hour + 7200 + offset, 80) for offset in range(3)])
+    write_events(db_path, [('cam.mp4', hour + 7200 + offset, 80) for offset in range(3)])
+    expire_raw_events(db_path, tmp_path)
+
+    rollups.backfill(db_path)
+    counts = rollup_counts(db_path)
+    assert counts[hour] == (3, 150)
+    assert counts[hour + 7200] == (6, 480)
+
+
+def test_backfill_rebuilds_buckets_raw_events_still_cover(db_path):
+    write_events(db_path, [('cam.mp4', NOW + offset, 80) for offset in range(3)])
+    write_events(db_path, [('cam.mp4', NOW + 3600 + offset, 80) for offset in range(3)])
+    # Counted twice, as when a stream is backfilled while it is written
+    write_events(db_path, [('cam.mp4', NOW + 3600 + offset, 80) for offset in range(3)])
+    conn = sqlite3.connect(db_path)
+    conn.execute('DELETE FROM events WHERE timestamp >= ?', (NOW + 3600 + 0.5,))
+    conn.execute('DELETE FROM events WHERE id IN (SELECT id FROM events WHERE timestamp >= ? LIMIT 1)', (NOW + 3600,))
+    conn.commit()
+    conn.close()
+
+    rollups.backfill(db_path, 'cam.mp4')
+    counts = rollup_counts(db_path)
+    start = int(NOW // 3600 * 3600)
+    assert counts[start] == (3, 240)
+    assert counts[start + 3600] == (1, 80)
+
+
+def test_legacy_rollups_are_carried_over(tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(path)
+    event_store.init_db(conn)
+    conn.execute(f'''
+        CREATE TABLE event_rollups (
+            video_filename TEXT, bucket_seconds INTEGER, bucket_start INTEGER, count INTEGER,
+            sum_detections INTEGER, max_detections INTEGER,
+            {', '.join(f'{column} REAL' for column in rollups.LEVEL_COLUMNS)}, max_confidence REAL,
+            PRIMARY KEY (video_filename, bucket_seconds, bucket_start)
+        )
+    ''')
+    conn.execute(
+        'INSERT INTO event_rollups VALUES (?, 3600, 7200, 4, 400, 120, 1.0, 2.0, 0.0, 0.0, 0.9)', ('old.mp4',)
+    )
+    assert rollups.init_rollups(conn) == {'migrated': 1}
+    conn.commit()
+    conn.close()
+
+    assert rollups.query_rollups('1h', 'old.mp4', db_path=path)['rollups'][0]['count'] == 4
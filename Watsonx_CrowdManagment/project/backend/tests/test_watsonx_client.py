@@ -0,0 +1,218 @@
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from watsonx_client import AsyncWatsonxClient, WatsonxClient, WatsonxError
+
+
+class StubWatsonx:
+    """IAM token and text generation endpoints on one local server"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.expires_in = 3600
+        self.mint_delay = 0.0
+        self.generation_delay = 0.0
+        self.revoked = set()
+        self.minted = []
+        self.generations = 0
+        self.connections = set()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: dict):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub.lock:
+                    stub.connections.add(self.client_address)
+                if self.path.startswith('/identity/token'):
+                    time.sleep(stub.mint_delay)
+                    with stub.lock:
+                        token = f'token-{len(stub.minted) + 1}'
+                        stub.minted.append(token)
+                    return self._send(200, {'access_token': token, 'expires_in': stub.expires_in})
+
+                token = self.headers.get('Authorization', '')[len('Bearer '):]
+                with stub.lock:
+                    stub.generations += 1
+                if token not in stub.minted or token in stub.revoked:
+                    return self._send(401, {'errorMessage': 'invalid token'})
+                time.sleep(stub.generation_delay)
+                self._send(200, {'results': [{'generated_text': f' answer with {token} '}]})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def client_kwargs(self, **kwargs) -> dict:
+        return {
+            'api_key': 'test-key',
+            'project_id': 'test-project',
+            'base_url': self.url,
+            'iam_url': f'{self.url}/identity/token',
+            'connect_timeout': 1.0,
+            'read_timeout': 5.0,
+            **kwargs
+        }
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubWatsonx()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(stub):
+    clients = []
+
+    def make(**kwargs) -> WatsonxClient:
+        clients.append(WatsonxClient(**stub.client_kwargs(**kwargs)))
+        return clients[-1]
+
+    yield make
+    for made in clients:
+        made.close()
+
+
+def run_async(stub, test, **kwargs):
+    """Run test(client) against the stub with a fresh AsyncWatsonxClient"""
+    async def main():
+        async_client = AsyncWatsonxClient(**stub.client_kwargs(**kwargs))
+        try:
+            return await test(async_client)
+        finally:
+            await async_client.close()
+    return asyncio.run(main())
+
+
+def test_concurrent_callers_mint_one_token(stub, client):
+    stub.mint_delay = 0.2
+    watsonx = client()
+    with ThreadPoolExecutor(8) as pool:
+        tokens = list(pool.map(lambda _: watsonx.get_token(), range(8)))
+    assert tokens == ['token-1'] * 8
+    assert stub.minted == ['token-1']
+    assert watsonx.get_stats()['tokens_minted'] == 1
+
+
+def test_async_concurrent_callers_mint_one_token(stub):
+    stub.mint_delay = 0.2
+
+    async def test(watsonx):
+        return await asyncio.gather(*(watsonx.get_token() for _ in range(8)))
+
+    assert run_async(stub, test) == ['token-1'] * 8
+    assert stub.minted == ['token-1']
+
+
+def test_token_reminted_ahead_of_expiry(stub, client):
+    stub.expires_in = 2
+    watsonx = client(refresh_margin=1.5)
+    assert watsonx.get_token() == 'token-1'
+    assert watsonx.get_token() == 'token-1'
+    # Inside the margin but still valid: refreshed before it ever expires
+    time.sleep(0.6)
+    assert watsonx.get_token() == 'token-2'
+    assert stub.minted == ['token-1', 'token-2']
+
+
+def test_async_token_reminted_ahead_of_expiry(stub):
+    stub.expires_in = 2
+
+    async def test(watsonx):
+        first = await watsonx.get_token()
+        await asyncio.sleep(0.6)
+        # The refresh runs in the background while the valid token is served
+        during = await watsonx.get_token()
+        await watsonx._minting
+        return first, during, await watsonx.get_token()
+
+    assert run_async(stub, test, refresh_margin=1.5) == ('token-1', 'token-1', 'token-2')
+    assert stub.minted == ['token-1', 'token-2']
+
+
+def test_unauthorized_generation_remints_and_retries(stub, client):
+    watsonx = client()
+    watsonx.get_token()
+    stub.revoked.add('token-1')
+    assert watsonx.generate('prompt') == 'answer with token-2'
+    assert stub.minted == ['token-1', 'token-2']
+    assert stub.generations == 2
+    assert watsonx.get_stats()['retried_unauthorized'] == 1
+
+
+def test_async_unauthorized_generation_remints_and_retries(stub):
+    async def test(watsonx):
+        await watsonx.get_token()
+        stub.revoked.add('token-1')
+        return await watsonx.generate('prompt'), watsonx.get_stats()['retried_unauthorized']
+
+    assert run_async(stub, test) == ('answer with token-2', 1)
+    assert stub.minted == ['token-1', 'token-2']
+
+
+def test_read_timeout_fires_on_stalled_generation(stub, client):
+    stub.generation_delay = 3.0
+    watsonx = client(read_timeout=0.3)
+    watsonx.get_token()
+    started = time.monotonic()
+    with pytest.raises(WatsonxError):
+        watsonx.generate('prompt')
+    assert time.monotonic() - started < 1.5
+    assert watsonx.get_stats()['errors'] == 1
+
+
+def test_async_read_timeout_fires_on_stalled_generation(stub):
+    stub.generation_delay = 3.0
+
+    async def test(watsonx):
+        await watsonx.get_token()
+        started = time.monotonic()
+        with pytest.raises(WatsonxError):
+            await watsonx.generate('prompt')
+        return time.monotonic() - started
+
+    assert run_async(stub, test, read_timeout=0.3) < 1.5
+
+
+def test_sequential_calls_reuse_one_connection(stub, client):
+    watsonx = client()
+    answers = [watsonx.generate('prompt') for _ in range(5)]
+    assert answers == ['answer with token-1'] * 5
+    # The token mint and all five generations went over one keep-alive connection
+    assert len(stub.connections) == 1
+
+
+def test_async_sequential_calls_reuse_one_connection(stub):
+    async def test(watsonx):
+        return [await watsonx.generate('prompt') for _ in range(5)]
+
+    assert run_async(stub, test) == ['answer with token-1'] * 5
+    assert len(stub.connections) == 1
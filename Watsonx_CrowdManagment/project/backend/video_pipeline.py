@@ -0,0 +1,382 @@
+import os
+import glob
+import time
+import asyncio
+import threading
+import concurrent.futures
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+# Marks the end of a stage's output
+_END = object()
+
+
+def find_upload(file_id: str, upload_dir: str = "uploads") -> Optional[str]:
+    """Locate the file saved by /upload-video for the given file id"""
+    pattern = os.path.join(upload_dir, f"{glob.escape(file_id)}_*")
+    matches = sorted(glob.glob(pattern))
+    return matches[0] if matches else None
+
+
+class StageStats:
+    """
+    Throughput counters for a single pipeline stage
+    Queue depth is reported for the queue the stage feeds
+    """
+
+    def __init__(self, name: str, output_queue: Optional[asyncio.Queue] = None):
+        self.name = name
+        self.output_queue = output_queue
+        self.frames = 0
+        self.busy_seconds = 0.0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    def record(self, busy_seconds: float, frames: int = 1):
+        self.frames += frames
+        self.busy_seconds += busy_seconds
+
+    def snapshot(self) -> Dict:
+        """Current frames/sec and queue depth for this stage"""
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+
+        stats = {
+            'frames': self.frames,
+            'fps': round(self.frames / elapsed, 2) if elapsed > 0 else 0.0,
+            'busy_fps': round(self.frames / self.busy_seconds, 2) if self.busy_seconds > 0 else 0.0,
+            'elapsed_seconds': round(elapsed, 3)
+        }
+        if self.output_queue is not None:
+            stats['queue_depth'] = self.output_queue.qsize()
+            stats['queue_capacity'] = self.output_queue.maxsize
+        return stats
+
+
+class SamplingPolicy:
+    """
+    Decides which decoded frames are worth analyzing
+    - stride: analyze every Nth frame
+    - target_fps: cap analysis at this many frames per second of video
+    - motion_threshold: mean absolute grayscale difference (0-255) against
+      the last analyzed frame below which a frame reuses that frame's
+      result; 0 disables the gate
+    - max_reuse: consecutive reuses allowed before a frame is analyzed anyway
+    """
+
+    def __init__(
+        self,
+        stride: int = 1,
+        target_fps: Optional[float] = None,
+        motion_threshold: float = 2.0,
+        max_reuse: int = 25,
+        motion_size: tuple = (64, 36)
+    ):
+        self.stride = max(1, stride)
+        self.target_fps = target_fps
+        self.motion_threshold = motion_threshold
+        self.max_reuse = max_reuse
+        self.motion_size = motion_size
+
+        self.frames_seen = 0
+        self.frames_sampled = 0
+        self.frames_reused = 0
+        self._step = self.stride
+        self._reference: Optional[np.ndarray] = None
+        self._reuse_run = 0
+
+    @classmethod
+    def from_env(cls, **overrides) -> "SamplingPolicy":
+        target_fps = os.getenv("SAMPLE_TARGET_FPS")
+        options = {
+            'stride': int(os.getenv("SAMPLE_STRIDE", 1)),
+            'target_fps': float(target_fps) if target_fps else None,
+            'motion_threshold': float(os.getenv("MOTION_THRESHOLD", 2.0)),
+            'max_reuse': int(os.getenv("MOTION_MAX_REUSE", 25))
+        }
+        options.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**options)
+
+    def configure(self, video_fps: Optional[float]):
+        """Combine stride and target FPS into one frame step for this video"""
+        step = self.stride
+        if self.target_fps and video_fps:
+            step = max(step, int(round(video_fps / self.target_fps)))
+        self._step = max(1, step)
+
+    def should_sample(self, frame_number: int) -> bool:
+        return frame_number % self._step == 0
+
+    def record(self, sampled: bool):
+        self.frames_seen += 1
+        if sampled:
+            self.frames_sampled += 1
+
+    def is_static(self, frame: np.ndarray) -> bool:
+        """Cheap motion check on a downscaled grayscale copy of the frame"""
+        if self.motion_threshold <= 0:
+            return False
+
+        small = cv2.cvtColor(cv2.resize(frame, self.motion_size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        if self._reference is not None and self._reuse_run < self.max_reuse:
+            if cv2.absdiff(small, self._reference).mean() < self.motion_threshold:
+                self._reuse_run += 1
+                self.frames_reused += 1
+                return True
+
+        self._reference = small
+        self._reuse_run = 0
+        return False
+
+    def get_stats(self, video_fps: Optional[float]) -> Dict:
+        analyzed = self.frames_sampled - self.frames_reused
+        video_seconds = self.frames_seen / video_fps if video_fps else None
+        return {
+            'stride': self._step,
+            'motion_threshold': self.motion_threshold,
+            'frames_seen': self.frames_seen,
+            'frames_analyzed': analyzed,
+            'frames_reused': self.frames_reused,
+            'frames_skipped': self.frames_seen - self.frames_sampled,
+            'skip_ratio': round(1 - analyzed / self.frames_seen, 3) if self.frames_seen else 0.0,
+            # Analyzed frames per second of video
+            'effective_fps': round(analyzed / video_seconds, 2) if video_seconds else None
+        }
+
+
+class VideoFramePipeline:
+    """
+    Decodes a video file in a worker thread and moves frames through
+    bounded queues: decode -> analyze -> publish
+    A full queue blocks the stage feeding it, so decoding never runs
+    further ahead of analysis than the queue capacity
+    Frames dropped by the sampling policy are never decoded; frames its
+    motion gate marks static are published with the last analysis result
+    """
+
+    def __init__(
+        self,
+        video_path: str,
+        analyze: Callable[[List[int], List[Any]], Awaitable[List[Any]]],
+        publish: Callable[[int, Any, Dict, bool], Awaitable[None]],
+        queue_size: int = 8,
+        max_in_flight: int = 2,
+        max_frame_side: Optional[int] = 640,
+        batch_size: int = 4,
+        sampling: Optional[SamplingPolicy] = None
+    ):
+        self.video_path = video_path
+        self.analyze = analyze
+        self.publish = publish
+        self.max_in_flight = max(1, max_in_flight)
+        self.batch_size = max(1, batch_size)
+        self.sampling = sampling or SamplingPolicy(motion_threshold=0)
+        self.max_frame_side = max_frame_side
+
+        self.frame_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.result_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+        self.stages = {
+            'decode': StageStats('decode', self.frame_queue),
+            'analyze': StageStats('analyze', self.result_queue),
+            'publish': StageStats('publish')
+        }
+        self.video_info: Dict = {}
+
+        self._stop = threading.Event()
+        self._decode_error: Optional[BaseException] = None
+        self._last_result = None
+
+    def get_stats(self) -> Dict:
+        """Per-stage throughput and queue depth"""
+        return {
+            'video': self.video_info,
+            'stages': {name: stage.snapshot() for name, stage in self.stages.items()},
+            'sampling': self.sampling.get_stats(self.video_info.get('fps'))
+        }
+
+    def stop(self):
+        """Ask the decoder to stop; queued frames are still drained"""
+        self._stop.set()
+
+    async def run(self) -> Dict:
+        """Run all stages to completion and return the final stats"""
+        loop = asyncio.get_running_loop()
+        decoder = loop.run_in_executor(None, self._decode, loop)
+
+        stages = [
+            asyncio.create_task(self._analyze_stage()),
+            asyncio.create_task(self._publish_stage())
+        ]
+        try:
+            await asyncio.gather(*stages)
+        except BaseException:
+            for task in stages:
+                task.cancel()
+            raise
+        finally:
+            self.stop()
+            await decoder
+
+        if self._decode_error is not None:
+            raise self._decode_error
+
+        return self.get_stats()
+
+    def _put_from_thread(self, loop: asyncio.AbstractEventLoop, item) -> bool:
+        """Blocking put from the decode thread; gives up if the pipeline stops"""
+        future = asyncio.run_coroutine_threadsafe(self.frame_queue.put(item), loop)
+        while True:
+            try:
+                future.result(timeout=0.5)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self._stop.is_set():
+                    future.cancel()
+                    return False
+
+    def _resize(self, frame):
+        """Downscale in the decode thread so less data crosses to the workers"""
+        if not self.max_frame_side:
+            return frame
+        height, width = frame.shape[:2]
+        scale = self.max_frame_side / max(height, width)
+        if scale >= 1:
+            return frame
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def _decode(self, loop: asyncio.AbstractEventLoop):
+        stats = self.stages['decode']
+        capture = cv2.VideoCapture(self.video_path)
+        try:
+            if not capture.isOpened():
+                raise IOError(f"Unable to open video: {self.video_path}")
+
+            self.video_info = {
+                'path': self.video_path,
+                'fps': capture.get(cv2.CAP_PROP_FPS) or None,
+                'total_frames': int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or None,
+                'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            }
+
+            self.sampling.configure(self.video_info['fps'])
+
+            stats.start()
+            frame_number = 0
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                if not self.sampling.should_sample(frame_number):
+                    # grab() advances without decoding the skipped frame
+                    if not capture.grab():
+                        break
+                    self.sampling.record(sampled=False)
+                    frame_number += 1
+                    continue
+
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                self.sampling.record(sampled=True)
+                frame = self._resize(frame)
+                if self.sampling.is_static(frame):
+                    frame = None  # Reuse the previous result
+                stats.record(time.perf_counter() - started)
+
+                if not self._put_from_thread(loop, (frame_number, frame)):
+                    break
+                frame_number += 1
+        except BaseException as e:
+            self._decode_error = e
+        finally:
+            capture.release()
+            stats.finish()
+            self._put_from_thread(loop, _END)
+
+    def _take_batch(self, first) -> tuple:
+        """Add frames that are already queued to the batch, without waiting"""
+        batch = [first]
+        while len(batch) < self.batch_size and not self.frame_queue.empty():
+            item = self.frame_queue.get_nowait()
+            if item is _END:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _analyze_stage(self):
+        stats = self.stages['analyze']
+        stats.start()
+        # Up to max_in_flight batches are being analyzed at once; results
+        # are collected in submission order so frames publish in order
+        in_flight = deque()
+
+        async def collect():
+            batch, started, task = in_flight.popleft()
+            results = iter(await task if task is not None else [])
+            analyzed = 0
+            for frame_number, frame in batch:
+                # The motion gate never marks the first frame static, so a
+                # reused frame always follows an analyzed one
+                reused = frame is None
+                if not reused:
+                    self._last_result = next(results)
+                    analyzed += 1
+                await self.result_queue.put((frame_number, self._last_result, reused))
+            if analyzed:
+                stats.record(time.perf_counter() - started, frames=analyzed)
+
+        try:
+            finished = False
+            while not finished:
+                item = await self.frame_queue.get()
+                if item is _END:
+                    break
+
+                batch, finished = self._take_batch(item)
+                pending = [(frame_number, frame) for frame_number, frame in batch if frame is not None]
+                task = None
+                if pending:
+                    task = asyncio.ensure_future(self.analyze(
+                        [frame_number for frame_number, _ in pending],
+                        [frame for _, frame in pending]
+                    ))
+                in_flight.append((batch, time.perf_counter(), task))
+                if len(in_flight) >= self.max_in_flight:
+                    await collect()
+
+            while in_flight:
+                await collect()
+            await self.result_queue.put(_END)
+        finally:
+            for _, _, task in in_flight:
+                if task is not None:
+                    task.cancel()
+            stats.finish()
+
+    async def _publish_stage(self):
+        stats = self.stages['publish']
+        stats.start()
+        try:
+            while True:
+                item = await self.result_queue.get()
+                if item is _END:
+                    break
+
+                frame_number, result, reused = item
+                started = time.perf_counter()
+                await self.publish(frame_number, result, self.get_stats(), reused)
+                stats.record(time.perf_counter() - started)
+        finally:
+            stats.finish()
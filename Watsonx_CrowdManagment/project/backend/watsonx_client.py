@@ -1,71 +1,325 @@
-import os
-import requests
-from dotenv import load_dotenv
-
-load_dotenv()
-
-API_KEY = os.getenv("WATSONX_API_KEY")
-PROJECT_ID = os.getenv("WATSONX_PROJECT_ID")
-WATSONX_URL = "https://us-south.ml.cloud.ibm.com/ml/v1/text/generation?version=2023-05-29"
-MODEL_ID = "ibm/granite-13b-chat-v2"  # can also use ibm/granite-8b-japan or others
-
-
-def get_iam_token():
-    response = requests.post(
-        "https://iam.cloud.ibm.com/identity/token",
-        data={
-            "apikey": API_KEY,
-            "grant_type": "urn:ibm:params:oauth:grant-type:apikey"
-        },
-        headers={"Content-Type": "application/x-www-form-urlencoded"},
-    )
-
-    if response.status_code != 200:
-        raise Exception(f"IAM token error: {response.status_code}, {response.text}")
-
-    data = response.json()
-    return data.get("access_token")
-
-
-
-def get_prediction(crowd_count, time_period, event_status):
-    token = get_iam_token()
-
-    prompt = f"""
-    You are a crowd safety AI. Classify the situation into one of four categories:
-    1. Good to go / Well managed / Low crowd
-    2. Moderate crowd but no danger
-    3. Overcrowd / Attention needed / More officers needed
-    4. Stampede / Red alert / Medical services needed
-
-    Input:
-    - Crowd count: {crowd_count}
-    - Time period: {time_period}
-    - Event status: {event_status}
-
-    Output only the category text (do not explain).
-    """
-
-    payload = {
-        "input": prompt,
-        "parameters": {
-            "decoding_method": "greedy",
-            "max_new_tokens": 50
-        },
-        "model_id": MODEL_ID,
-        "project_id": PROJECT_ID
-    }
-
-    response = requests.post(
-        WATSONX_URL,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {token}"
-        },
-        json=payload
-    )
-
-    try:
-        return response.json()["results"][0]["generated_text"].strip()
-    except Exception:
-        return f"Error: {response.text}"
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+API_KEY = os.getenv("WATSONX_API_KEY")
+PROJECT_ID = os.getenv("WATSONX_PROJECT_ID")
+BASE_URL = os.getenv("WATSONX_AI_URL", "https://us-south.ml.cloud.ibm.com")
+IAM_URL = os.getenv("WATSONX_IAM_URL", "https://iam.cloud.ibm.com/identity/token")
+API_VERSION = "2023-05-29"
+MODEL_ID = "ibm/granite-13b-chat-v2"  # can also use ibm/granite-8b-japan or others
+
+
+class WatsonxError(Exception):
+    pass
+
+
+class _WatsonxBase:
+    """
+    Configuration, token state, request building and counters shared by
+    the blocking and the async client
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        project_id: Optional[str] = None,
+        base_url: Optional[str] = None,
+        iam_url: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        refresh_margin: Optional[float] = None,
+        pool_size: Optional[int] = None
+    ):
+        self.api_key = api_key or API_KEY
+        self.project_id = project_id or PROJECT_ID
+        self.base_url = (base_url or BASE_URL).rstrip('/')
+        self.iam_url = iam_url or IAM_URL
+        self.connect_timeout = connect_timeout or float(os.getenv("WATSONX_CONNECT_TIMEOUT", 5))
+        self.read_timeout = read_timeout or float(os.getenv("WATSONX_READ_TIMEOUT", 30))
+        self.refresh_margin = refresh_margin if refresh_margin is not None else float(
+            os.getenv("WATSONX_TOKEN_REFRESH_MARGIN", 300)
+        )
+        self.pool_size = pool_size or int(os.getenv("WATSONX_POOL_SIZE", 10))
+
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'tokens_minted': 0,
+            'token_errors': 0,
+            'requests': 0,
+            'errors': 0,
+            'retried_unauthorized': 0,
+            'total_seconds': 0.0
+        }
+
+    def _count(self, key: str, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def _remaining(self) -> float:
+        return self._expires_at - time.monotonic() if self._token is not None else 0.0
+
+    def _token_request(self) -> Dict:
+        return {
+            'url': self.iam_url,
+            'data': {
+                "apikey": self.api_key,
+                "grant_type": "urn:ibm:params:oauth:grant-type:apikey"
+            },
+            'headers': {"Content-Type": "application/x-www-form-urlencoded"}
+        }
+
+    def _store_token(self, status_code: int, text: str, data: Optional[Dict]):
+        if status_code != 200 or not data or "access_token" not in data:
+            self._count('token_errors')
+            raise WatsonxError(f"IAM token error: {status_code}, {text}")
+        self._token = data["access_token"]
+        self._expires_at = time.monotonic() + float(data.get("expires_in", 3600))
+        self._count('tokens_minted')
+
+    def _generation_request(self, prompt: str, model_id: str, max_new_tokens: int, token: str) -> Dict:
+        return {
+            'url': f"{self.base_url}/ml/v1/text/generation?version={API_VERSION}",
+            'headers': {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {token}"
+            },
+            'json': {
+                "input": prompt,
+                "parameters": {
+                    "decoding_method": "greedy",
+                    "max_new_tokens": max_new_tokens
+                },
+                "model_id": model_id,
+                "project_id": self.project_id
+            }
+        }
+
+    def _generated_text(self, status_code: int, text: str, data) -> str:
+        if status_code != 200:
+            raise WatsonxError(f"Generation error: {status_code}, {text}")
+        try:
+            return data["results"][0]["generated_text"].strip()
+        except (TypeError, KeyError, IndexError) as e:
+            raise WatsonxError(f"Generation error: {text}") from e
+
+    def invalidate_token(self):
+        self._expires_at = 0.0
+
+    def get_stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['token_valid_for'] = round(max(0.0, self._remaining()), 1)
+        stats['avg_request_seconds'] = round(
+            stats.pop('total_seconds') / stats['requests'], 3
+        ) if stats['requests'] else 0.0
+        return stats
+
+
+def _json(response) -> Optional[Dict]:
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+class WatsonxClient(_WatsonxBase):
+    """
+    Shared blocking Watsonx text generation client
+    IAM tokens are cached and refreshed refresh_margin seconds before they
+    expire; one caller mints while the others keep using the current token,
+    or wait for it if there is none. Requests go through one keep-alive
+    session, so the IAM and generation hosts are not re-handshaked per call
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._token_lock = threading.Lock()
+
+    def _mint_token(self):
+        try:
+            response = self.session.post(**self._token_request(), timeout=(self.connect_timeout, self.read_timeout))
+        except requests.RequestException as e:
+            self._count('token_errors')
+            raise WatsonxError(f"IAM token error: {e}") from e
+        self._store_token(response.status_code, response.text, _json(response))
+
+    def get_token(self) -> str:
+        """A valid access token, minting or refreshing it when needed"""
+        remaining = self._remaining()
+        if remaining > self.refresh_margin:
+            return self._token
+
+        if remaining > 0:
+            # Still valid: refresh in this caller only if nobody else is
+            if self._token_lock.acquire(blocking=False):
+                try:
+                    if self._remaining() <= self.refresh_margin:
+                        self._mint_token()
+                except WatsonxError as e:
+                    print(f"Watsonx token refresh error: {e}")
+                finally:
+                    self._token_lock.release()
+            return self._token
+
+        with self._token_lock:
+            if self._remaining() <= 0:
+                self._mint_token()
+            return self._token
+
+    def generate(self, prompt: str, model_id: str = MODEL_ID, max_new_tokens: int = 50) -> str:
+        """Generated text for prompt; raises WatsonxError on failure"""
+        started = time.perf_counter()
+        self._count('requests')
+        try:
+            for attempt in range(2):
+                response = self.session.post(
+                    **self._generation_request(prompt, model_id, max_new_tokens, self.get_token()),
+                    timeout=(self.connect_timeout, self.read_timeout)
+                )
+                # A token revoked before its expiry is minted again once
+                if response.status_code == 401 and attempt == 0:
+                    self._count('retried_unauthorized')
+                    self.invalidate_token()
+                    continue
+                break
+            return self._generated_text(response.status_code, response.text, _json(response))
+        except requests.RequestException as e:
+            self._count('errors')
+            raise WatsonxError(f"Generation error: {e}") from e
+        except WatsonxError:
+            self._count('errors')
+            raise
+        finally:
+            self._count('total_seconds', time.perf_counter() - started)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncWatsonxClient(_WatsonxBase):
+    """
+    Async Watsonx text generation client for the event loop
+    Same token policy as WatsonxClient, with the single-flight mint held as
+    a task that concurrent callers await, and an httpx connection pool
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.http = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        )
+        self._minting: Optional[asyncio.Task] = None
+
+    async def _mint_token(self):
+        try:
+            response = await self.http.post(**self._token_request())
+        except httpx.HTTPError as e:
+            self._count('token_errors')
+            raise WatsonxError(f"IAM token error: {e}") from e
+        self._store_token(response.status_code, response.text, _json(response))
+
+    def _mint(self) -> asyncio.Task:
+        if self._minting is None or self._minting.done():
+            self._minting = asyncio.create_task(self._mint_token())
+            self._minting.add_done_callback(_log_refresh_error)
+        return self._minting
+
+    async def get_token(self) -> str:
+        """A valid access token, minting or refreshing it when needed"""
+        remaining = self._remaining()
+        if remaining > self.refresh_margin:
+            return self._token
+        if remaining > 0:
+            # Still valid: refresh in the background and keep using it
+            self._mint()
+            return self._token
+        await asyncio.shield(self._mint())
+        return self._token
+
+    async def generate(self, prompt: str, model_id: str = MODEL_ID, max_new_tokens: int = 50) -> str:
+        """Generated text for prompt; raises WatsonxError on failure"""
+        started = time.perf_counter()
+        self._count('requests')
+        try:
+            for attempt in range(2):
+                request = self._generation_request(prompt, model_id, max_new_tokens, await self.get_token())
+                response = await self.http.post(**request)
+                if response.status_code == 401 and attempt == 0:
+                    self._count('retried_unauthorized')
+                    self.invalidate_token()
+                    continue
+                break
+            return self._generated_text(response.status_code, response.text, _json(response))
+        except httpx.HTTPError as e:
+            self._count('errors')
+            raise WatsonxError(f"Generation error: {e!r}") from e
+        except WatsonxError:
+            self._count('errors')
+            raise
+        finally:
+            self._count('total_seconds', time.perf_counter() - started)
+
+    async def close(self):
+        await self.http.aclose()
+
+
+def _log_refresh_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Watsonx token refresh error: {task.exception()}")
+
+
+_client: Optional[WatsonxClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> WatsonxClient:
+    """The process-wide client, created on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = WatsonxClient()
+    return _client
+
+
+def get_iam_token():
+    return get_client().get_token()
+
+
+def get_prediction(crowd_count, time_period, event_status):
+    prompt = f"""
+    You are a crowd safety AI. Classify the situation into one of four categories:
+    1. Good to go / Well managed / Low crowd
+    2. Moderate crowd but no danger
+    3. Overcrowd / Attention needed / More officers needed
+    4. Stampede / Red alert / Medical services needed
+
+    Input:
+    - Crowd count: {crowd_count}
+    - Time period: {time_period}
+    - Event status: {event_status}
+
+    Output only the category text (do not explain).
+    """
+
+    try:
+        return get_client().generate(prompt)
+    except WatsonxError as e:
+        return f"Error: {e}"
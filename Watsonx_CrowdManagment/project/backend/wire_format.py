@@ -0,0 +1,252 @@
+"""
+Encodings for /ws messages
+
+json     - the plain messages, as text frames
+compact  - the same messages with levels, statuses, equipment and action
+           texts as enum indexes, categories dropped (they follow from the
+           level), timestamps as epoch seconds and resource lists in
+           columns; JSON text frames
+msgpack  - the compact messages packed with MessagePack in binary frames,
+           with positions and boxes as little-endian float32 arrays
+
+Clients choose with /ws?format=... and receive a "schema" message first,
+holding the enum tables needed to decode. msgpack needs the msgpack
+package from requirements.txt; without it the format is not offered and
+clients asking for it get compact.
+"""
+
+import re
+import json
+import struct
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from detectors import BOX_COLUMNS
+from risk_predictor import RISK_CATEGORIES, RISK_LEVELS
+from safety_actions import (
+    ACTION_TEMPLATES, BARRICADE_STATUSES, BARRICADE_TYPES, CHANNELS, DYNAMIC_ACTIONS, EQUIPMENT,
+    MEDICAL_EQUIPMENT_LEVELS, MEDICAL_STATUSES, MEDICAL_TYPES, OFFICER_STATUSES
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Formats this server can send; msgpack only when the package imports
+FORMATS = ('json', 'compact') + (('msgpack',) if msgpack is not None else ())
+SCHEMA_VERSION = 2
+
+
+def _distinct(by_level: Dict) -> tuple:
+    """Every value of a per-level table of tuples, once each, in level order"""
+    return tuple(dict.fromkeys(value for level in RISK_LEVELS for value in by_level.get(level, ())))
+
+
+ENUMS = {
+    'level': tuple(RISK_LEVELS),
+    'officer_status': _distinct(OFFICER_STATUSES),
+    'barricade_status': _distinct(BARRICADE_STATUSES),
+    'barricade_type': BARRICADE_TYPES,
+    'medical_status': tuple(dict.fromkeys(MEDICAL_STATUSES[level] for level in RISK_LEVELS)),
+    'medical_type': MEDICAL_TYPES,
+    'equipment_level': tuple(dict.fromkeys(MEDICAL_EQUIPMENT_LEVELS[level] for level in RISK_LEVELS)),
+    'equipment': EQUIPMENT,
+    'channel': CHANNELS,
+    'action': _distinct(ACTION_TEMPLATES) + _distinct(DYNAMIC_ACTIONS)
+}
+_ENUM_INDEX = {name: {value: index for index, value in enumerate(values)} for name, values in ENUMS.items()}
+
+# Column order and encoding of each resource list
+RESOURCE_COLUMNS = {
+    'officers': (
+        ('id', 'id'), ('position', 'position'), ('status', 'officer_status'),
+        ('equipment', 'equipment'), ('communication_channel', 'channel')
+    ),
+    'barricades': (
+        ('id', 'id'), ('position', 'position'), ('status', 'barricade_status'),
+        ('type', 'barricade_type'), ('capacity', None)
+    ),
+    'medical': (
+        ('id', 'id'), ('position', 'position'), ('status', 'medical_status'), ('type', 'medical_type'),
+        ('personnel_count', None), ('equipment_level', 'equipment_level'), ('response_time', 'minutes')
+    )
+}
+RESOURCE_PREFIX = {'officers': 'officer', 'barricades': 'barricade', 'medical': 'medical'}
+_MINUTES = re.compile(r'^(\d+) minutes$')
+
+
+def negotiate(requested: Optional[str]) -> str:
+    """The format a client gets for the one it asked for"""
+    if requested == 'msgpack' and msgpack is None:
+        return 'compact'
+    return requested if requested in FORMATS else 'json'
+
+
+def schema(format: str) -> Dict:
+    """First message on a compact or msgpack connection"""
+    return {
+        "type": "schema",
+        "version": SCHEMA_VERSION,
+        "format": format,
+        "enums": {name: list(values) for name, values in ENUMS.items()},
+        "categories": [RISK_CATEGORIES[level] for level in RISK_LEVELS],
+        "resource_columns": {
+            resource: [name for name, _ in columns] for resource, columns in RESOURCE_COLUMNS.items()
+        },
+        "resource_prefix": RESOURCE_PREFIX,
+        "box_columns": list(BOX_COLUMNS),
+        "binary_arrays": "float32le" if format == 'msgpack' else None
+    }
+
+
+def encode(message: Dict, format: str) -> Union[str, bytes]:
+    if format == 'json':
+        return json.dumps(message)
+    if format == 'msgpack':
+        return msgpack.packb(compact(message, binary=True))
+    return json.dumps(compact(message), separators=(',', ':'))
+
+
+def compact(message: Dict, binary: bool = False) -> Dict:
+    """
+    The compact form of a message or of a delta of one
+    Every rule replaces a value or a whole list, so deltas compact the same
+    way as full messages. Messages other than updates and alerts pass through
+    """
+    kind = message.get('type')
+    if kind == 'analysis_update':
+        result = dict(message)
+        if result.get('risk_data'):
+            result['risk_data'] = _compact_risk(result['risk_data'])
+        if result.get('safety_actions'):
+            result['safety_actions'] = _compact_safety(result['safety_actions'], binary)
+        if result.get('boxes'):
+            result['boxes'] = _compact_boxes(result['boxes'], binary)
+        return result
+    if kind == 'alert':
+        result = dict(message)
+        result.pop('category', None)
+        for key in ('level', 'previous_level'):
+            if key in result:
+                result[key] = _enum('level', result[key])
+        if result.get('actions') is not None:
+            result['actions'] = [_enum('action', text) for text in result['actions']]
+        return result
+    return message
+
+
+def _enum(name: str, value):
+    return _ENUM_INDEX[name].get(value, value)
+
+
+def _compact_level(entry: Optional[Dict]) -> Optional[Dict]:
+    if not entry:
+        return entry
+    result = {key: value for key, value in entry.items() if key != 'category'}
+    if 'level' in result:
+        result['level'] = _enum('level', result['level'])
+    if isinstance(result.get('confidence'), float):
+        result['confidence'] = round(result['confidence'], 3)
+    return result
+
+
+def _compact_risk(risk: Dict) -> Dict:
+    result = dict(risk)
+    if 'current' in result:
+        result['current'] = _compact_level(result['current'])
+    if result.get('predictions'):
+        result['predictions'] = {
+            horizon: _compact_level(prediction) for horizon, prediction in result['predictions'].items()
+        }
+    if 'llm' in result:
+        result['llm'] = _compact_level(result['llm'])
+    return result
+
+
+def _compact_safety(safety: Dict, binary: bool) -> Dict:
+    result = dict(safety)
+    if result.get('actions') is not None:
+        result['actions'] = [_enum('action', text) for text in result['actions']]
+    for resource, columns in RESOURCE_COLUMNS.items():
+        if result.get(resource) is not None:
+            result[resource] = _columns(resource, columns, result[resource], binary)
+    if result.get('changes') and 'timestamp' in result['changes']:
+        result['changes'] = {**result['changes'], 'timestamp': _epoch(result['changes']['timestamp'])}
+    return result
+
+
+def _columns(resource: str, columns, units: List[Dict], binary: bool) -> Dict:
+    """A list of units as one list per column"""
+    encoded = {'n': len(units)}
+    for name, kind in columns:
+        values = [unit.get(name) for unit in units]
+        if kind == 'position':
+            encoded.update(_positions(values, binary))
+        elif kind == 'id':
+            prefix = f"{RESOURCE_PREFIX[resource]}-"
+            encoded[name] = [
+                int(value[len(prefix):]) if isinstance(value, str) and value.startswith(prefix)
+                and value[len(prefix):].isdigit() else value
+                for value in values
+            ]
+        elif kind == 'equipment':
+            encoded[name] = [_bitmask(value) for value in values]
+        elif kind == 'minutes':
+            encoded[name] = [_minutes(value) for value in values]
+        elif kind is not None:
+            encoded[name] = [_enum(kind, value) for value in values]
+        else:
+            encoded[name] = values
+    return encoded
+
+
+def _positions(positions: List, binary: bool) -> Dict:
+    if not positions or any(position is None for position in positions):
+        return {'position': positions}
+    if not binary:
+        return {'position': [round(coordinate, 6) for position in positions for coordinate in position]}
+    # Offsets from the first unit keep float32 precise to well under a metre
+    origin = positions[0]
+    offsets = [coordinate - origin[axis] for position in positions for axis, coordinate in enumerate(position)]
+    return {
+        'origin': list(origin),
+        'position': struct.pack(f'<{len(offsets)}f', *offsets)
+    }
+
+
+def _epoch(value) -> Optional[float]:
+    if not isinstance(value, str):
+        return value
+    try:
+        return round(datetime.fromisoformat(value).timestamp(), 3)
+    except ValueError:
+        return value
+
+
+def _minutes(value):
+    match = _MINUTES.match(value) if isinstance(value, str) else None
+    return int(match.group(1)) if match else value
+
+
+def _bitmask(items) -> Union[int, List]:
+    if not isinstance(items, (list, tuple)):
+        return items
+    mask = 0
+    for item in items:
+        index = _ENUM_INDEX['equipment'].get(item)
+        if index is None:
+            return items
+        mask |= 1 << index
+    return mask
+
+
+def _compact_boxes(boxes: Dict, binary: bool) -> Dict:
+    result = {key: value for key, value in boxes.items() if key != 'columns'}
+    if 'rows' in result:
+        rows = np.asarray(result['rows'], dtype=np.float64).reshape(-1, len(BOX_COLUMNS))
+        result['n'] = len(rows)
+        result['rows'] = rows.astype('<f4').tobytes() if binary else np.round(rows, 2).ravel().tolist()
+    return result
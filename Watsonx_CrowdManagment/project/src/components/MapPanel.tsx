@@ -61,6 +61,20 @@ const MapPanel: React.FC = () => {
     }
   };
 
+  // Hotspots come in normalized frame coordinates; spread the camera view
+  // over a small area around the venue center
+  const HOTSPOT_SPAN = 0.004;
+  const hotspotPosition = (x: number, y: number): [number, number] => [
+    center[0] + (0.5 - y) * HOTSPOT_SPAN,
+    center[1] + (x - 0.5) * HOTSPOT_SPAN,
+  ];
+
+  const getHotspotColor = (density: number) => {
+    if (density >= 6) return '#EF4444';
+    if (density >= 4) return '#F97316';
+    return '#F59E0B';
+  };
+
   const getRiskZoneRadius = (level: string) => {
     switch (level) {
       case 'good': return 200;
@@ -123,6 +137,26 @@ const MapPanel: React.FC = () => {
             </Circle>
           )}
 
+          {/* Density Hotspots */}
+          {riskData?.current.hotspots?.map((hotspot) => (
+            <Circle
+              key={`hotspot-${hotspot.row}-${hotspot.col}`}
+              center={hotspotPosition(hotspot.x, hotspot.y)}
+              radius={25 + hotspot.density * 5}
+              color={getHotspotColor(hotspot.density)}
+              fillColor={getHotspotColor(hotspot.density)}
+              fillOpacity={0.5}
+              weight={1}
+            >
+              <Popup>
+                <div>
+                  <strong>Hotspot</strong><br />
+                  Density: {hotspot.density.toFixed(1)} people/m²
+                </div>
+              </Popup>
+            </Circle>
+          ))}
+
           {/* Officers */}
           {safetyActions?.officers.map((officer) => (
             <Marker
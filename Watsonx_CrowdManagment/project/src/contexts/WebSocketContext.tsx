@@ -1,11 +1,22 @@
 import React, { createContext, useContext, useEffect, useState, ReactNode } from 'react';
 
+export interface Hotspot {
+  row: number;
+  col: number;
+  x: number;
+  y: number;
+  density: number;
+}
+
 interface RiskData {
   current: {
     level: string;
     category: string;
     confidence: number;
     detections: number;
+    density_per_sqm?: number;
+    peak_density?: number;
+    hotspots?: Hotspot[];
   };
   predictions: {
     next10min: { level: string; category: string; confidence: number };